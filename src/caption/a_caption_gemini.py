@@ -1,15 +1,13 @@
 import os
 import subprocess
 import json
-from google import genai
+import asyncio
 from google.genai import types
 from datetime import datetime
+from src.utils.llm_client import AsyncLLMClient
 
 print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>CLIENT>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n")
-client = genai.Client(
-    api_key=os.getenv('LLM_API_KEY'),
-    http_options=types.HttpOptions(base_url=os.getenv('LLM_BASE_URL'))
-)
+llm = AsyncLLMClient("gemini")
 
 category = "software_tutorials"
 model_name = "gemini_2"
@@ -70,17 +68,78 @@ def extract_audio_chunk(mp4_path, start, end, chunk_file):
         return None
     return chunk_file
 
-def log_token_usage(video_file, chunk_id, usage_metadata):
+def log_token_usage(video_file, chunk_id, usage):
     """把 token 消耗追加写入日志文件"""
     with open(token_log_path, "a", encoding="utf-8") as log_f:
         log_f.write(
             f"{datetime.now().isoformat()} | {video_file} | chunk {chunk_id} | "
-            f"prompt_tokens={usage_metadata.prompt_token_count}, "
-            f"candidates_tokens={usage_metadata.candidates_token_count}, "
-            f"total_tokens={usage_metadata.total_token_count}\n"
+            f"prompt_tokens={usage.get('prompt_tokens')}, "
+            f"candidates_tokens={usage.get('completion_tokens')}, "
+            f"total_tokens={usage.get('total_tokens')}\n"
         )
 
+async def caption_chunk(video_file, video_path, base_name, i, start, end):
+    print(f"正在处理 {video_file} 的 audio chunk {i}: {start} - {end}")
+
+    chunk_file = os.path.join(audio_tmp_dir, f"{base_name}_{i}.aac")
+    # ffmpeg 是阻塞调用，放到线程里，不阻塞其他请求
+    chunk_file = await asyncio.to_thread(extract_audio_chunk, video_path, start, end, chunk_file)
+
+    if not chunk_file:
+        print(f"[SKIP] Failed to extract audio chunk {i} of {video_file}")
+        return None
+
+    with open(chunk_file, "rb") as f:
+        audio_data = f.read()
+
+    response = await llm.generate_content(
+        model="gemini-2.0-flash",
+        contents=[
+            types.Content(parts=[
+                types.Part.from_bytes(
+                    data=audio_data,
+                    mime_type="audio/aac"
+                )
+            ]),
+            types.Part(text=AUDIO_PROMPT)
+        ]
+    )
+
+    # 保存 token 消耗日志
+    if response.usage:
+        log_token_usage(video_file, i, response.usage)
+
+    return {
+        "chunk_id": i,
+        "start": start,
+        "end": end,
+        "audio_caption": response.text.strip()
+    }
+
+
+async def caption_video(job):
+    video_file, video_path, chunk_json_path, audio_output_json = job
+    base_name = os.path.splitext(video_file)[0]
+    print(f"\n================= Processing {video_file} =================")
+
+    with open(chunk_json_path, "r", encoding="utf-8") as f:
+        chunk_info = json.load(f)
+    chunks = chunk_info.get("audio chunks", [])
+
+    # 同一视频的各个 chunk 并发请求，按 chunk 顺序收集结果
+    results = await asyncio.gather(*(
+        caption_chunk(video_file, video_path, base_name, i, start, end)
+        for i, (start, end) in enumerate(chunks)
+    ))
+    results = [r for r in results if r is not None]
+
+    with open(audio_output_json, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"✅ {video_file} 完成，结果已保存到 {audio_output_json}")
+
+
 # 遍历视频
+jobs = []
 for video_file in os.listdir(video_dir):
     if not video_file.endswith(".mp4"):
         continue
@@ -96,52 +155,7 @@ for video_file in os.listdir(video_dir):
     if not os.path.exists(chunk_json_path):
         print(f"[SKIP] Chunk json not found for {video_file}")
         continue
+    jobs.append((video_file, video_path, chunk_json_path, audio_output_json))
 
-    print(f"\n================= Processing {video_file} =================")
-
-    with open(chunk_json_path, "r", encoding="utf-8") as f:
-        chunk_info = json.load(f)
-    chunks = chunk_info.get("audio chunks", [])
-
-    results = []
-    for i, (start, end) in enumerate(chunks):
-        print(f"正在处理 {video_file} 的 audio chunk {i}: {start} - {end}")
-
-        chunk_file = os.path.join(audio_tmp_dir, f"{base_name}_{i}.aac")
-        chunk_file = extract_audio_chunk(video_path, start, end, chunk_file)
-
-        if not chunk_file:
-            print(f"[SKIP] Failed to extract audio chunk {i} of {video_file}")
-            continue
-
-        with open(chunk_file, "rb") as f:
-            audio_data = f.read()
-
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[
-                types.Content(parts=[
-                    types.Part.from_bytes(
-                        data=audio_data,
-                        mime_type="audio/aac"
-                    )
-                ]),
-                types.Part(text=AUDIO_PROMPT)
-            ]
-        )
-
-        caption = response.text.strip()
-        results.append({
-            "chunk_id": i,
-            "start": start,
-            "end": end,
-            "audio_caption": caption
-        })
-
-        # 保存 token 消耗日志
-        if hasattr(response, "usage_metadata"):
-            log_token_usage(video_file, i, response.usage_metadata)
-
-    with open(audio_output_json, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-    print(f"✅ {video_file} 完成，结果已保存到 {audio_output_json}")
+asyncio.run(llm.run_all(caption_video, jobs, desc="Audio caption"))
+print(f"API 调用统计: {llm.report()}")
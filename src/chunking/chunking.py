@@ -1,13 +1,14 @@
 import os
 import re
 import json
+import asyncio
 import torch
-from openai import OpenAI
 from src.chunking.chunk_test import SimpleScorer
 from src.chunking.chunk_utils import map_chunks_with_timestamps
+from src.utils.llm_client import AsyncLLMClient
 from filter import check_video_quality
 
-client = OpenAI()
+llm = AsyncLLMClient("openai")
 
 # ------------------------
 # 阶段1 Prompt
@@ -74,14 +75,14 @@ Output:
 # ------------------------
 # 阶段1：估算语义块数量 + 小标题
 # ------------------------
-def estimate_chunks_and_titles(text: str):
+async def estimate_chunks_and_titles(text: str):
     prompt = SEGMENT_COUNT_PROMPT.format(text=text)
-    resp = client.chat.completions.create(
+    resp = await llm.chat_completion(
         model="gpt-4o",
         messages=[{"role": "system", "content": prompt}],
         temperature=0
     )
-    output = resp.choices[0].message.content.strip()
+    output = resp.text.strip()
     #print("=== 阶段1 输出 ===")
     #print(output)
 
@@ -103,9 +104,9 @@ def estimate_chunks_and_titles(text: str):
 # ------------------------
 # 阶段2：边界检测
 # ------------------------
-def detect_borders(text: str, topic_count: int, titles: list):
+async def detect_borders(text: str, topic_count: int, titles: list):
     if topic_count == 1:
-        return []
+        return [], ""
 
     boundary_count = topic_count - 1
     titles_str = "\n".join([f"{i+1}. {t}" for i, t in enumerate(titles)])
@@ -115,12 +116,12 @@ def detect_borders(text: str, topic_count: int, titles: list):
         boundary_count=boundary_count,
         titles=titles_str
     )
-    resp = client.chat.completions.create(
+    resp = await llm.chat_completion(
         model="gpt-4o",
         messages=[{"role": "system", "content": prompt}],
         temperature=0
     )
-    output = resp.choices[0].message.content.strip()
+    output = resp.text.strip()
     #print("=== 阶段2 输出 ===")
     #print(output)
     # 提取 borders
@@ -132,7 +133,7 @@ def detect_borders(text: str, topic_count: int, titles: list):
 # ------------------------
 # 主流程
 # ------------------------
-def process_metadata(metadata_path: str, output_path: str, log_file: str):
+async def process_metadata(metadata_path: str, output_path: str, log_file: str):
     # 如果已存在结果文件，跳过
     if os.path.exists(output_path):
         print(f"[跳过] {output_path} 已存在")
@@ -154,11 +155,11 @@ def process_metadata(metadata_path: str, output_path: str, log_file: str):
     full_text = "".join([seg["text"] for seg in transcript])
 
     # 阶段1
-    topic_count, titles = estimate_chunks_and_titles(full_text)
+    topic_count, titles = await estimate_chunks_and_titles(full_text)
 
     # 阶段2
     # borders = detect_borders(full_text, topic_count, titles)
-    borders, raw_boundary_output = detect_borders(full_text, topic_count, titles)
+    borders, raw_boundary_output = await detect_borders(full_text, topic_count, titles)
 
     # # 分块 & 映射时间戳
     # chunks = map_chunks_with_timestamps(transcript, borders)
@@ -204,8 +205,9 @@ if __name__ == "__main__":
     metadata_root = "./datasets/finevideo/metadata"
     output_root = "./datasets/finevideo/chunking"
 
-    total_generated = 0
-
+    # 先收集所有类别的待处理文件，再统一并发调用
+    jobs = []
+    categories = []
     # 遍历 metadata_root 下的所有子文件夹
     for category in os.listdir(metadata_root):
         category_path = os.path.join(metadata_root, category)
@@ -213,27 +215,36 @@ if __name__ == "__main__":
             continue  # 跳过非文件夹
         # if category in ["camping", "expert_interviews", "physics"]:
         #     continue
-        
-        print(f"\n===== 正在处理类别: {category} =====")
+        categories.append(category)
 
         # 输出目录 & 日志文件
         output_category = os.path.join(output_root, category)
         os.makedirs(output_category, exist_ok=True)
         log_file = os.path.join(output_category, "skipped.log")
 
-        generated_count = 0
         for filename in os.listdir(category_path):
             if filename.endswith(".json") and filename.startswith("sample_"):
                 idx = filename.split("_")[1].split(".")[0]
                 metadata_path = os.path.join(category_path, filename)
                 output_path = os.path.join(output_category, f"sample_{idx}.json")
-                success = process_metadata(metadata_path, output_path, log_file)
-                if success:
-                    generated_count += 1
+                jobs.append((category, metadata_path, output_path, log_file))
+
+    generated_counts = {category: 0 for category in categories}
+
+    async def run_job(job):
+        category, metadata_path, output_path, log_file = job
+        success = await process_metadata(metadata_path, output_path, log_file)
+        if success:
+            generated_counts[category] += 1
+
+    print(f"\n===== 共 {len(categories)} 个类别，{len(jobs)} 个文件，最多 {llm.max_concurrency} 个请求并发 =====")
+    asyncio.run(llm.run_all(run_job, jobs, desc="Chunking"))
 
-        total_generated += generated_count
-        print(f"[{category}] 生成了 {generated_count} 个新文件")
+    for category in categories:
+        log_file = os.path.join(output_root, category, "skipped.log")
+        print(f"[{category}] 生成了 {generated_counts[category]} 个新文件")
         print(f"[{category}] 跳过的文件日志已保存到: {log_file}")
 
     print("\n===== 全部处理完成 =====")
-    print(f"总共生成了 {total_generated} 个新文件")
+    print(f"总共生成了 {sum(generated_counts.values())} 个新文件")
+    print(f"API 调用统计: {llm.report()}")
@@ -1,9 +1,11 @@
 import os
 import json
-from openai import OpenAI
-from tqdm import tqdm
+import asyncio
+from src.utils.event_index import EventIndex
+from src.utils.llm_client import AsyncLLMClient
+from src.utils.llm_batch import BatchJob
 
-client = OpenAI()
+llm = AsyncLLMClient("openai")
 
 SYSTEM_PROMPT = """
 You are an evaluator for long audiovisual QA. 
@@ -47,6 +49,10 @@ current_task = "3audio_visual_alignment"
 qa_file = f"./qa_alm_filtered/{current_task}.json"
 event_root = f"./event_lists"
 output_file = f"./qa_scored/{current_task}.json"
+event_index = EventIndex(event_root=event_root)
+# 运行模式: "interactive" 逐条并发调用；"batch" 走 Batch API（几万条评分请求时更省）
+run_mode = os.getenv("RUN_MODE", "interactive")
+batch_backend = os.getenv("BATCH_BACKEND", "openai")  # "local" 为本地替身，无需联网即可跑通
 os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
 # 读取QA数据
@@ -65,51 +71,44 @@ if os.path.exists(output_file):
             print("⚠️ 输出文件损坏，重新开始评分")
 
 def load_event_clip(category, idx, required_event_ids):
-    path = os.path.join(event_root, category, f"sample_{idx}.json")
-    with open(path, "r", encoding="utf-8") as f:
-        event_json = json.load(f)
-
-    results = []
-    for ev in event_json.get("events_list", []):
-        if ev.get("event_id") in required_event_ids:
-            results.append({
-                "video_caption": ev.get("video_caption", ""),
-                "audio_caption": ev.get("audio_caption", "")
-            })
-    return results
-
-def judge_with_gpt(video_caption, audio_caption, qa):
+    # 同一视频的多个 QA 共用一次解析结果
+    return event_index.get_events(f"{category}_{idx}", required_event_ids)
+
+def build_judge_request(video_caption, audio_caption, qa):
     prompt = USER_PROMPT.format(
         video_caption=video_caption,
         audio_caption=audio_caption,
         qa=json.dumps(qa, ensure_ascii=False)
     )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={
+    return {
+        "model": "gpt-4o",
+        "response_format": {
             "type": "json_schema",
             "json_schema": {
                 "name": "score_schema",
                 "schema": SCORE_JSON_SCHEMA
             }
         },
-        messages=[
+        "messages": [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ]
-    )
-    result = json.loads(response.choices[0].message.content)
+    }
+
+def parse_judgement(text):
+    result = json.loads(text)
     result["overall"] = round(
         (result["sufficiency"] + result["consistency"] + result["relevance"]) / 3, 3
     )
     return result
 
-# 逐个处理
-for qa in tqdm(qa_data, desc="Scoring QA pairs"):
-    qid = qa["question_id"]
-    if qid in scored_data:
-        continue  # 跳过已评分
+async def judge_with_gpt(video_caption, audio_caption, qa):
+    # 解析失败的回复不进缓存，下次运行会重新请求
+    response = await llm.chat_completion(**build_judge_request(video_caption, audio_caption, qa),
+                                         validate=parse_judgement)
+    return parse_judgement(response.text)
 
+def qa_inputs(qa):
     videoID = qa["related_videoID"]
     parts = videoID.split("_")
     category = "_".join(parts[:-1])
@@ -120,17 +119,47 @@ for qa in tqdm(qa_data, desc="Scoring QA pairs"):
     video_caption = " ".join([c["video_caption"] for c in clips])
     audio_caption = " ".join([c["audio_caption"] for c in clips])
 
-    qa["judgement"] = judge_with_gpt(video_caption, audio_caption, {
+    return video_caption, audio_caption, {
         "question": qa["question"],
         "options": qa["options"],
         "answer": qa.get("answer", []),
         "reasoning": qa.get("gold_reasoning", "")
-    })
-
-    scored_data[qid] = qa
+    }
 
-    # 每个评分完就写入文件
+def save_scored():
     with open(output_file, "w", encoding="utf-8") as f:
         json.dump(list(scored_data.values()), f, ensure_ascii=False, indent=2)
 
+# 单条QA评分
+async def score_qa(qa):
+    qa["judgement"] = await judge_with_gpt(*qa_inputs(qa))
+    scored_data[qa["question_id"]] = qa
+
+    # 每个评分完就写入文件（事件循环单线程，写入不会交错）
+    save_scored()
+
+# 跳过已评分，其余并发处理
+pending = [qa for qa in qa_data if qa["question_id"] not in scored_data]
+if run_mode == "batch":
+    job = BatchJob(f"./batch_jobs/score/{current_task}", backend=batch_backend, cache=llm.cache)
+    requests = {qa["question_id"]: build_judge_request(*qa_inputs(qa)) for qa in pending}
+    results = job.run(requests)
+    # 写回与交互模式相同的输出文件；解析失败的结果丢弃，下次运行重新提交
+    bad_ids = []
+    for qa in pending:
+        if qa["question_id"] in results:
+            try:
+                qa["judgement"] = parse_judgement(results[qa["question_id"]])
+            except Exception as e:
+                print(f"⚠️ 结果解析失败，跳过 {qa['question_id']}: {e!r}")
+                bad_ids.append(qa["question_id"])
+                continue
+            scored_data[qa["question_id"]] = qa
+    job.discard(bad_ids, requests)
+    save_scored()
+else:
+    asyncio.run(llm.run_all(score_qa, pending, desc="Scoring QA pairs"))
+    print(f"API 调用统计: {llm.report()}")
+
+print(f"📦 event list 缓存: {event_index.cache_info()}")
 print(f"✅ 已完成评分，共 {len(scored_data)} 条，保存到 {output_file}")
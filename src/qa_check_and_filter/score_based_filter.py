@@ -1,5 +1,8 @@
+import os
+import csv
 import json
 import argparse
+import numpy as np
 
 def filter_scored_json(input_file, output_file, sub_threshold, overall_threshold):
     # 读取打分后的json
@@ -23,13 +26,103 @@ def filter_scored_json(input_file, output_file, sub_threshold, overall_threshold
     print(f"✅ 筛选后剩余 {len(filtered)} 条，结果已保存到 {output_file}")
 
 
+def load_score_matrix(input_files):
+    """
+    把多个打分后的json一次性读成数组:
+    min_sub: (N,) 每条QA所有小分的最小值（没有小分时为 +inf，与 all([]) 为 True 保持一致）
+    overall: (N,)
+    tasks / categories: (N,) 字符串，task 取文件名，category 取 related_videoID 去掉末尾序号
+    """
+    min_sub, overall, tasks, categories = [], [], [], []
+    for input_file in input_files:
+        task = os.path.splitext(os.path.basename(input_file))[0]
+        with open(input_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for qa in data:
+            scores = qa.get("judgement", {})
+            subs = [v for k, v in scores.items() if k != "overall"]
+            min_sub.append(min(subs) if subs else np.inf)
+            overall.append(scores.get("overall", 0.0))
+            tasks.append(task)
+            categories.append(qa.get("related_videoID", "unknown_0").rsplit("_", 1)[0])
+    return (np.asarray(min_sub, dtype=np.float64), np.asarray(overall, dtype=np.float64),
+            np.asarray(tasks), np.asarray(categories))
+
+
+def sweep_thresholds(min_sub, overall, group_ids, n_groups, sub_grid, overall_grid):
+    """
+    一次向量化计算所有 (sub_th, overall_th) 组合下每个分组保留的条数
+    返回 (n_groups, len(sub_grid), len(overall_grid)) 的整数数组
+    """
+    sub_ok = min_sub[:, None] >= sub_grid[None, :]            # (N, S)
+    overall_ok = overall[:, None] >= overall_grid[None, :]    # (N, O)
+    keep = sub_ok[:, :, None] & overall_ok[:, None, :]        # (N, S, O)
+
+    # one-hot 分组矩阵 (G, N) 与 keep 相乘，得到每组的保留数
+    onehot = np.zeros((n_groups, len(min_sub)), dtype=np.int64)
+    onehot[group_ids, np.arange(len(min_sub))] = 1
+    counts = onehot @ keep.reshape(len(min_sub), -1).astype(np.int64)
+    return counts.reshape(n_groups, len(sub_grid), len(overall_grid))
+
+
+def parse_grid(spec):
+    """"0.5:1.0:0.05" -> [0.5, 0.55, ..., 1.0]；"0.8,0.9,0.95" -> [0.8, 0.9, 0.95]"""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 6)
+    return np.asarray([float(x) for x in spec.split(",")])
+
+
+def sweep_scored_json(input_files, output_csv, sub_grid, overall_grid):
+    min_sub, overall, tasks, categories = load_score_matrix(input_files)
+
+    # 分组：(task, category)、(task, ALL)、(ALL, category)、(ALL, ALL)
+    keys = []
+    key_index = {}
+    group_rows = [[] for _ in range(len(min_sub))]
+    for i, (task, category) in enumerate(zip(tasks, categories)):
+        for key in ((task, category), (task, "ALL"), ("ALL", category), ("ALL", "ALL")):
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            group_rows[i].append(key_index[key])
+
+    # 每条QA属于4个分组，展开后一次性计算
+    rows = np.repeat(np.arange(len(min_sub)), 4)
+    group_ids = np.asarray(group_rows, dtype=np.int64).reshape(-1)
+    counts = sweep_thresholds(min_sub[rows], overall[rows], group_ids, len(keys), sub_grid, overall_grid)
+    totals = np.bincount(group_ids, minlength=len(keys))
+
+    os.makedirs(os.path.dirname(output_csv) or ".", exist_ok=True)
+    with open(output_csv, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["task", "category", "sub_th", "overall_th", "retained", "total", "retained_ratio"])
+        for g in sorted(range(len(keys)), key=lambda g: keys[g]):
+            task, category = keys[g]
+            for s, sub_th in enumerate(sub_grid):
+                for o, overall_th in enumerate(overall_grid):
+                    retained = int(counts[g, s, o])
+                    writer.writerow([task, category, f"{sub_th:g}", f"{overall_th:g}", retained, int(totals[g]),
+                                     f"{retained / totals[g]:.4f}" if totals[g] else "0"])
+
+    print(f"✅ 共 {len(min_sub)} 条QA，{len(keys)} 个分组，"
+          f"{len(sub_grid)}x{len(overall_grid)} 个阈值组合，结果已保存到 {output_csv}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", required=True, help="输入打分后的json文件路径")
-    parser.add_argument("--output", required=True, help="输出筛选后的json文件路径")
+    parser.add_argument("--input", required=True, nargs="+", help="输入打分后的json文件路径（--sweep 时可传多个任务文件）")
+    parser.add_argument("--output", required=True, help="输出筛选后的json文件路径（--sweep 时为csv路径）")
     parser.add_argument("--sub-th", type=float, default=0.95, help="小分阈值")
     parser.add_argument("--overall-th", type=float, default=0.9, help="overall阈值")
+    parser.add_argument("--sweep", action="store_true", help="扫描阈值网格，按任务/类别输出保留条数csv")
+    parser.add_argument("--sub-grid", default="0.5:1.0:0.05", help="小分阈值网格，start:stop:step 或逗号分隔")
+    parser.add_argument("--overall-grid", default="0.5:1.0:0.05", help="overall阈值网格，start:stop:step 或逗号分隔")
     args = parser.parse_args()
 
-    filter_scored_json(args.input, args.output, args.sub_th, args.overall_th)
-
+    if args.sweep:
+        sweep_scored_json(args.input, args.output, parse_grid(args.sub_grid), parse_grid(args.overall_grid))
+    else:
+        if len(args.input) != 1:
+            parser.error("非 --sweep 模式只接受一个 --input 文件")
+        filter_scored_json(args.input[0], args.output, args.sub_th, args.overall_th)
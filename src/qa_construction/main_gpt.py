@@ -1,7 +1,8 @@
 import os
 import json
-from tqdm import tqdm
-from openai import OpenAI
+import asyncio
+from src.utils.llm_client import AsyncLLMClient
+from src.utils.llm_batch import BatchJob
 from prompts_gpt import (
     QUESTION_JSON_SCHEMA,
     SYSTEM_PROMPT,
@@ -16,7 +17,7 @@ from prompts_gpt import (
 # =====================
 # 初始化
 # =====================
-client = OpenAI()
+llm = AsyncLLMClient("openai")
 
 # =============================
 # 配置任务类型和对应的Prompt
@@ -24,6 +25,10 @@ client = OpenAI()
 current_task = "timeline_reconstruction"  # "intra_event_reasoning"
 categories = ["software_tutorials"] #cross
 
+# 运行模式: "interactive" 逐条并发调用；"batch" 走 Batch API（大批量、不要求时延时更省）
+run_mode = os.getenv("RUN_MODE", "interactive")
+batch_backend = os.getenv("BATCH_BACKEND", "openai")  # "local" 为本地替身，无需联网即可跑通
+
 TASK_PROMPTS = {
     "intra_event_reasoning": INTRA_EVENT_REASONING_USER_PROMPT,
     "multimodal_temporal_localization": MULTIMODAL_TEMPORAL_LOCALIZATION_USER_PROMPT,
@@ -37,9 +42,61 @@ SELECTED_USER_PROMPT_TEMPLATE = TASK_PROMPTS.get(current_task)
 if SELECTED_USER_PROMPT_TEMPLATE is None:
     raise ValueError(f"Unknown task: {current_task}. Please define its prompt template.")
 
+# =============================
+# 单个样本：构建Prompt -> 请求体
+# =============================
+def build_request(input_path):
+    # 读取输入
+    with open(input_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    video_id = data["video_id"]
+    summary = data["summary"]
+    events_list = data["events_list"]
+    events_str = json.dumps(events_list, ensure_ascii=False, indent=2)
+
+    # 构建USER_PROMPT
+    USER_PROMPT = SELECTED_USER_PROMPT_TEMPLATE.format(
+        video_id=video_id,
+        summary=summary,
+        events_str=events_str
+    )
+
+    return {
+        "model": "gpt-4o",
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "questions_schema",
+                "schema": QUESTION_JSON_SCHEMA
+            }
+        },
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": USER_PROMPT}
+        ]
+    }
+
+
+def save_result(output_json_path, result):
+    result_json = json.loads(result)  # 把字符串解析成 dict
+    with open(output_json_path, "w", encoding="utf-8") as f:
+        json.dump(result_json, f, ensure_ascii=False, indent=2)
+
+
+async def process_sample(job):
+    input_path, output_json_path = job
+    # 模型推理
+    response = await llm.chat_completion(**build_request(input_path), validate=json.loads)
+    # 保存结果
+    save_result(output_json_path, response.text)
+
+
 # =============================
 # 遍历多个类别
 # =============================
+batch_requests = {}
+batch_outputs = {}
 for category in categories:
     print(f"🚀 开始处理类别: {category}")
 
@@ -51,7 +108,8 @@ for category in categories:
     # 遍历所有文件
     input_files = sorted([f for f in os.listdir(input_dir) if f.endswith(".json")])
 
-    for fname in tqdm(input_files, desc=f"[{category}] Processing samples"):
+    jobs = []
+    for fname in input_files:
         sample_id = os.path.splitext(fname)[0]  # e.g. "sample_1"
         input_path = os.path.join(input_dir, fname)
         output_json_path = os.path.join(output_dir, f"{sample_id}.json")
@@ -59,45 +117,33 @@ for category in categories:
         # 断点续跑
         if os.path.exists(output_json_path):
             continue
-
-        # 读取输入
-        with open(input_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        video_id = data["video_id"]
-        summary = data["summary"]
-        events_list = data["events_list"]
-        events_str = json.dumps(events_list, ensure_ascii=False, indent=2)
-
-        # 构建USER_PROMPT
-        USER_PROMPT = SELECTED_USER_PROMPT_TEMPLATE.format(
-            video_id=video_id,
-            summary=summary,
-            events_str=events_str
-        )
-
-        # 模型推理
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "questions_schema",
-                    "schema": QUESTION_JSON_SCHEMA
-                }
-            },
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": USER_PROMPT}
-            ]
-        )
-
-        # 保存结果
-        result = response.choices[0].message.content
-        result_json = json.loads(result)  # 把字符串解析成 dict
-        with open(output_json_path, "w", encoding="utf-8") as f:
-            json.dump(result_json, f, ensure_ascii=False, indent=2)
-
-        print(f"✅ 已保存到 {output_json_path}")
-
-    print(f"🎉 类别 {category} 处理完成！")
+        jobs.append((input_path, output_json_path))
+
+    if run_mode == "batch":
+        # 先收集所有类别的请求，统一提交
+        for input_path, output_json_path in jobs:
+            custom_id = f"{category}/{os.path.splitext(os.path.basename(input_path))[0]}"
+            batch_requests[custom_id] = build_request(input_path)
+            batch_outputs[custom_id] = output_json_path
+        continue
+
+    # 并发调用，单个样本失败不影响其他样本，下次运行会重新处理
+    failed = asyncio.run(llm.run_all(process_sample, jobs, desc=f"[{category}] Processing samples"))
+
+    print(f"🎉 类别 {category} 处理完成！新生成 {len(jobs) - len(failed)} 个，失败 {len(failed)} 个")
+
+if run_mode == "batch":
+    job = BatchJob(f"./batch_jobs/main_gpt/{current_task}", backend=batch_backend, cache=llm.cache)
+    results = job.run(batch_requests)
+    # 写回与交互模式相同的逐样本输出；解析失败的结果丢弃，下次运行重新提交
+    bad_ids = []
+    for custom_id, result in results.items():
+        try:
+            save_result(batch_outputs[custom_id], result)
+        except Exception as e:
+            print(f"⚠️ 结果解析失败，跳过 {custom_id}: {e!r}")
+            bad_ids.append(custom_id)
+    job.discard(bad_ids, batch_requests)
+    print(f"🎉 batch 模式完成！新生成 {len(results) - len(bad_ids)} 个，未完成 {len(batch_requests) - len(results) + len(bad_ids)} 个")
+else:
+    print(f"API 调用统计: {llm.report()}")
@@ -1,16 +1,14 @@
-from google import genai
 from google.genai import types
 import os
 import json
-from tqdm import tqdm
+import asyncio
 from pydantic import BaseModel
 import base64
 import ffmpeg
+from src.utils.event_index import EventIndex, concat_captions
+from src.utils.llm_client import AsyncLLMClient
 
-client = genai.Client(
-    api_key=os.getenv('LLM_API_KEY'),
-    http_options=types.HttpOptions(base_url=os.getenv('LLM_BASE_URL'))
-)
+llm = AsyncLLMClient("gemini")
 
 USER_PROMPT = """
 You are an expert in long video understanding. Always base your answers strictly on the video content.
@@ -28,15 +26,11 @@ class Recipe(BaseModel):
     model_reason: str
 
 # ========== 工具函数 ==========
-def concat_video_caption(v_caption_file):
+def concat_video_caption(events):
     """
-    拼接整个 JSON 文件里所有的 video_caption 文本
+    拼接该视频所有段落的 video_caption 文本
     """
-    captions = [seg.get("video_caption", "") for seg in v_caption_file if isinstance(seg, dict)]
-
-    # 过滤空白，拼接
-    captions = [c.strip() for c in captions if c and c.strip()]
-    return " ".join(captions)
+    return concat_captions(events, "video_caption")
 
 def preprocess_audio_for_gemini(
     audio_path: str,   
@@ -94,12 +88,15 @@ def preprocess_audio_for_gemini(
 current_tasks = ["1intra_event_reasoning", "2multimodal_temporal_localization", "3audio_visual_alignment", 
                  "4timeline_reconstruction", "5topic_stance_evolution_summarization", "6cross_event_causality"]
 
+VIDEO_CAPTION_ROOT = "./caption_result/v_caption(ovis)"
+# 6 个任务共享同一个字幕索引，每个视频的字幕只解析一次
+caption_index = EventIndex(video_caption_root=VIDEO_CAPTION_ROOT)
+
 for current_task in current_tasks:
     print(f"===== 处理任务: {current_task} =====")
 
     INPUT_FILE = f"./final_qa_subset/{current_task}.json"
     OUTPUT_FILE = f"/./experiment_subset/gemini2.5/{current_task}.json"
-    VIDEO_CAPTION_ROOT = "./caption_result/v_caption(ovis)"
     AUDIO_ROOT = "./datasets/finevideo/audios"
     TMP_FILE = f"./experiment_subset/gemini2.5/tmp.json"
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
@@ -122,10 +119,10 @@ for current_task in current_tasks:
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
         qa_data = json.load(f)
 
-    for qa in tqdm(qa_data, desc="QA 推理"):
+    async def answer_qa(qa):
         qid = qa.get("question_id")
         if qid in results:
-            continue  # 已有结果 -> 跳过
+            return  # 已有结果 -> 跳过
 
         question = qa.get("question", "")
         options = qa.get("options", "")
@@ -138,15 +135,13 @@ for current_task in current_tasks:
             v_caption_path = os.path.join(VIDEO_CAPTION_ROOT, category, f"sample_{idx}.json")
         except Exception as e:
             print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-            continue
+            return
         if not os.path.exists(audio_path):
             print(f"⚠️ 音频不存在: {audio_path}, 跳过。")
-            continue
+            return
 
         # 读取并拼接 video caption 段落
-        with open(v_caption_path, "r", encoding="utf-8") as f:
-            v_caption_file = json.load(f)
-        v_caption = concat_video_caption(v_caption_file)
+        v_caption = concat_video_caption(caption_index.get_events(video_id))
         if not v_caption:
             # 如果拼接后为空，也可以继续，但给个警告
             print(f"⚠️ {v_caption_path} 的视频字幕拼接结果为空（qid={qid}）")
@@ -155,17 +150,18 @@ for current_task in current_tasks:
         #     audio_data = f.read()
         # 预处理视频和音频
         try:
-            audio_data = preprocess_audio_for_gemini(
+            audio_data = await asyncio.to_thread(
+                preprocess_audio_for_gemini,
                 audio_path,
                 audio_bitrate="64k",    # 更低的音频码率
                 max_file_size_mb=10     # 留点余量
             )
         except Exception as e:
             print(f"⚠️ 视频/音频预处理失败，跳过 {qid}。异常: {e}")
-            continue
+            return
 
         # 调用模型
-        response = client.models.generate_content(
+        response = await llm.generate_content(
             model="gemini-2.5-flash",
             contents=[
                 types.Content(parts=[
@@ -201,6 +197,9 @@ for current_task in current_tasks:
         with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
 
+    asyncio.run(llm.run_all(answer_qa, qa_data, desc="QA 推理"))
+    print(f"📦 字幕缓存: {caption_index.cache_info()}")
+    print(f"API 调用统计: {llm.report()}")
     print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
 
 
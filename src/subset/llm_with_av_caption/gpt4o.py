@@ -1,11 +1,12 @@
 import os
 import json
-from tqdm import tqdm
-from openai import OpenAI
+import asyncio
 import base64
 import cv2
+from src.utils.event_index import EventIndex, concat_captions
+from src.utils.llm_client import AsyncLLMClient
 
-client = OpenAI()
+llm = AsyncLLMClient("openai")
 
 SYSTEM_PROMPT = "You are an expert in long video understanding. Always base your answers strictly on the video content."
 
@@ -37,38 +38,33 @@ JSON_SCHEMA = {
 }
 
 # ========== 工具函数 ==========
-def concat_video_caption(v_caption_file):
+def concat_video_caption(events):
     """
-    拼接整个 JSON 文件里所有的 video_caption 文本
+    拼接该视频所有段落的 video_caption 文本
     """
-    captions = [seg.get("video_caption", "") for seg in v_caption_file if isinstance(seg, dict)]
+    return concat_captions(events, "video_caption")
 
-    # 过滤空白，拼接
-    captions = [c.strip() for c in captions if c and c.strip()]
-    return " ".join(captions)
-
-def concat_audio_caption(a_caption_file):
+def concat_audio_caption(events):
     """
-    拼接整个 JSON 文件里所有的 audio_caption 文本
+    拼接该视频所有段落的 audio_caption 文本
     """
-    captions = [seg.get("audio_caption", "") for seg in a_caption_file if isinstance(seg, dict)]
-
-    # 过滤空白，拼接
-    captions = [c.strip() for c in captions if c and c.strip()]
-    return " ".join(captions)
+    return concat_captions(events, "audio_caption")
 
 
 # 文件路径
 current_tasks = ["1intra_event_reasoning", "2multimodal_temporal_localization", "3audio_visual_alignment", 
                  "4timeline_reconstruction", "5topic_stance_evolution_summarization", "6cross_event_causality"]
 
+VIDEO_CAPTION_ROOT = "./caption_result_0907/v_caption(ovis)"
+AUDIO_CAPTION_ROOT = "./caption_result_0907/a_caption(gemini2)"
+# 6 个任务共享同一个字幕索引，每个视频的字幕只解析一次
+caption_index = EventIndex(video_caption_root=VIDEO_CAPTION_ROOT, audio_caption_root=AUDIO_CAPTION_ROOT)
+
 for current_task in current_tasks:
     print(f"===== 处理任务: {current_task} =====")
 
     INPUT_FILE = f"./final_qa_subset/{current_task}.json"
     OUTPUT_FILE = f"./experiment_subset/gpt4o_text/{current_task}.json"
-    VIDEO_CAPTION_ROOT = "./caption_result_0907/v_caption(ovis)"
-    AUDIO_CAPTION_ROOT = "./caption_result_0907/a_caption(gemini2)"
     VIDEO_ROOT = "./datasets/finevideo/videos"
     TMP_FILE = f"./experiment_subset/gpt4o_text/tmp.json"
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
@@ -91,10 +87,10 @@ for current_task in current_tasks:
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
         qa_data = json.load(f)
 
-    for qa in tqdm(qa_data, desc="QA 推理"):
+    async def answer_qa(qa):
         qid = qa.get("question_id")
         if qid in results:
-            continue  # 已有结果 -> 跳过
+            return  # 已有结果 -> 跳过
 
         question = qa.get("question", "")
         options = qa.get("options", "")
@@ -108,32 +104,29 @@ for current_task in current_tasks:
             a_caption_path = os.path.join(AUDIO_CAPTION_ROOT, category, f"sample_{idx}.json")
         except Exception as e:
             print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-            continue
+            return
         if not os.path.exists(video_path):
             print(f"⚠️ 视频不存在: {video_path}, 跳过。")
-            continue
+            return
         if not os.path.exists(a_caption_path):
             print(f"⚠️ 音频字幕不存在: {a_caption_path}, 跳过。")
-            continue
+            return
 
         # 读取并拼接 video caption 段落
-        with open(v_caption_path, "r", encoding="utf-8") as f:
-            v_caption_file = json.load(f)
-        v_caption = concat_video_caption(v_caption_file)
+        caption_events = caption_index.get_events(video_id)
+        v_caption = concat_video_caption(caption_events)
         if not v_caption:
             # 如果拼接后为空，也可以继续，但给个警告
             print(f"⚠️ {v_caption_path} 的视频字幕拼接结果为空（qid={qid}）")
 
         # 读取并拼接 audio caption 段落
-        with open(a_caption_path, "r", encoding="utf-8") as f:
-            a_caption_file = json.load(f)
-        a_caption = concat_audio_caption(a_caption_file)
+        a_caption = concat_audio_caption(caption_events)
         if not a_caption:
             # 如果拼接后为空，也可以继续，但给个警告
             print(f"⚠️ {a_caption_path} 的音频字幕拼接结果为空（qid={qid}）")
 
         # 调用模型
-        response = client.chat.completions.create(
+        response = await llm.chat_completion(
             model="gpt-4o",
             response_format={
                 "type": "json_schema",
@@ -154,7 +147,7 @@ for current_task in current_tasks:
         )
 
         # ====== 临时保存 tmp.json ======
-        result = response.choices[0].message.content
+        result = response.text
         result_json = json.loads(result)  # dict
         with open(TMP_FILE, "w", encoding="utf-8") as f:
             json.dump(result_json, f, ensure_ascii=False, indent=2)
@@ -172,6 +165,9 @@ for current_task in current_tasks:
         with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
 
+    asyncio.run(llm.run_all(answer_qa, qa_data, desc="QA 推理"))
+    print(f"📦 字幕缓存: {caption_index.cache_info()}")
+    print(f"API 调用统计: {llm.report()}")
     print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
 
 
@@ -1,17 +1,15 @@
-from google import genai
 from google.genai import types
 import os
 import subprocess
 import json
-from tqdm import tqdm
+import asyncio
 from pydantic import BaseModel
 import base64
 import ffmpeg
+from src.utils.event_index import EventIndex, concat_captions
+from src.utils.llm_client import AsyncLLMClient
 
-client = genai.Client(
-    api_key=os.getenv('LLM_API_KEY'),
-    http_options=types.HttpOptions(base_url=os.getenv('LLM_BASE_URL'))
-)
+llm = AsyncLLMClient("gemini")
 
 USER_PROMPT = """
 You are an expert in long video understanding. Always base your answers strictly on the video content.
@@ -29,15 +27,11 @@ class Recipe(BaseModel):
     model_reason: str
 
 # ========== 工具函数 ==========
-def concat_audio_caption(a_caption_file):
+def concat_audio_caption(events):
     """
-    拼接整个 JSON 文件里所有的 audio_caption 文本
+    拼接该视频所有段落的 audio_caption 文本
     """
-    captions = [seg.get("audio_caption", "") for seg in a_caption_file if isinstance(seg, dict)]
-
-    # 过滤空白，拼接
-    captions = [c.strip() for c in captions if c and c.strip()]
-    return " ".join(captions)
+    return concat_captions(events, "audio_caption")
 
 def preprocess_video_for_gemini(
     video_path: str,
@@ -101,13 +95,16 @@ def preprocess_video_for_gemini(
 current_tasks = ["1intra_event_reasoning", "2multimodal_temporal_localization", "3audio_visual_alignment", 
                  "4timeline_reconstruction", "5topic_stance_evolution_summarization", "6cross_event_causality"]
 
+AUDIO_CAPTION_ROOT = "./caption_result/a_caption(gemini2)"
+# 6 个任务共享同一个字幕索引，每个视频的字幕只解析一次
+caption_index = EventIndex(audio_caption_root=AUDIO_CAPTION_ROOT)
+
 for current_task in current_tasks:
     print(f"===== 处理任务: {current_task} =====")
     
     INPUT_FILE = f"./final_qa_subset/{current_task}.json"
     OUTPUT_FILE = f"./experiment_subset/gemini2.5flash_vlm/{current_task}.json"
     VIDEO_ROOT = "./datasets/finevideo/videos"
-    AUDIO_CAPTION_ROOT = "./caption_result/a_caption(gemini2)"
     TMP_FILE = f"./experiment_subset/gemini2.5flash_vlm/tmp.json"
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
 
@@ -122,13 +119,13 @@ for current_task in current_tasks:
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
         qa_data = json.load(f)
 
-    for qa in tqdm(qa_data):
+    async def answer_qa(qa):
         qid = qa["question_id"]
         question = qa["question"]
         video_id = qa["related_videoID"]
         options = qa.get("options", "")
         if qid in results:
-            continue
+            return
 
         try:
             category, idx = video_id.rsplit("_", 1)
@@ -136,13 +133,14 @@ for current_task in current_tasks:
             a_caption_path = os.path.join(AUDIO_CAPTION_ROOT, category, f"sample_{idx}.json")
         except Exception as e:
             print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-            continue
+            return
 
         print("Processing video:", video_id)
 
         # 预处理视频
         try:
-            video_data = preprocess_video_for_gemini(
+            video_data = await asyncio.to_thread(
+                preprocess_video_for_gemini,
                 video_path,
                 output_size="480x270",  # 尝试更低的分辨率
                 output_fps=1,
@@ -151,18 +149,16 @@ for current_task in current_tasks:
             )
         except Exception as e:
             print(f"⚠️ 视频/音频预处理失败，跳过 {qid}。异常: {e}")
-            continue
+            return
 
         # 读取并拼接 audio caption 段落
-        with open(a_caption_path, "r", encoding="utf-8") as f:
-            a_caption_file = json.load(f)
-        a_caption = concat_audio_caption(a_caption_file)
+        a_caption = concat_audio_caption(caption_index.get_events(video_id))
         if not a_caption:
             # 如果拼接后为空，也可以继续，但给个警告
             print(f"⚠️ {a_caption_path} 的音频字幕拼接结果为空（qid={qid}）")
         
         # 调用模型
-        response = client.models.generate_content(
+        response = await llm.generate_content(
             model="gemini-2.5-flash",
             contents=[
                 types.Content(parts=[
@@ -201,4 +197,7 @@ for current_task in current_tasks:
         with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
 
+    asyncio.run(llm.run_all(answer_qa, qa_data, desc="QA 推理"))
+    print(f"📦 字幕缓存: {caption_index.cache_info()}")
+    print(f"API 调用统计: {llm.report()}")
     print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
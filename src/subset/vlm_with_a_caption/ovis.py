@@ -7,6 +7,7 @@ from moviepy.editor import VideoFileClip
 from PIL import Image
 import torch
 from transformers import AutoModelForCausalLM
+from src.utils.event_index import EventIndex, concat_captions
 
 # ========== 配置 ==========
 MODEL_PATH = "./models/Ovis2.5-9B"
@@ -67,15 +68,11 @@ def extract_frames(video_path, start_sec=None, end_sec=None, num_frames=64):
             frames.append(Image.fromarray(frame_nd))
     return frames
 
-def concat_audio_caption(a_caption_file):
+def concat_audio_caption(events):
     """
-    拼接整个 JSON 文件里所有的 audio_caption 文本
+    拼接该视频所有段落的 audio_caption 文本
     """
-    captions = [seg.get("audio_caption", "") for seg in a_caption_file if isinstance(seg, dict)]
-
-    # 过滤空白，拼接
-    captions = [c.strip() for c in captions if c and c.strip()]
-    return " ".join(captions)
+    return concat_captions(events, "audio_caption")
 
 def run_model_on_frames(frames, a_caption, question, options, 
                         max_new_tokens=max_new_tokens):
@@ -126,12 +123,15 @@ def run_model_on_frames(frames, a_caption, question, options,
 current_tasks = ["1intra_event_reasoning", "2multimodal_temporal_localization", "3audio_visual_alignment", 
                  "4timeline_reconstruction", "5topic_stance_evolution_summarization", "6cross_event_causality"]
 
+AUDIO_CAPTION_ROOT = "./caption_result_0907/a_caption(gemini2)"
+# 6 个任务共享同一个字幕索引，每个视频的字幕只解析一次
+caption_index = EventIndex(audio_caption_root=AUDIO_CAPTION_ROOT)
+
 for current_task in current_tasks:
     print(f"===== 处理任务: {current_task} =====")
 
     INPUT_FILE = f"./final_qa_subset/{current_task}.json"   # <-- 我把 typo 改成 final_qa_subset
     OUTPUT_FILE = f"./experiment_subset/ovis/{current_task}.json"
-    AUDIO_CAPTION_ROOT = "./caption_result_0907/a_caption(gemini2)"
     VIDEO_ROOT = "./datasets/finevideo/videos"
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
 
@@ -178,9 +178,7 @@ for current_task in current_tasks:
             continue
 
         # 读取并拼接 audio caption 段落
-        with open(a_caption_path, "r", encoding="utf-8") as f:
-            a_caption_file = json.load(f)
-        a_caption = concat_audio_caption(a_caption_file)
+        a_caption = concat_audio_caption(caption_index.get_events(video_id))
         if not a_caption:
             # 如果拼接后为空，也可以继续，但给个警告
             print(f"⚠️ {a_caption_path} 的音频字幕拼接结果为空（qid={qid}）")
@@ -222,4 +220,5 @@ for current_task in current_tasks:
         with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
 
+    print(f"📦 字幕缓存: {caption_index.cache_info()}")
     print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
@@ -0,0 +1,131 @@
+"""
+model_worker 连续批处理（serve/continuous_batching.py）的压测：对比逐个处理（max_batch_size=1，相当于原来的
+semaphore 串行 generate）和连续批处理在并发请求下的吞吐、首 token 延迟和端到端延迟。
+
+不需要下载权重：语言模型是随机初始化的小号 Videollama2MistralForCausalLM，在 CPU 上运行。多模态前缀用随机的
+视觉 token 向量模拟（纯文本 / 图像 / 视频三种长度），拼在文本 token embedding 之间，覆盖前缀长度不一致时的对齐。
+请求按泊松过程到达，每个请求由一个客户端线程流式读取 token。贪心解码下还会检查：
+  - max_batch_size=1 的输出与 HF generate 一致；
+  - 连续批处理的输出与逐个处理一致。
+用法（在 VideoLLaMA2 目录下）:
+    python benchmark_continuous_batching.py
+    python benchmark_continuous_batching.py --requests 64 --rate 8 --batch-sizes 4 8 16 --hidden-size 512
+"""
+import sys
+sys.path.append('./')
+import time
+import argparse
+import threading
+
+import numpy as np
+import torch
+
+from videollama2.model.videollama2_mistral import Videollama2MistralConfig, Videollama2MistralForCausalLM
+from videollama2.serve.continuous_batching import ContinuousBatchScheduler
+
+# 各类请求的视觉 token 数
+PREFIX_TOKENS = {"文本": 0, "图像": 144, "视频": 576}
+
+
+def build_workload(model, args):
+    rng = np.random.default_rng(0)
+    embed = model.get_model().embed_tokens
+    scale = embed.weight.std().item()
+    workload, arrival = [], 0.0
+    for _ in range(args.requests):
+        kind = rng.choice(list(PREFIX_TOKENS))
+        text_ids = torch.from_numpy(rng.integers(3, model.config.vocab_size, int(rng.integers(16, 64))))
+        visual = torch.from_numpy(rng.standard_normal((PREFIX_TOKENS[kind], model.config.hidden_size))).float() * scale
+        with torch.no_grad():
+            text = embed(text_ids)
+        # 系统提示 + 视觉 token + 问题，与 prepare_inputs_labels_for_multimodal 的拼接方式一致
+        inputs_embeds = torch.cat([text[:8], visual, text[8:]])
+        max_new_tokens = int(rng.integers(args.min_new_tokens, args.max_new_tokens + 1))
+        arrival += rng.exponential(1 / args.rate)
+        workload.append((arrival, kind, inputs_embeds, max_new_tokens))
+    return workload
+
+
+def run(model, workload, max_batch_size, max_prefills_per_step):
+    scheduler = ContinuousBatchScheduler(model, max_batch_size, max_prefills_per_step).start()
+    requests = [None] * len(workload)
+    start = time.perf_counter()
+
+    def client(i, arrival, inputs_embeds, max_new_tokens):
+        time.sleep(max(0.0, start + arrival - time.perf_counter()))
+        requests[i] = scheduler.submit(inputs_embeds=inputs_embeds, max_new_tokens=max_new_tokens)
+        for _ in requests[i].stream():
+            pass
+
+    threads = [threading.Thread(target=client, args=(i, arrival, inputs_embeds, max_new_tokens))
+               for i, (arrival, _, inputs_embeds, max_new_tokens) in enumerate(workload)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    scheduler.close()
+    return requests, elapsed, scheduler.num_steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=4.0, help="每秒到达的请求数")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--max-prefills-per-step", type=int, default=1)
+    parser.add_argument("--min-new-tokens", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    config = Videollama2MistralConfig(
+        vocab_size=32000, hidden_size=args.hidden_size, intermediate_size=args.hidden_size * 3,
+        num_hidden_layers=args.layers, num_attention_heads=args.hidden_size // 64, num_key_value_heads=2,
+        max_position_embeddings=4096,
+    )
+    model = Videollama2MistralForCausalLM(config).eval()
+    workload = build_workload(model, args)
+    print(f"{args.requests} 个请求, {args.rate}/s 到达, 新 token {args.min_new_tokens}-{args.max_new_tokens}, "
+          f"hidden_size={args.hidden_size}, layers={args.layers}, threads={torch.get_num_threads()}")
+
+    # 正确性：逐个处理与 HF generate（贪心、不提前停止）一致
+    _, _, inputs_embeds, max_new_tokens = workload[0]
+    with torch.no_grad():
+        reference = super(Videollama2MistralForCausalLM, model).generate(
+            inputs_embeds=inputs_embeds.unsqueeze(0), attention_mask=torch.ones(1, inputs_embeds.shape[0], dtype=torch.long),
+            do_sample=False, max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, pad_token_id=0)
+    single = ContinuousBatchScheduler(model, max_batch_size=1)
+    request = single.submit(inputs_embeds=inputs_embeds, max_new_tokens=max_new_tokens)
+    while single.running or single.waiting.qsize():
+        single.step()
+    hf_ok = request.output_ids == reference[0, -max_new_tokens:].tolist()
+
+    baseline = None
+    for max_batch_size in [1] + args.batch_sizes:
+        requests, elapsed, num_steps = run(model, workload, max_batch_size, args.max_prefills_per_step)
+        tokens = sum(len(r.output_ids) for r in requests)
+        ttft = np.array([r.first_token_time - r.arrival_time for r in requests])
+        latency = np.array([r.finish_time - r.arrival_time for r in requests])
+        if baseline is None:
+            baseline, match = (requests, tokens / elapsed), ""
+        else:
+            same = sum(r.output_ids == b.output_ids for r, b in zip(requests, baseline[0]))
+            match = f", 输出与逐个处理一致 {same}/{len(requests)}"
+        name = "逐个处理" if max_batch_size == 1 else f"连续批处理 max_batch_size={max_batch_size}"
+        print(f"{name}: {tokens / elapsed:.0f} tok/s x{tokens / elapsed / baseline[1]:.2f}, "
+              f"解码步数 {num_steps}, 首 token p50 {np.median(ttft) * 1000:.0f}ms p95 {np.percentile(ttft, 95) * 1000:.0f}ms, "
+              f"端到端 p50 {np.median(latency):.2f}s p95 {np.percentile(latency, 95):.2f}s{match}")
+        for kind in PREFIX_TOKENS:
+            kind_latency = [l for l, (_, k, _, _) in zip(latency, workload) if k == kind]
+            if kind_latency:
+                print(f"    [{kind}] {len(kind_latency)} 个, 端到端 p50 {np.median(kind_latency):.2f}s")
+
+    status = "✅ 一致" if hf_ok else "❌ 不一致"
+    print(f"{status}: max_batch_size=1 的贪心输出与 HF generate 对比")
+    sys.exit(0 if hf_ok else 1)
@@ -0,0 +1,84 @@
+"""
+对比 STCConnector 时序 token 合并（merge_temporal_tokens）前后的 LLM prefill 长度和 CPU 耗时。
+
+不需要下载权重：STCConnector 和 Mistral 语言模型都随机初始化（默认缩小了 hidden_size / 层数），输入是合成的
+CLIP-336 帧特征 [1, T, 576, 1024]，覆盖 "静态"（同一画面 + 少量噪声，类似讲座/软件教程）、"幻灯片"（每 8 帧切换一次画面）
+和 "动态"（每帧独立）三类视频。
+用法（在 VideoLLaMA2 目录下）:
+    python benchmark_token_merging.py
+    python benchmark_token_merging.py --frames 16 --thresholds 0.8 0.9 --budgets 576 --hidden-size 4096 --layers 4
+"""
+import sys
+sys.path.append('./')
+import time
+import argparse
+from types import SimpleNamespace
+
+import torch
+from transformers import MistralConfig, MistralForCausalLM
+
+from videollama2.model.projector import STCConnector
+
+
+def synthetic_features(kind, num_frames, num_tokens, dim, noise):
+    if kind == "静态":
+        frames = torch.randn(1, 1, num_tokens, dim).expand(1, num_frames, -1, -1)
+    elif kind == "幻灯片":
+        frames = torch.randn(1, (num_frames + 7) // 8, num_tokens, dim).repeat_interleave(8, dim=1)[:, :num_frames]
+    else:
+        frames = torch.randn(1, num_frames, num_tokens, dim)
+    return frames + noise * torch.randn(1, num_frames, num_tokens, dim)
+
+
+def timed(fn, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=16)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.9])
+    parser.add_argument("--budgets", type=int, nargs="*", default=[576], help="每个视频的视觉 token 上限")
+    parser.add_argument("--noise", type=float, default=0.1, help="帧特征上叠加的噪声（相对特征幅度）")
+    parser.add_argument("--hidden-size", type=int, default=1024, help="LLM hidden size（VideoLLaMA2-7B 为 4096）")
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--prompt-tokens", type=int, default=128)
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    config = SimpleNamespace(mm_hidden_size=1024, hidden_size=args.hidden_size)
+    connector = STCConnector(config).eval()
+    llm = MistralForCausalLM(MistralConfig(
+        vocab_size=32000, hidden_size=args.hidden_size, intermediate_size=args.hidden_size * 3,
+        num_hidden_layers=args.layers, num_attention_heads=args.hidden_size // 128, num_key_value_heads=8,
+    )).eval()
+    prompt = torch.randn(1, args.prompt_tokens, args.hidden_size)
+
+    settings = [("不合并", None, None)]
+    settings += [(f"threshold={t}", t, None) for t in args.thresholds]
+    settings += [(f"budget={b}", None, b) for b in args.budgets]
+    settings += [(f"threshold={t}+budget={b}", t, b) for t in args.thresholds for b in args.budgets]
+
+    print(f"frames={args.frames}, LLM hidden_size={args.hidden_size}, layers={args.layers}, "
+          f"prompt={args.prompt_tokens} tokens, threads={torch.get_num_threads()}")
+    for kind in ["静态", "幻灯片", "动态"]:
+        features = synthetic_features(kind, args.frames, 576, 1024, args.noise)
+        base = None
+        for name, threshold, budget in settings:
+            connector.merge_threshold, connector.token_budget = threshold, budget
+            with torch.no_grad():
+                t_connector, visual = timed(lambda: connector(features), args.repeat)
+                # 合并时返回每个样本一个 [l_i, d] 的列表，否则为 [b, l, d]
+                visual = visual[0]
+                inputs_embeds = torch.cat([prompt[0], visual]).unsqueeze(0)
+                t_prefill, _ = timed(lambda: llm(inputs_embeds=inputs_embeds, use_cache=True), args.repeat)
+            base = base or t_prefill
+            print(f"[{kind}] {name}: 视觉 token {visual.shape[0]}, prefill 长度 {inputs_embeds.shape[1]} | "
+                  f"connector {t_connector * 1000:.0f}ms, prefill {t_prefill * 1000:.0f}ms x{base / t_prefill:.2f}")
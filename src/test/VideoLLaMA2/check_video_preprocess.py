@@ -0,0 +1,93 @@
+"""
+对比 process_video 的逐帧 PIL + processor.preprocess 路径与 fast=True 整批 torch 路径的数值一致性和 CPU 耗时。
+
+视觉塔的 image processor 在本地按 VideoLLaMA2 使用的配置构造（CLIP ViT-L/14-336、SigLIP so400m-384），不需要下载权重；
+不加 --video 时用随机帧，覆盖横屏、竖屏、补帧（帧数不足 num_frames）以及 aspect_ratio='pad' 分支。
+用法（在 VideoLLaMA2 目录下）:
+    python check_video_preprocess.py --frames 16 32
+    python check_video_preprocess.py --video ./datasets/finevideo/videos/xxx/sample_1.mp4 --threads 1 2 4
+"""
+import sys
+sys.path.append('./')
+import time
+import argparse
+
+import numpy as np
+from transformers import CLIPImageProcessor, SiglipImageProcessor
+
+from videollama2.mm_utils import process_video
+
+
+def load_image_processors():
+    return {
+        # openai/clip-vit-large-patch14-336
+        "clip-336": CLIPImageProcessor(size={"shortest_edge": 336}, crop_size={"height": 336, "width": 336}),
+        # google/siglip-so400m-patch14-384
+        "siglip-384": SiglipImageProcessor(size={"height": 384, "width": 384}),
+    }
+
+
+def timed(fn, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def compare(name, video, processor, aspect_ratio, num_frames, repeat):
+    t_ref, ref = timed(lambda: process_video(video, processor, aspect_ratio=aspect_ratio, num_frames=num_frames), repeat)
+    t_out, out = timed(lambda: process_video(video, processor, aspect_ratio=aspect_ratio, num_frames=num_frames,
+                                             fast=True), repeat)
+
+    assert ref.shape == out.shape, (ref.shape, out.shape)
+    diff = (ref - out).abs()
+    # 像素值误差（uint8 级别），归一化后 1 级 = rescale_factor / std
+    level = processor.rescale_factor / min(processor.image_std)
+    print(f"{name}: -> {tuple(out.shape)} | "
+          f"max |diff|={diff.max().item():.4g} ({diff.max().item() / level:.2f} 级), "
+          f"mean={diff.mean().item():.3g}, 差异像素比例={(diff > 1e-5).float().mean().item():.4f} | "
+          f"逐帧 {t_ref * 1000:.1f}ms, 整批 {t_out * 1000:.1f}ms, x{t_ref / t_out:.1f}")
+    # 浮点误差会让恰好 1 级的差异略大于 1
+    return round(diff.max().item() / level, 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video", default=None)
+    parser.add_argument("--frames", type=int, nargs="+", default=[16])
+    parser.add_argument("--threads", type=int, nargs="+", default=[2], help="--video 时对比的 decord 解码线程数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1.0, help="允许的最大误差（uint8 级）")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    worst = 0.0
+    for proc_name, processor in load_image_processors().items():
+        for num_frames in args.frames:
+            if args.video:
+                cases = {args.video: args.video}
+            else:
+                cases = {
+                    "720p": rng.integers(0, 256, (num_frames, 720, 1280, 3), dtype=np.uint8),
+                    "竖屏 640x360": rng.integers(0, 256, (num_frames, 640, 360, 3), dtype=np.uint8),
+                    "补帧 480p": rng.integers(0, 256, (max(num_frames // 2, 1), 480, 640, 3), dtype=np.uint8),
+                }
+            for name, video in cases.items():
+                for aspect_ratio in [None, 'pad']:
+                    label = f"[{proc_name}] {name} x{num_frames} aspect_ratio={aspect_ratio}"
+                    worst = max(worst, compare(label, video, processor, aspect_ratio, num_frames, args.repeat))
+
+    if args.video:
+        processor = load_image_processors()["siglip-384"]
+        for num_frames in args.frames:
+            for threads in args.threads:
+                t, _ = timed(lambda: process_video(args.video, processor, aspect_ratio=None, num_frames=num_frames,
+                                                   fast=True, num_threads=threads), args.repeat)
+                print(f"decord num_threads={threads}, {num_frames} 帧: 解码+预处理 {t * 1000:.1f}ms")
+
+    status = "✅ 一致" if worst <= args.tolerance else "❌ 超出容差"
+    print(f"{status}: 最大误差 {worst:.2f} 级（容差 {args.tolerance} 级）")
+    sys.exit(0 if worst <= args.tolerance else 1)
@@ -1,6 +1,5 @@
 import os
 import json
-from tqdm import tqdm
 from transformers import AutoModelForCausalLM, AutoProcessor, AutoModel, AutoImageProcessor
 import torch
 import cv2
@@ -8,32 +7,48 @@ import tempfile
 import numpy as np
 import subprocess
 import sys
+from functools import partial
 # sys.path.append('./')
 from videollama2 import model_init, mm_infer
 from videollama2.utils import disable_torch_init
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+from src.utils.video_scheduler import VideoGroupScheduler
+from src.utils.frame_dedup import from_env, VISION_FLOPS_PER_FRAME
+
 # ====== 初始化模型 ======
 MODEL_PATH = "./models/VideoLLaMA2-7B"
 model, processor, tokenizer = model_init(MODEL_PATH)
+# VIDEO_FAST_PREPROCESS=1（默认）：解码后的帧保持为 uint8 数组，整批用 torch 完成缩放/裁剪/归一化，
+# 不再逐帧转 PIL 再调用 processor.preprocess；VIDEO_DECODE_THREADS 为 decord 解码线程数
+processor['video'] = partial(
+    processor['video'],
+    fast=os.environ.get("VIDEO_FAST_PREPROCESS", "1") == "1",
+    num_threads=int(os.environ.get("VIDEO_DECODE_THREADS", "2")),
+)
+# FRAME_DEDUP=1：按感知哈希去掉近重复帧（可用采样区间内的其它帧替换），不再补齐到固定帧数
+frame_dedup = from_env(flops_per_frame=VISION_FLOPS_PER_FRAME["videollama2"])
+if frame_dedup is not None:
+    processor['video'] = partial(processor['video'], frame_filter=frame_dedup)
+# STCConnector 投影后的时序 token 合并（默认关闭）：相邻帧同一位置余弦相似度超过 VIDEO_TOKEN_MERGE_THRESHOLD 的 token 合并，
+# VIDEO_TOKEN_BUDGET 限制每个视频的视觉 token 总数；静态视频（讲座、软件教程）的 prefill 长度随画面变化而不是帧数增长
+if os.environ.get("VIDEO_TOKEN_MERGE_THRESHOLD"):
+    model.get_model().mm_projector.merge_threshold = float(os.environ["VIDEO_TOKEN_MERGE_THRESHOLD"])
+if os.environ.get("VIDEO_TOKEN_BUDGET"):
+    model.get_model().mm_projector.token_budget = int(os.environ["VIDEO_TOKEN_BUDGET"])
     
 
 # ====== 文件路径 ======
-current_task = "1intra_event_reasoning"
-INPUT_FILE = f"./final_qa/{current_task}.json"
-OUTPUT_FILE = f"./experiment/videollama2/{current_task}.json"
+current_tasks = ["1intra_event_reasoning", "3audio_visual_alignment", "5topic_stance_evolution_summarization", "4timeline_reconstruction", "6cross_event_causality", "2multimodal_temporal_localization"]
 VIDEO_ROOT = "./datasets/finevideo/videos"
-os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-
-# ====== 读取已有结果 ======
-if os.path.exists(OUTPUT_FILE):
-    with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-        results = json.load(f)
-else:
-    results = {}
 
-# ====== 读取 QA 数据 ======
-with open(INPUT_FILE, "r", encoding="utf-8") as f:
-    qa_data = json.load(f)
+# ====== 按视频分组（已有结果自动跳过） ======
+scheduler = VideoGroupScheduler(
+    current_tasks,
+    input_pattern="./final_qa/{task}.json",
+    output_pattern="./experiment/videollama2" + ("_dedup" if frame_dedup is not None else "") + "/{task}.json",
+    video_root=VIDEO_ROOT,
+)
 
 SYSTEM_PROMPT = "You are an expert in long video understanding. Always base your answers strictly on the video content."
 
@@ -48,36 +63,14 @@ Output format:
   "reason": your explanation
 """
 
-for qa in tqdm(qa_data):
-    qid = qa["question_id"]
-    question = qa["question"]
-    video_id = qa["related_videoID"]
-    options = qa.get("options", "")
-    if qid in results:
-        continue
-
-    try:
-        category, idx = video_id.rsplit("_", 1)
-        video_path = os.path.join(VIDEO_ROOT, category, f"sample_{idx}.mp4")
-    except Exception as e:
-        print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-        continue
-
-    if not os.path.exists(video_path):
-        print(f"⚠️ 视频不存在: {video_path}")
-        continue
-
-    output = mm_infer(processor['video'](video_path), USER_PROMPT.format(question=question, options=options), model=model, tokenizer=tokenizer, do_sample=False, modal='video')
 
-    results[qid] = {
-        "question_id": qid,
-        "question": question,
-        "options": options,
-        "video_id": video_id,
-        "model_answer": output
-    }
+def answer(video_tensor, qa):
+    prompt = USER_PROMPT.format(question=qa["question"], options=qa.get("options", ""))
+    return mm_infer(video_tensor, prompt, model=model, tokenizer=tokenizer, do_sample=False, modal='video')
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
 
-print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
+# 每个视频只抽帧、预处理一次，供它的所有问题复用
+scheduler.run(prepare=processor['video'], answer=answer, desc="VideoLLaMA2")
+if frame_dedup is not None:
+    print(f"🎞️ 帧去重: {frame_dedup.stats()}")
+    frame_dedup.dump(os.path.join(os.path.dirname(scheduler.output_files[current_tasks[0]]), "frame_dedup.json"))
@@ -0,0 +1,30 @@
+set -x
+
+# Judges all five VideoChatGPT generation criteria in one run. Run the inference part of
+# eval_video_oqa_vcgpt_{1_correctness,4_temporal,5_consistency}.sh first; missing prediction
+# files are skipped, and a re-run only judges the samples that have no result yet.
+OUTPUT_DIR=eval_output
+CKPT=DAMO-NLP-SG/VideoLLaMA2.1-7B-16F
+CKPT_NAME=$(echo $CKPT | rev | cut -d'/' -f1 | rev)
+
+ANSWER_DIR=${OUTPUT_DIR}/videochatgpt_gen/answers
+PRED_ARGS=""
+for pair in generic:correctness temporal:temporal consistency:consistency; do
+    pred_file=${ANSWER_DIR}/${pair#*:}/${CKPT_NAME}/merge.json
+    if [ -f "$pred_file" ]; then
+        PRED_ARGS="$PRED_ARGS --${pair%%:*}-pred-path $pred_file"
+    fi
+done
+
+
+AZURE_API_KEY=your_key
+AZURE_API_ENDPOINT=your_endpoint
+AZURE_API_DEPLOYNAME=your_deployname
+
+python3 videollama2/eval/eval_video_oqa_vcgpt_unified.py \
+    $PRED_ARGS \
+    --output-dir "${ANSWER_DIR}/{criterion}/${CKPT_NAME}" \
+    --api-key $AZURE_API_KEY \
+    --api-endpoint $AZURE_API_ENDPOINT \
+    --api-deployname $AZURE_API_DEPLOYNAME \
+    --max-concurrency 16
@@ -0,0 +1,210 @@
+"""
+controller 派发策略（lottery / shortest_queue / least_work）的离线仿真：把一条请求轨迹回放给模拟 worker，
+统计每种策略的 p50/p99 延迟（整体和按模态）。
+
+派发用的是 serve/controller.py 里真实的 Controller（--package ola 时用 Ola 的 controller 和代价模型），
+worker 是模拟的：同时最多处理 --concurrency 个请求（对应 --limit-model-concurrency），这些请求平分
+worker 的算力（processor sharing），其余排队；和真实 worker 一样在请求开始和结束时发心跳，上报
+queue_length 和按 request_cost.py 估计的未完成工作量。请求的真实耗时按实际输出长度计算，再乘上对数正态噪声，
+所以代价估计本身也有误差。
+不加 --trace 时生成合成轨迹（文本 / 图像 / 8-128 帧视频混合，泊松到达，按 --load 设定整体负载）。
+轨迹格式（jsonl，每行一个请求）: {"time": 到达时间(秒), "params": worker_generate_stream 的请求参数, "output_tokens": 实际输出 token 数}
+用法（在 VideoLLaMA2 目录下）:
+    python simulate_dispatch.py
+    python simulate_dispatch.py --speeds 1 1 0.5 0.5 --load 0.9 --requests 5000 --save-trace trace.jsonl
+    python simulate_dispatch.py --trace trace.jsonl --package ola
+"""
+import sys
+sys.path.append('./')
+import json
+import heapq
+import logging
+import argparse
+from collections import deque
+
+import numpy as np
+
+MODEL_NAME = "sim"
+
+
+def load_controller(package):
+    if package == "ola":
+        sys.path.append('../ola7b')
+        from ola.serve.controller import Controller
+        from ola.serve.request_cost import RequestCostModel
+    else:
+        from videollama2.serve.controller import Controller
+        from videollama2.serve.request_cost import RequestCostModel
+    # build_logger 会把 stdout/stderr 重定向到日志，派发日志也太多
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    logging.getLogger("controller").setLevel(logging.WARNING)
+    return Controller, RequestCostModel
+
+
+def synthetic_trace(args, cost_model, total_speed):
+    rng = np.random.default_rng(args.seed)
+    requests = []
+    for _ in range(args.requests):
+        kind = rng.choice(["text", "image", "video"], p=[0.5, 0.2, 0.3])
+        # 视频请求大多是评测里的短答案问答，少数是长描述
+        max_new_tokens = int(rng.choice([32, 64, 64, 512])) if kind == "video" else int(rng.choice([128, 256, 512]))
+        question = "Describe what happens and explain why. " * int(rng.integers(1, 8))
+        if kind == "video":
+            params = {"prompt": "<video>\n" + question, "modality": "video", "num_frames": int(rng.choice([8, 16, 32, 64, 128]))}
+        elif kind == "image":
+            params = {"prompt": "<image>\n" + question, "modality": "image"}
+        else:
+            params = {"prompt": question, "modality": "text"}
+        if args.package == "ola" and rng.random() < 0.3:
+            params["audio_seconds"] = float(rng.uniform(2, 60))
+        params.update(model=MODEL_NAME, max_new_tokens=max_new_tokens)
+        requests.append({"params": params, "output_tokens": int(max_new_tokens * rng.uniform(0.05, 1.0))})
+
+    # 按平均真实耗时换算到达率，使整体负载为 --load
+    mean_cost = np.mean([cost_model.estimate(r["params"], r["output_tokens"]) for r in requests])
+    rate = args.rate or args.load * total_speed / mean_cost
+    arrivals = np.cumsum(rng.exponential(1 / rate, len(requests)))
+    for request, arrival in zip(requests, arrivals):
+        request["time"] = float(arrival)
+    return requests
+
+
+class MockWorker:
+    def __init__(self, name, speed, concurrency):
+        self.name = name
+        self.speed = speed
+        self.concurrency = concurrency
+        self.active = {}  # 请求下标 -> 剩余工作量（speed=1 下的秒数）
+        self.waiting = deque()
+        self.outstanding_cost = 0.0
+
+    def queue_length(self):
+        return len(self.active) + len(self.waiting)
+
+    def add(self, job, work, estimate):
+        self.outstanding_cost += estimate
+        if len(self.active) < self.concurrency:
+            self.active[job] = work
+        else:
+            self.waiting.append((job, work))
+
+    def advance(self, dt):
+        if self.active:
+            done = dt * self.speed / len(self.active)
+            for job in self.active:
+                self.active[job] -= done
+
+    def time_to_next_finish(self):
+        if not self.active:
+            return float("inf")
+        return max(min(self.active.values()), 0.0) * len(self.active) / self.speed
+
+    def pop_finished(self):
+        first = min(self.active, key=self.active.get)
+        finished = [job for job, work in self.active.items() if job == first or work <= 1e-9]
+        for job in finished:
+            del self.active[job]
+        while self.waiting and len(self.active) < self.concurrency:
+            job, work = self.waiting.popleft()
+            self.active[job] = work
+        return finished
+
+
+def simulate(policy, trace, args, Controller, cost_model):
+    np.random.seed(args.seed)  # lottery 用 np.random
+    controller = Controller(policy, cost_model)
+    workers = {}
+    for i, speed in enumerate(args.speeds):
+        worker = MockWorker(f"http://worker-{i}", speed, args.concurrency)
+        workers[worker.name] = worker
+        controller.register_worker(worker.name, False, {
+            "model_names": [MODEL_NAME], "speed": speed, "queue_length": 0, "outstanding_cost": 0.0})
+
+    estimates = [cost_model.estimate(r["params"]) for r in trace]
+    rng = np.random.default_rng(args.seed + 1)
+    works = [cost_model.estimate(r["params"], r["output_tokens"]) * rng.lognormal(0, args.noise) for r in trace]
+    finish = [None] * len(trace)
+    assigned = [None] * len(trace)
+
+    def heart_beat(worker):
+        controller.receive_heart_beat(worker.name, worker.queue_length(), worker.outstanding_cost)
+
+    arrivals = [(r["time"], i) for i, r in enumerate(trace)]
+    heapq.heapify(arrivals)
+    now = 0.0
+    while arrivals or any(w.active for w in workers.values()):
+        next_arrival = arrivals[0][0] if arrivals else float("inf")
+        worker = min(workers.values(), key=MockWorker.time_to_next_finish)
+        next_finish = now + worker.time_to_next_finish()
+        t = min(next_arrival, next_finish)
+        for w in workers.values():
+            w.advance(t - now)
+        now = t
+        if next_finish <= next_arrival:
+            for job in worker.pop_finished():
+                finish[job] = now
+                worker.outstanding_cost -= estimates[job]
+            heart_beat(worker)
+        else:
+            _, job = heapq.heappop(arrivals)
+            name = controller.get_worker_address(MODEL_NAME, trace[job]["params"])
+            assigned[job] = name
+            workers[name].add(job, works[job], estimates[job])
+            heart_beat(workers[name])
+
+    latency = np.array([f - r["time"] for f, r in zip(finish, trace)])
+    busy = {name: sum(works[j] for j, a in enumerate(assigned) if a == name) / w.speed for name, w in workers.items()}
+    return latency, busy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--package", choices=["videollama2", "ola"], default="videollama2")
+    parser.add_argument("--policies", nargs="+", default=["lottery", "shortest_queue", "least_work"])
+    parser.add_argument("--trace", default=None)
+    parser.add_argument("--save-trace", default=None)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=None, help="每秒到达的请求数，默认按 --load 计算")
+    parser.add_argument("--load", type=float, default=0.8, help="合成轨迹的整体负载（真实工作量 / 总算力）")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[1, 1, 1, 1], help="各 worker 的 speed")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.3, help="真实耗时相对估计的对数正态噪声")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    Controller, RequestCostModel = load_controller(args.package)
+    cost_model = RequestCostModel()
+    if args.trace:
+        with open(args.trace) as f:
+            trace = [json.loads(line) for line in f if line.strip()]
+        for request in trace:
+            request["params"]["model"] = MODEL_NAME
+    else:
+        trace = synthetic_trace(args, cost_model, sum(args.speeds))
+    trace.sort(key=lambda r: r["time"])
+    if args.save_trace:
+        with open(args.save_trace, "w") as f:
+            for request in trace:
+                f.write(json.dumps(request) + "\n")
+
+    kinds = []
+    for request in trace:
+        modality = request["params"].get("modality")
+        if modality is None:
+            prompt = request["params"].get("prompt", "")
+            modality = "video" if "<video>" in prompt else "image" if "<image>" in prompt else "text"
+        kinds.append(modality.split("_")[0])
+    duration = trace[-1]["time"] - trace[0]["time"]
+    print(f"[{args.package}] {len(trace)} 个请求, {len(trace) / duration:.2f}/s, workers speed={args.speeds}, "
+          f"concurrency={args.concurrency}, noise={args.noise}")
+
+    for policy in args.policies:
+        latency, busy = simulate(policy, trace, args, Controller, cost_model)
+        print(f"{policy}: p50 {np.percentile(latency, 50):.1f}s, p90 {np.percentile(latency, 90):.1f}s, "
+              f"p99 {np.percentile(latency, 99):.1f}s, 平均 {latency.mean():.1f}s | "
+              f"各 worker 工作时间 {' / '.join(f'{b:.0f}s' for b in busy.values())}")
+        for kind in ["text", "image", "video"]:
+            kind_latency = latency[[k == kind for k in kinds]]
+            if len(kind_latency):
+                print(f"    [{kind}] {len(kind_latency)} 个, p50 {np.percentile(kind_latency, 50):.1f}s, "
+                      f"p99 {np.percentile(kind_latency, 99):.1f}s")
@@ -0,0 +1,319 @@
+"""
+GPT judging of the VideoChatGPT generation benchmark (all five criteria) in one run.
+
+Correctness, detail orientation and context are judged on the same generic predictions, so
+each generic prediction gets one structured-output request that returns all three scores.
+Temporal and consistency predictions come from their own question files and keep one request
+per sample. Requests run with bounded async concurrency through `src/utils/llm_client.py`
+(rate limits, retries, response cache), samples whose output files already exist are skipped,
+and every criterion is written in the format of `eval_video_oqa_vcgpt_{1..5}_*.py`:
+`<output-dir>/gpt/<key>.json` holding `[{"score": n}, qa_set]` and `<output-dir>/results.json`.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../../..")))
+from src.utils.llm_client import AsyncLLMClient
+
+# criterion -> (score name used in the prompt, instructions of the single-criterion script)
+GENERIC_CRITERIA = {
+    "correctness": (
+        "factual accuracy",
+        "- Focus on the factual consistency between the predicted answer and the correct answer. The predicted answer should not contain any misinterpretations or misinformation.\n"
+        "- The predicted answer must be factually accurate and align with the video content.\n"
+        "- Consider synonyms or paraphrases as valid matches.\n"
+        "- Evaluate the factual accuracy of the prediction compared to the answer.\n",
+    ),
+    "detail": (
+        "detail orientation",
+        "- Check if the predicted answer covers all major points from the video. The response should not leave out any key aspects.\n"
+        "- Evaluate whether the predicted answer includes specific details rather than just generic points. It should provide comprehensive information that is tied to specific elements of the video.\n"
+        "- Consider synonyms or paraphrases as valid matches.\n"
+        "- Provide a single evaluation score that reflects the level of detail orientation of the prediction, considering both completeness and specificity.\n",
+    ),
+    "context": (
+        "contextual understanding",
+        "- Evaluate whether the predicted answer aligns with the overall context of the video content. It should not provide information that is out of context or misaligned.\n"
+        "- The predicted answer must capture the main themes and sentiments of the video.\n"
+        "- Consider synonyms or paraphrases as valid matches.\n"
+        "- Provide your evaluation of the contextual understanding of the prediction compared to the answer.\n",
+    ),
+}
+
+# names printed with the averages, as in the single-criterion scripts
+DISPLAY_NAMES = {
+    "correctness": "correctness",
+    "detail": "detailed orientation",
+    "context": "contextual understanding",
+    "temporal": "temporal understanding",
+    "consistency": "consistency",
+}
+
+
+def score_schema(keys):
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "score_schema",
+            "schema": {
+                "type": "object",
+                "properties": {key: {"type": "integer", "minimum": 0, "maximum": 5} for key in keys},
+                "required": list(keys),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def generic_messages(qa_set):
+    instructions = "".join(
+        f"{name.capitalize()} ('{key}'):\n{text}" for key, (name, text) in GENERIC_CRITERIA.items())
+    return [
+        {
+            "role": "system",
+            "content":
+                "You are an intelligent chatbot designed for evaluating generative outputs for video-based question-answer pairs. "
+                "Your task is to compare the predicted answer with the correct answer and score it on three independent criteria: "
+                "factual accuracy, detail orientation and contextual understanding. Here's how you can accomplish the task:"
+                "------"
+                "##INSTRUCTIONS: \n"
+                f"{instructions}"
+                "Score each criterion on its own; a long or detailed answer is not more accurate, and an accurate answer is not necessarily detailed."
+        },
+        {
+            "role": "user",
+            "content":
+                "Please evaluate the following video-based question-answer pair:\n\n"
+                f"Question: {qa_set['q']}\n"
+                f"Correct Answer: {qa_set['a']}\n"
+                f"Predicted Answer: {qa_set['p']}\n\n"
+                "Provide your evaluation only as three scores, each an integer value between 0 and 5, with 5 indicating the highest level of the criterion. "
+                "Respond with a JSON object with the keys 'correctness' (factual accuracy), 'detail' (detail orientation) and 'context' (contextual understanding). "
+                "DO NOT PROVIDE ANY OTHER OUTPUT TEXT OR EXPLANATION. "
+                "For example, your response should look like this: {\"correctness\": 4, \"detail\": 3, \"context\": 5}."
+        },
+    ]
+
+
+def temporal_messages(qa_set):
+    return [
+        {
+            "role": "system",
+            "content":
+                "You are an intelligent chatbot designed for evaluating the temporal understanding of generative outputs for video-based question-answer pairs. "
+                "Your task is to compare the predicted answer with the correct answer and determine if they correctly reflect the temporal sequence of events in the video content. Here's how you can accomplish the task:"
+                "------"
+                "##INSTRUCTIONS: "
+                "- Focus on the temporal consistency between the predicted answer and the correct answer. The predicted answer should correctly reflect the sequence of events or details as they are presented in the video content.\n"
+                "- Consider synonyms or paraphrases as valid matches, but only if the temporal order is maintained.\n"
+                "- Evaluate the temporal accuracy of the prediction compared to the answer."
+        },
+        {
+            "role": "user",
+            "content":
+                "Please evaluate the following video-based question-answer pair:\n\n"
+                f"Question: {qa_set['q']}\n"
+                f"Correct Answer: {qa_set['a']}\n"
+                f"Predicted Answer: {qa_set['p']}\n\n"
+                "Provide your evaluation only as a temporal accuracy score where the temporal accuracy score is an integer value between 0 and 5, with 5 indicating the highest level of temporal consistency. "
+                "Respond with a JSON object with the key 'score', where its value is the temporal accuracy score in INTEGER, not STRING. "
+                "DO NOT PROVIDE ANY OTHER OUTPUT TEXT OR EXPLANATION. "
+                "For example, your response should look like this: {\"score\": 4}."
+        },
+    ]
+
+
+def consistency_messages(qa_set):
+    return [
+        {
+            "role": "system",
+            "content":
+                "You are an intelligent chatbot designed for evaluating the consistency of generative outputs for similar video-based question-answer pairs. "
+                "You will be given two very similar questions, a common answer common to both the questions and predicted answers for the two questions ."
+                "Your task is to compare the predicted answers for two very similar question, with a common correct answer and determine if they are consistent. Here's how you can accomplish the task:"
+                "------"
+                "##INSTRUCTIONS: "
+                "- Focus on the consistency between the two predicted answers and the correct answer. Both predicted answers should correspond to the correct answer and to each other, and should not contain any contradictions or significant differences in the conveyed information.\n"
+                "- Both predicted answers must be consistent with each other and the correct answer, in terms of the information they provide about the video content.\n"
+                "- Consider synonyms or paraphrases as valid matches, but only if they maintain the consistency in the conveyed information.\n"
+                "- Evaluate the consistency of the two predicted answers compared to the correct answer."
+        },
+        {
+            "role": "user",
+            "content":
+                "Please evaluate the following video-based question-answer pair:\n\n"
+                f"Question 1: {qa_set['q1']}\n"
+                f"Question 2: {qa_set['q2']}\n"
+                f"Correct Answer: {qa_set['a']}\n"
+                f"Predicted Answer to Question 1: {qa_set['p1']}\n"
+                f"Predicted Answer to Question 2: {qa_set['p2']}\n\n"
+                "Provide your evaluation only as a consistency score where the consistency score is an integer value between 0 and 5, with 5 indicating the highest level of consistency. "
+                "Respond with a JSON object with the key 'score', where its value is the consistency score in INTEGER, not STRING. "
+                "DO NOT PROVIDE ANY OTHER OUTPUT TEXT OR EXPLANATION. "
+                "For example, your response should look like this: {\"score\": 4}."
+        },
+    ]
+
+
+def load_predictions(pred_path, consistency=False):
+    """Returns {key: qa_set} with the keys of the single-criterion scripts (`<video_name>_<n>`)."""
+    video_id_counts = {}
+    prediction_set = {}
+    with open(pred_path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            sample = json.loads(line)
+            video_id = sample['video_name']
+            video_id_counts[video_id] = video_id_counts[video_id] + 1 if video_id in video_id_counts else 0
+            key = f"{video_id}_{video_id_counts[video_id]}"
+            if consistency:
+                qa_set = {"q1": sample['Q1'], "q2": sample['Q2'], "a": sample['A'], "p1": sample['P1'], "p2": sample['P2']}
+            else:
+                qa_set = {"q": sample['Q'], "a": sample['A'], "p": sample['P']}
+            prediction_set[key] = qa_set
+    return prediction_set
+
+
+def parse_scores(text, keys):
+    scores = json.loads(text)
+    for key in keys:
+        # same int() conversion the single-criterion scripts apply when averaging
+        score = int(scores[key])
+        if not 0 <= score <= 5:
+            raise ValueError(f"score {key}={score} out of range")
+        scores[key] = score
+    return scores
+
+
+def write_result(output_dir, key, score, qa_set):
+    path = os.path.join(output_dir, f"{key}.json")
+    # write then rename, so an interrupted run never leaves a truncated file that would be skipped
+    with open(path + ".tmp", "w") as f:
+        json.dump([{"score": score}, qa_set], f)
+    os.replace(path + ".tmp", path)
+
+
+class VcgptJudge:
+
+    def __init__(self, llm, model, output_dirs):
+        self.llm = llm
+        self.model = model
+        self.output_dirs = output_dirs  # criterion -> directory of per-sample files
+
+    def missing(self, criterion, key):
+        return not os.path.exists(os.path.join(self.output_dirs[criterion], f"{key}.json"))
+
+    async def judge(self, messages, keys):
+        resp = await self.llm.chat_completion(
+            model=self.model,
+            messages=messages,
+            response_format=score_schema(keys),
+            temperature=0.7,
+            max_tokens=800,
+            top_p=0.95,
+            # a reply that does not parse is not cached, so the next round asks again
+            validate=lambda text: parse_scores(text, keys),
+        )
+        return parse_scores(resp.text, keys)
+
+    async def judge_generic(self, item):
+        key, qa_set = item
+        scores = await self.judge(generic_messages(qa_set), list(GENERIC_CRITERIA))
+        for criterion in GENERIC_CRITERIA:
+            # keep results that already exist, e.g. from a single-criterion run
+            if criterion in self.output_dirs and self.missing(criterion, key):
+                write_result(self.output_dirs[criterion], key, scores[criterion], qa_set)
+
+    async def judge_temporal(self, item):
+        key, qa_set = item
+        scores = await self.judge(temporal_messages(qa_set), ["score"])
+        write_result(self.output_dirs["temporal"], key, scores["score"], qa_set)
+
+    async def judge_consistency(self, item):
+        key, qa_set = item
+        scores = await self.judge(consistency_messages(qa_set), ["score"])
+        write_result(self.output_dirs["consistency"], key, scores["score"], qa_set)
+
+
+def combine(output_dir, prediction_set, json_path):
+    combined_contents = {}
+    for key in prediction_set:
+        file_path = os.path.join(output_dir, f"{key}.json")
+        if os.path.exists(file_path):
+            with open(file_path, "r") as json_file:
+                combined_contents[key] = json.load(json_file)
+    with open(json_path, "w") as json_file:
+        json.dump(combined_contents, json_file)
+    return combined_contents
+
+
+def main(args):
+    tasks = {}  # judge method -> (criteria it writes, prediction set)
+    if args.generic_pred_path:
+        tasks["judge_generic"] = (list(GENERIC_CRITERIA), load_predictions(args.generic_pred_path))
+    if args.temporal_pred_path:
+        tasks["judge_temporal"] = (["temporal"], load_predictions(args.temporal_pred_path))
+    if args.consistency_pred_path:
+        tasks["judge_consistency"] = (["consistency"], load_predictions(args.consistency_pred_path, consistency=True))
+    if not tasks:
+        raise ValueError("Pass at least one of --generic-pred-path, --temporal-pred-path, --consistency-pred-path.")
+
+    # every criterion needs its own directory, otherwise their per-sample files would collide
+    output_dir = args.output_dir if "{criterion}" in args.output_dir else os.path.join(args.output_dir, "{criterion}")
+    root_dirs = {criterion: output_dir.format(criterion=criterion)
+                 for criteria, _ in tasks.values() for criterion in criteria}
+    output_dirs = {criterion: os.path.join(root, "gpt") for criterion, root in root_dirs.items()}
+    for output_dir in output_dirs.values():
+        os.makedirs(output_dir, exist_ok=True)
+
+    llm = AsyncLLMClient(args.provider, max_concurrency=args.max_concurrency,
+                         base_url=args.api_endpoint, api_key=args.api_key)
+    judge = VcgptJudge(llm, args.api_deployname, output_dirs)
+
+    async def run_all():
+        for method, (criteria, prediction_set) in tasks.items():
+            for _ in range(args.max_rounds):
+                # a sample is pending while any of the criteria it is judged for has no file yet
+                pending = [(key, qa_set) for key, qa_set in prediction_set.items()
+                           if any(judge.missing(criterion, key) for criterion in criteria)]
+                print(f"{method}: {len(prediction_set) - len(pending)} completed, {len(pending)} incomplete")
+                if not pending:
+                    break
+                await llm.run_all(getattr(judge, method), pending, desc=method)
+
+    asyncio.run(run_all())
+    print(f"API calls: {llm.report()}")
+
+    for criteria, prediction_set in tasks.values():
+        for criterion in criteria:
+            combined_contents = combine(output_dirs[criterion], prediction_set,
+                                        os.path.join(root_dirs[criterion], "results.json"))
+            scores = [int(result[0]['score']) for result in combined_contents.values()]
+            if len(scores) < len(prediction_set):
+                print(f"{len(prediction_set) - len(scores)} {criterion} samples are still missing, re-run to resume.")
+            if scores:
+                print(f"Average score for {DISPLAY_NAMES[criterion]}:", sum(scores) / len(scores))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="videochatgpt-generation-gpt-judge")
+    parser.add_argument("--generic-pred-path", default=None, help="Predictions on generic_qa (correctness, detail, context).")
+    parser.add_argument("--temporal-pred-path", default=None, help="Predictions on temporal_qa.")
+    parser.add_argument("--consistency-pred-path", default=None, help="Predictions on consistency_qa.")
+    parser.add_argument("--output-dir", required=True,
+                        help="Output directory per criterion, '{criterion}' is replaced by correctness, detail, context, "
+                             "temporal or consistency (without it, <output-dir>/<criterion> is used); annotations go to "
+                             "<dir>/gpt, the combined file to <dir>/results.json.")
+    parser.add_argument("--provider", default="azure", choices=["azure", "openai"])
+    parser.add_argument("--api-key", default=None, type=str, help="API key (defaults to AZURE_OPENAI_KEY / OPENAI_API_KEY).")
+    parser.add_argument("--api-endpoint", default=None, type=str, help="Azure endpoint or OpenAI base url.")
+    parser.add_argument("--api-deployname", required=True, type=str, help="Azure deployment (or OpenAI model) name.")
+    parser.add_argument("--max-concurrency", default=None, type=int, help="Concurrent requests (defaults to LLM_MAX_CONCURRENCY).")
+    parser.add_argument("--max-rounds", default=3, type=int, help="Passes over samples that failed in the previous pass.")
+    args = parser.parse_args()
+
+    main(args)
@@ -129,7 +129,92 @@ def frame_sample(duration, mode='uniform', num_frames=None, fps=None):
         raise ImportError(f'Unsupported frame sampling mode: {mode}')
 
 
-def process_video(video_path, processor, s=None, e=None, aspect_ratio='pad', num_frames=NUM_FRAMES):
+def _resize_output_size(processor, height, width):
+    """Output (height, width) of the HF processor's `resize` step"""
+    size = processor.size
+    if "shortest_edge" in size:
+        # same as `transformers.image_transforms.get_resize_output_image_size(default_to_square=False)`
+        short, long = (width, height) if width <= height else (height, width)
+        new_short, new_long = size["shortest_edge"], int(size["shortest_edge"] * long / short)
+        return (new_long, new_short) if width <= height else (new_short, new_long)
+    return size["height"], size["width"]
+
+
+def _resize_frames(frames, size, resample):
+    """
+    Resize uint8 [T, H, W, 3] frames to `size` (height, width) like PIL's `Image.resize`.
+
+    Bilinear uses torch's uint8 antialiased kernel (matches PIL and is several times faster);
+    PIL's own uint8 kernel is faster than torch's float bicubic on CPU, so other filters keep it.
+    """
+    if int(resample) == Image.BILINEAR:
+        # a permuted [T, H, W, 3] tensor is channels-last, which the uint8 kernel needs
+        resized = torch.nn.functional.interpolate(
+            frames.permute(0, 3, 1, 2), size=size, mode="bilinear", align_corners=False, antialias=True)
+        return resized.permute(0, 2, 3, 1)
+    resized = [np.asarray(Image.fromarray(frame).resize(size[::-1], resample)) for frame in frames.numpy()]
+    return torch.from_numpy(np.stack(resized))
+
+
+def process_video_frames(frames, processor, aspect_ratio='pad'):
+    """
+    Batched equivalent of `expand2square` (if `aspect_ratio == 'pad'`) followed by
+    `processor.preprocess(images, return_tensors='pt')['pixel_values']` for the CLIP/SigLIP
+    image processors, without building a PIL image and numpy copies per frame.
+
+    Args:
+        frames: uint8 array / tensor of shape [T, H, W, 3] (RGB, e.g. decord `get_batch`)
+        processor: the vision tower's image processor
+        aspect_ratio: 'pad' to pad frames to a square with the mean color first
+
+    Returns:
+        float32 tensor of shape [T, 3, H', W']
+    """
+    frames = torch.as_tensor(frames)
+    num_frames, height, width, _ = frames.shape
+
+    if aspect_ratio == 'pad' and height != width:
+        side = max(height, width)
+        canvas = torch.empty((num_frames, side, side, 3), dtype=torch.uint8)
+        canvas[:] = torch.tensor([int(x * 255) for x in processor.image_mean], dtype=torch.uint8)
+        top, left = (side - height) // 2, (side - width) // 2
+        canvas[:, top:top + height, left:left + width] = frames
+        frames, height, width = canvas, side, side
+
+    if getattr(processor, "do_resize", True):
+        height, width = _resize_output_size(processor, height, width)
+        frames = _resize_frames(frames.contiguous(), (height, width), processor.resample)
+
+    if getattr(processor, "do_center_crop", False):
+        crop_height, crop_width = processor.crop_size["height"], processor.crop_size["width"]
+        if crop_height > height or crop_width > width:
+            raise ValueError("process_video_frames does not support center crops larger than the image")
+        top, left = (height - crop_height) // 2, (width - crop_width) // 2
+        frames = frames[:, top:top + crop_height, left:left + crop_width]
+
+    pixels = frames.permute(0, 3, 1, 2).float()
+    if getattr(processor, "do_rescale", True):
+        pixels = pixels * processor.rescale_factor
+    if getattr(processor, "do_normalize", True):
+        mean = torch.tensor(processor.image_mean, dtype=torch.float32).view(1, -1, 1, 1)
+        std = torch.tensor(processor.image_std, dtype=torch.float32).view(1, -1, 1, 1)
+        pixels = (pixels - mean) / std
+    return pixels.contiguous()
+
+
+def process_video(video_path, processor, s=None, e=None, aspect_ratio='pad', num_frames=NUM_FRAMES,
+                  fast=False, num_threads=2, frame_filter=None):
+    """
+    Load and pre-process a video for the vision tower.
+
+    Args:
+        fast: keep decoded frames as one uint8 array and pre-process them with
+            `process_video_frames` instead of per-frame PIL images and `processor.preprocess`
+        num_threads: decord decoding threads
+        frame_filter: optional `frame_filter(decode, indices, first, last, key=video_path)` returning
+            the frames to keep (e.g. `src/utils/frame_dedup.FrameDeduplicator`) for decord videos;
+            the kept frames are not padded back to `num_frames`
+    """
     if isinstance(video_path, str):
         if s is not None and e is not None:
             s = s if s >= 0. else 0.
@@ -151,7 +236,7 @@ def process_video(video_path, processor, s=None, e=None, aspect_ratio='pad', num
             fps = 25
             num_frames_of_video = len(gif_reader)
         else:
-            vreader = VideoReader(video_path, num_threads=2)
+            vreader = VideoReader(video_path, num_threads=num_threads)
 
             fps = vreader.get_avg_fps()
             num_frames_of_video = len(vreader)
@@ -174,10 +259,17 @@ def process_video(video_path, processor, s=None, e=None, aspect_ratio='pad', num
         elif video_path.endswith('.gif'):
             video_data = [Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_RGBA2RGB)) for idx, frame in enumerate(gif_reader) if idx in sampled_frame_indices]
         else:
-            video_data = [Image.fromarray(frame) for frame in vreader.get_batch(sampled_frame_indices).asnumpy()]
+            if frame_filter is not None:
+                frames = frame_filter(lambda idx: vreader.get_batch(idx).asnumpy(), sampled_frame_indices,
+                                      f_start, f_end, key=video_path)
+                # keep the filtered frame count, padding back would re-add the dropped frames' cost
+                num_frames = None
+            else:
+                frames = vreader.get_batch(sampled_frame_indices).asnumpy()
+            video_data = frames if fast else [Image.fromarray(frame) for frame in frames]
 
     elif isinstance(video_path, np.ndarray):
-        video_data = [Image.fromarray(f) for f in video_path]
+        video_data = video_path if fast else [Image.fromarray(f) for f in video_path]
     elif isinstance(video_path, list) and isinstance(video_path[0], np.ndarray):
         video_data = [Image.fromarray(f) for f in video_path]
     elif isinstance(video_path, list) and isinstance(video_path[0], str):
@@ -187,6 +279,20 @@ def process_video(video_path, processor, s=None, e=None, aspect_ratio='pad', num
     else:
         raise ValueError(f"Unsupported video path type: {type(video_path)}")
 
+    if fast:
+        if not isinstance(video_data, np.ndarray):
+            video_data = np.stack([np.asarray(f.convert('RGB')) for f in video_data])
+        video = process_video_frames(video_data[:MAX_FRAMES], processor, aspect_ratio)
+        num_padding = min(num_frames or 0, MAX_FRAMES) - len(video)
+        if num_padding > 0:
+            # same black filler frames as below: each is shaped like the transposed previous frame,
+            # so they alternate between (width, height) and (height, width)
+            height, width = video_data.shape[1:3]
+            fillers = np.zeros((1, width, height, 3), dtype=np.uint8), np.zeros((1, height, width, 3), dtype=np.uint8)
+            fillers = [process_video_frames(f, processor, aspect_ratio) for f in fillers]
+            video = torch.cat([video] + [fillers[i % 2] for i in range(num_padding)])
+        return video
+
     while num_frames is not None and len(video_data) < num_frames:
         video_data.append(Image.fromarray(np.zeros((*video_data[-1].size, 3), dtype=np.uint8)))
 
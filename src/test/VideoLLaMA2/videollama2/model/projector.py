@@ -130,6 +130,54 @@ def build_mlp(depth, hidden_size, output_hidden_size):
     return nn.Sequential(*modules)
 
 
+def merge_temporal_tokens(x, t, threshold=None, token_budget=None):
+    """ToMe-style merging of temporally adjacent tokens at the same spatial position.
+
+    A token is merged into the token at the same position of the previous frame when their
+    cosine similarity exceeds `threshold`; merged runs are replaced by their mean, kept at the
+    position of their first frame. If more than `token_budget` tokens remain, the most similar
+    remaining adjacent pairs are merged as well (down to at most one token per position).
+
+    Args:
+        x: tokens [b, (t n), d] in (frame, position) order
+        t: number of frames
+        threshold: cosine similarity above which adjacent tokens are merged, None to only
+            merge down to `token_budget`
+        token_budget: maximum number of tokens per sample, None for no limit
+    Returns:
+        list of b merged token tensors [l_i, d], l_i depends on the sample's visual change
+    """
+    b, length, d = x.shape
+    n = length // t
+    merged = []
+    for tokens in x.view(b, t, n, d):
+        normed = F.normalize(tokens.float(), dim=-1)
+        # similarity of each token to the same position in the previous frame, [t - 1, n]
+        sim = (normed[1:] * normed[:-1]).sum(-1)
+        num_merge = int((sim > threshold).sum()) if threshold is not None else 0
+        if token_budget is not None:
+            num_merge = max(num_merge, length - token_budget)
+        num_merge = min(num_merge, sim.numel())
+        if num_merge == 0:
+            merged.append(tokens.reshape(length, d))
+            continue
+
+        is_start = torch.ones(t, n, dtype=torch.bool, device=x.device)
+        is_start[1:].view(-1)[sim.view(-1).topk(num_merge).indices] = False
+        # every token joins the run started by the last start token at its position
+        frame_idx = torch.arange(t, device=x.device).view(t, 1).expand(t, n)
+        run_start = torch.where(is_start, frame_idx, 0).cummax(dim=0).values
+        start_group = is_start.view(-1).cumsum(0).view(t, n) - 1
+        group = start_group.gather(0, run_start)
+
+        num_groups = int(is_start.sum())
+        sums = torch.zeros(num_groups, d, dtype=torch.float32, device=x.device)
+        sums.index_add_(0, group.view(-1), tokens.reshape(length, d).float())
+        counts = torch.bincount(group.view(-1), minlength=num_groups).unsqueeze(-1)
+        merged.append((sums / counts).to(x.dtype))
+    return merged
+
+
 class STCConnector(nn.Module):
 
     def __init__(self, config, downsample=(2, 2, 2), depth=4, mlp_depth=2):
@@ -142,6 +190,9 @@ class STCConnector(nn.Module):
             mlp_depth: depth of the vision-language projector layers.
         """
         super().__init__()
+        # optional post-projection temporal token merging, see `merge_temporal_tokens`
+        self.merge_threshold = getattr(config, "mm_token_merge_threshold", None)
+        self.token_budget = getattr(config, "mm_token_budget", None)
         self.encoder_hidden_size = encoder_hidden_size = config.mm_hidden_size
         self.hidden_size = hidden_size = config.hidden_size
         self.output_hidden_size = output_hidden_size = config.hidden_size
@@ -191,7 +242,8 @@ class STCConnector(nn.Module):
         Args:
             x: input tokens [b, t, h, w, d] / [b, t, l, d]
         Returns:
-            aggregated tokens [b, l, d]
+            aggregated tokens [b, l, d], or a list of b [l_i, d] tensors when token merging
+            (`merge_threshold` / `token_budget`) is enabled
         """
         t = x.size(1)
         if x.ndim == 4:
@@ -212,6 +264,8 @@ class STCConnector(nn.Module):
         x = self.s2(x)
         x = einops.rearrange(x, "(b t) d h w -> b (t h w) d", t=new_t)
         x = self.readout(x)
+        if self.merge_threshold is not None or self.token_budget is not None:
+            x = merge_temporal_tokens(x, new_t, self.merge_threshold, self.token_budget)
         return x
 
 
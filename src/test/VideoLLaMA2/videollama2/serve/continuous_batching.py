@@ -0,0 +1,234 @@
+"""
+Continuous batching for the model worker.
+
+Requests are prefilled one at a time and join the running decode batch at the next token
+boundary; finished or cancelled requests leave it at the same point. The key/value cache of
+the batch is kept left-padded to a common length, so requests with different (multimodal)
+prefix lengths decode together with a per-row attention mask and position ids.
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import torch
+import torch.nn.functional as F
+
+
+@dataclass
+class GenerationRequest:
+    input_ids: Optional[torch.Tensor]          # [L], may contain multimodal token indices
+    images: Optional[list] = None              # [(tensor, modal)] as passed to `model.generate`
+    inputs_embeds: Optional[torch.Tensor] = None  # [L, d], used instead of input_ids/images if given
+    max_new_tokens: int = 256
+    temperature: float = 0.0
+    top_p: float = 1.0
+    stop_token_ids: tuple = ()
+    output_ids: List[int] = field(default_factory=list)
+    cancelled: bool = False
+    arrival_time: float = field(default_factory=time.perf_counter)
+    first_token_time: Optional[float] = None
+    finish_time: Optional[float] = None
+    _output: queue.Queue = field(default_factory=queue.Queue, repr=False)
+
+    def cancel(self):
+        """Asks the scheduler to drop the request at the next token boundary."""
+        self.cancelled = True
+
+    def stream(self, timeout=None):
+        """Yields generated token ids as the scheduler produces them."""
+        while True:
+            item = self._output.get(timeout=timeout)
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def sample_tokens(logits, temperature, top_p):
+    """Samples one token per row of `logits` [B, V]; rows with temperature <= 0.001 are greedy."""
+    greedy = logits.argmax(-1)
+    do_sample = temperature > 0.001
+    if not do_sample.any():
+        return greedy
+    probs = torch.softmax(logits.float() / temperature.clamp(min=0.001)[:, None], dim=-1)
+    sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+    # nucleus filtering: keep the smallest prefix whose mass reaches top_p (always >= 1 token)
+    sorted_probs[(sorted_probs.cumsum(-1) - sorted_probs) > top_p[:, None]] = 0
+    sampled = sorted_ids.gather(-1, torch.multinomial(sorted_probs, 1)).squeeze(-1)
+    return torch.where(do_sample, sampled, greedy)
+
+
+class ContinuousBatchScheduler:
+    """Runs prefill and batched decoding of `GenerationRequest`s on a background thread.
+
+    Args:
+        model: a Videollama2*ForCausalLM (or any HF causal LM exposing `get_model()` and `lm_head`).
+        max_batch_size: maximum number of requests decoded together.
+        max_prefills_per_step: new requests admitted per token boundary, bounds the stall that
+            prefills (vision encoding + prompt) add to the running requests.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_prefills_per_step=1):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_prefills_per_step = max_prefills_per_step
+        self.waiting = queue.Queue()
+        self.running = []
+        self.past_key_values = None   # per layer (key, value), [B, heads, T, head_dim], left-padded
+        self.attention_mask = None    # [B, T]
+        self.num_steps = 0
+        self._thread = None
+        self._closed = False
+
+    def submit(self, input_ids=None, images=None, inputs_embeds=None, **kwargs):
+        request = GenerationRequest(input_ids=input_ids, images=images, inputs_embeds=inputs_embeds, **kwargs)
+        self.waiting.put(request)
+        return request
+
+    def num_requests(self):
+        return self.waiting.qsize() + len(self.running)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stops the background thread after the current step; running requests are not finished."""
+        self._closed = True
+        self.waiting.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+    def run(self):
+        while not self._closed:
+            self.step(block=True)
+
+    @torch.inference_mode()
+    def step(self, block=False):
+        """Admits waiting requests, then decodes one token for every running request.
+
+        With `block`, an idle scheduler waits for the next request instead of returning.
+        """
+        admitted = 0
+        while admitted < self.max_prefills_per_step and len(self.running) < self.max_batch_size:
+            try:
+                request = self.waiting.get(block=block and not self.running)
+            except queue.Empty:
+                break
+            if request is None:
+                break
+            if request.cancelled:
+                self._finish(request)
+                continue
+            admitted += 1
+            try:
+                self._prefill(request)
+            except Exception as e:
+                request._output.put(e)
+
+        if not self.running:
+            return
+        try:
+            self._decode()
+        except Exception as e:
+            for request in self.running:
+                request._output.put(e)
+            self.running, self.past_key_values, self.attention_mask = [], None, None
+        self.num_steps += 1
+
+    def _embed(self, request):
+        if request.inputs_embeds is not None:
+            return request.inputs_embeds.unsqueeze(0)
+        input_ids = request.input_ids.unsqueeze(0)
+        if request.images is not None:
+            _, _, _, inputs_embeds, _ = self.model.prepare_inputs_labels_for_multimodal(
+                input_ids, None, None, None, request.images)
+            return inputs_embeds
+        return self.model.get_model().embed_tokens(input_ids)
+
+    def _forward(self, inputs_embeds, **kwargs):
+        outputs = self.model.get_model()(inputs_embeds=inputs_embeds, use_cache=True, return_dict=True, **kwargs)
+        # only the last position is needed, skip the full-prefix vocabulary projection
+        logits = self.model.lm_head(outputs.last_hidden_state[:, -1])
+        return logits, outputs.past_key_values
+
+    def _sample(self, logits, requests):
+        temperature = torch.tensor([r.temperature for r in requests], device=logits.device)
+        top_p = torch.tensor([r.top_p for r in requests], device=logits.device)
+        return sample_tokens(logits, temperature, top_p).tolist()
+
+    def _emit(self, request, token):
+        """Streams `token`, returns True if the request is done."""
+        if request.first_token_time is None:
+            request.first_token_time = time.perf_counter()
+        request.output_ids.append(token)
+        request._output.put(token)
+        return token in request.stop_token_ids or len(request.output_ids) >= request.max_new_tokens
+
+    def _finish(self, request):
+        request.finish_time = time.perf_counter()
+        request._output.put(None)
+
+    def _prefill(self, request):
+        inputs_embeds = self._embed(request).to(self.model.device, self.model.dtype)
+        logits, past_key_values = self._forward(inputs_embeds)
+        if self._emit(request, self._sample(logits, [request])[0]) or request.cancelled:
+            self._finish(request)
+            return
+
+        length = inputs_embeds.shape[1]
+        mask = torch.ones(1, length, dtype=torch.long, device=inputs_embeds.device)
+        if not self.running:
+            self.past_key_values, self.attention_mask = tuple(past_key_values), mask
+        else:
+            # align the new prefix and the batch on the right by left-padding the shorter one
+            current = self.attention_mask.shape[1]
+            past_key_values, mask = _left_pad(past_key_values, mask, current - length)
+            batch_past, batch_mask = _left_pad(self.past_key_values, self.attention_mask, length - current)
+            self.past_key_values = tuple(
+                (torch.cat([k, new_k]), torch.cat([v, new_v]))
+                for (k, v), (new_k, new_v) in zip(batch_past, past_key_values))
+            self.attention_mask = torch.cat([batch_mask, mask])
+        self.running.append(request)
+
+    def _decode(self):
+        input_ids = torch.tensor([[r.output_ids[-1]] for r in self.running], device=self.model.device)
+        # pads are not counted, so every row continues from its own prefix length
+        position_ids = self.attention_mask.sum(-1, keepdim=True)
+        attention_mask = F.pad(self.attention_mask, (0, 1), value=1)
+        logits, self.past_key_values = self._forward(
+            self.model.get_model().embed_tokens(input_ids), attention_mask=attention_mask,
+            position_ids=position_ids, past_key_values=self.past_key_values)
+        self.attention_mask = attention_mask
+
+        keep = []
+        for i, (request, token) in enumerate(zip(self.running, self._sample(logits, self.running))):
+            if self._emit(request, token) or request.cancelled:
+                self._finish(request)
+            else:
+                keep.append(i)
+        if len(keep) < len(self.running):
+            self._evict(keep)
+
+    def _evict(self, keep):
+        self.running = [self.running[i] for i in keep]
+        if not keep:
+            self.past_key_values, self.attention_mask = None, None
+            return
+        index = torch.tensor(keep, device=self.attention_mask.device)
+        mask = self.attention_mask[index]
+        # drop the columns that are now padding for every remaining row
+        start = int(mask.any(0).long().argmax())
+        self.attention_mask = mask[:, start:]
+        self.past_key_values = tuple((k[index, :, start:], v[index, :, start:]) for k, v in self.past_key_values)
+
+
+def _left_pad(past_key_values, mask, pad):
+    if pad <= 0:
+        return past_key_values, mask
+    past_key_values = tuple((F.pad(k, (0, 0, pad, 0)), F.pad(v, (0, 0, pad, 0))) for k, v in past_key_values)
+    return past_key_values, F.pad(mask, (pad, 0), value=0)
@@ -258,8 +258,9 @@ def http_bot(state, model_selector, temperature, top_p, max_new_tokens, request:
 
     # Query worker address
     controller_url = args.controller_url
+    # prompt (with its <image>/<video> tags) and max_new_tokens let a least_work controller estimate the request cost
     ret = requests.post(controller_url + "/get_worker_address",
-            json={"model": model_name})
+            json={"model": model_name, "prompt": state.get_prompt(), "max_new_tokens": min(int(max_new_tokens), 1536)})
     worker_addr = ret.json()["address"]
     logger.info(f"model_name: {model_name}, worker_addr: {worker_addr}")
 
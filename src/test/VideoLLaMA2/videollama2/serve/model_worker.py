@@ -5,11 +5,13 @@ import os
 import json
 import time
 import uuid
+import base64
 import asyncio
 import requests
 import argparse
 import threading
 from threading import Thread
+from io import BytesIO
 from functools import partial
 from typing import Iterator, List, Optional, Tuple
 
@@ -18,18 +20,15 @@ from fastapi import FastAPI, Request, BackgroundTasks
 from fastapi.responses import StreamingResponse
 
 import torch
-import decord
-import numpy as np
-from PIL import Image
-from decord import VideoReader, cpu
 from transformers import TextIteratorStreamer
 
 from videollama2.constants import WORKER_HEART_BEAT_INTERVAL
 from videollama2.utils import (build_logger, server_error_msg, pretty_print_semaphore)
-from videollama2.model.builder import load_pretrained_model
-from videollama2.mm_utils import process_images, process_videos, load_image_from_base64, tokenizer_image_token, KeywordsStoppingCriteria, tokenizer_MMODAL_token
-from videollama2.mm_utils import chunk_list, frame_expansion
-from videollama2.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN, DEFAULT_VIDEO_TOKEN, NUM_FRAMES, MMODAL_TOKEN_INDEX
+from videollama2.model import load_pretrained_model
+from videollama2.mm_utils import process_image, process_video, tokenizer_multimodal_token, KeywordsStoppingCriteria
+from videollama2.constants import DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN, DEFAULT_VIDEO_TOKEN, NUM_FRAMES
+from videollama2.serve.continuous_batching import ContinuousBatchScheduler
+from videollama2.serve.request_cost import RequestCostModel
 
 
 GB = 1 << 30
@@ -87,7 +86,8 @@ class ModelWorker:
     def __init__(self, controller_addr, worker_addr,
                  worker_id, no_register,
                  model_path, model_base, model_name,
-                 load_8bit, load_4bit, device):
+                 load_8bit, load_4bit, device,
+                 continuous_batching=False, max_batch_size=8, max_prefills_per_step=1):
         self.controller_addr = controller_addr
         self.worker_addr = worker_addr
         self.worker_id = worker_id
@@ -108,6 +108,14 @@ class ModelWorker:
         self.tokenizer, self.model, self.image_processor, self.context_len = load_pretrained_model(
             model_path, model_base, self.model_name, load_8bit, load_4bit, device=self.device)
         self.is_multimodal = 'videollama2' in self.model_name.lower() or 'vlb' in self.model_name.lower()
+        self.num_frames = getattr(self.model.config, 'num_frames', NUM_FRAMES)
+        self.cost_model = RequestCostModel(default_num_frames=self.num_frames)
+        self.outstanding_cost = 0.0
+
+        self.scheduler = None
+        if continuous_batching:
+            logger.info(f"Continuous batching: max_batch_size={max_batch_size}, max_prefills_per_step={max_prefills_per_step}")
+            self.scheduler = ContinuousBatchScheduler(self.model, max_batch_size, max_prefills_per_step).start()
 
         if not no_register:
             self.register_to_controller()
@@ -138,7 +146,8 @@ class ModelWorker:
             try:
                 ret = requests.post(url, json={
                     "worker_name": self.worker_addr,
-                    "queue_length": self.get_queue_length()}, timeout=5)
+                    "queue_length": self.get_queue_length(),
+                    "outstanding_cost": self.outstanding_cost}, timeout=5)
                 exist = ret.json()["exist"]
                 break
             except requests.exceptions.RequestException as e:
@@ -160,92 +169,51 @@ class ModelWorker:
             "model_names": [self.model_name],
             "speed": 1,
             "queue_length": self.get_queue_length(),
+            "outstanding_cost": self.outstanding_cost,
         }
 
+    def finish_request(self, cost):
+        self.outstanding_cost -= cost
+        self.send_heart_beat()
+
+    def load_media(self, images_or_videos):
+        """Returns the `images` argument of `model.generate` and the modal token for a request.
+
+        Entries are base64 images; if they cannot be decoded, the first entry is read as a video path.
+        """
+        try:
+            print("Load image...")
+            images = [process_image(BytesIO(base64.b64decode(image)), self.image_processor, aspect_ratio=None)
+                      for image in images_or_videos]
+            images = [(image.to(self.model.device, dtype=self.model.dtype), "image") for image in images]
+            return images, DEFAULT_IMAGE_TOKEN
+        except Exception:
+            print("Load video instead...")
+            video = process_video(images_or_videos[0], self.image_processor, aspect_ratio=None, num_frames=self.num_frames)
+            print("Video:", video.shape)
+            return [(video.to(self.model.device, dtype=self.model.dtype), "video")], DEFAULT_VIDEO_TOKEN
+
     @torch.inference_mode()
     def generate_stream(self, params):
-        tokenizer, model, image_processor = self.tokenizer, self.model, self.image_processor
+        tokenizer, model = self.tokenizer, self.model
 
         prompt = params["prompt"]
         ori_prompt = prompt
         images_or_videos = params.get("images", None)
-        #print("Input images:", images_or_videos)
         num_image_tokens = 0
-        modal_list = []
+        images = None
+        modal_token = DEFAULT_IMAGE_TOKEN
         if images_or_videos is not None and len(images_or_videos) and self.is_multimodal:
-            if len(images_or_videos) > 0:
-                if len(images_or_videos) != prompt.count(DEFAULT_IMAGE_TOKEN) and len(images_or_videos) != (prompt.count(DEFAULT_VIDEO_TOKEN)):
-                    raise ValueError("Number of images/videos does not match number of <image>/<video> tokens in prompt")
-                
-                try:
-                    print("Load image...")
-                    images_or_videos = [load_image_from_base64(image) for image in images_or_videos]
-                    images_or_videos = process_images(images_or_videos, image_processor, model.config)
-                    
-                    modal_list = ["image"]
-                    replace_token = DEFAULT_IMAGE_TOKEN
-                    modal_token_index = MMODAL_TOKEN_INDEX["IMAGE"]
-                except:
-                    print("Load video instead...")
-                    decord_vr = VideoReader(uri=images_or_videos[0], ctx=cpu(0))
-                    duration = len(decord_vr)
-                    if not "use_taug" in self.model_path:
-                        frame_id_list = np.linspace(0, duration-1, 8, dtype=int)
-                        video_frames = decord_vr.get_batch(frame_id_list).asnumpy()
-                        images_or_videos = process_videos(video_frames, image_processor, model.config)
-                    else:
-                        print("Temporal augmentation activated!!!")
-                        frame_id_list = np.linspace(0, duration-1, 8 * 2 * 2, dtype=int)
-                        video_data = decord_vr.get_batch(frame_id_list)
-                        video_frames = [Image.fromarray(f) for f in video_data.asnumpy()]
-                        chunked_video_frames = chunk_list(video_frames, 2*2)
-                        expanded_video_frames = [frame_expansion(frame_list, 2) for frame_list in chunked_video_frames]
-                        images_or_videos = process_videos(expanded_video_frames, image_processor, model.config)
-
-                    # frame_id_list = np.linspace(0, duration-1, NUM_FRAMES, dtype=int)
-                    # images_or_videos = decord_vr.get_batch(frame_id_list).asnumpy()
-                    # images_or_videos = process_videos(images_or_videos, image_processor, model.config)
-                    #print("images_or_videos.shape:", images_or_videos.shape)
-                    modal_list = ["video"]
-                    replace_token = DEFAULT_VIDEO_TOKEN
-                    modal_token_index = MMODAL_TOKEN_INDEX["VIDEO"]
-                
-                if type(images_or_videos) is list:
-                    images_or_videos = [image.to(self.model.device, dtype=torch.float16) for image in images_or_videos]
-                else:
-                    images_or_videos = images_or_videos.to(self.model.device, dtype=torch.float16)
-                    if modal_list[0] == "video":
-                        print("Video:", images_or_videos.shape)
-                        images_or_videos = [images_or_videos]
-                    else:
-                        print("Image:", images_or_videos.shape)
-
-
-                #image_sizes = [image.size for image in images_or_videos]
-                
-
-                # if len(images_or_videos) % NUM_FRAMES == 0:
-                #     images_or_videos = process_images(images_or_videos, image_processor, model.config)
-                #     #images_or_videos = [image.to(self.model.device, dtype=torch.float16) for image in images_or_videos]
-                #     #modal_list = ["image"] * len(images_or_videos)
-                #     images_or_videos = images_or_videos.to(self.model.device, dtype=torch.float16)
-                #     modal_list = ["video"]
-                #     replace_token = DEFAULT_VIDEO_TOKEN
-                # else:
-                    
-                if getattr(self.model.config, 'mm_use_im_start_end', False):
-                    replace_token = DEFAULT_IM_START_TOKEN + replace_token + DEFAULT_IM_END_TOKEN
-                prompt = prompt.replace(DEFAULT_IMAGE_TOKEN, replace_token)
-
-                num_image_tokens = prompt.count(replace_token) * model.get_vision_tower().num_patches
-            else:
-                images = None
-                modal_list = []
-            image_args = {"images_or_videos": images_or_videos, "modal_list": modal_list}
-        else:
-            images = None
-            image_args = {}
-        print("image_args:", image_args)
+            if len(images_or_videos) != prompt.count(DEFAULT_IMAGE_TOKEN) and len(images_or_videos) != (prompt.count(DEFAULT_VIDEO_TOKEN)):
+                raise ValueError("Number of images/videos does not match number of <image>/<video> tokens in prompt")
+
+            images, modal_token = self.load_media(images_or_videos)
+            replace_token = modal_token
+            if getattr(self.model.config, 'mm_use_im_start_end', False):
+                replace_token = DEFAULT_IM_START_TOKEN + replace_token + DEFAULT_IM_END_TOKEN
+            prompt = prompt.replace(DEFAULT_IMAGE_TOKEN, replace_token)
+            num_image_tokens = prompt.count(modal_token) * model.get_vision_tower().num_patches
+
         temperature = float(params.get("temperature", 1.0))
         top_p = float(params.get("top_p", 1.0))
         max_context_length = getattr(model.config, 'max_position_embeddings', 2048)
@@ -253,14 +221,7 @@ class ModelWorker:
         stop_str = params.get("stop", None)
         do_sample = True if temperature > 0.001 else False
 
-        #input_ids = tokenizer_image_token(prompt, tokenizer, IMAGE_TOKEN_INDEX, return_tensors='pt').unsqueeze(0).to(self.device)
-        # tokenizer for our video-llama beta
-        input_ids = tokenizer_MMODAL_token(prompt, tokenizer, modal_token_index, return_tensors='pt').unsqueeze(0).to(self.device)
-        #print("Current prompt:", prompt)
-        #print("input_ids.shape:", input_ids.shape)
-        keywords = [stop_str]
-        stopping_criteria = KeywordsStoppingCriteria(keywords, tokenizer, input_ids)
-        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=15)
+        input_ids = tokenizer_multimodal_token(prompt, tokenizer, modal_token, return_tensors='pt').unsqueeze(0).to(self.device)
 
         max_new_tokens = min(max_new_tokens, max_context_length - input_ids.shape[-1] - num_image_tokens)
 
@@ -268,22 +229,31 @@ class ModelWorker:
             yield json.dumps({"text": ori_prompt + "Exceeds max token length. Please start a new conversation, thanks.", "error_code": 0}).encode() + b"\0"
             return
 
-        thread = Thread(target=model.generate, kwargs=dict(
-            inputs=input_ids,
-            do_sample=do_sample,
-            temperature=temperature,
-            top_p=top_p,
-            max_new_tokens=max_new_tokens,
-            streamer=streamer,
-            stopping_criteria=[stopping_criteria],
-            use_cache=True,
-            **image_args
-        ))
-        thread.start()
+        if self.scheduler is not None:
+            new_texts = self.stream_batched(input_ids[0], images, max_new_tokens, temperature, top_p)
+        else:
+            keywords = [stop_str or tokenizer.eos_token]
+            stopping_criteria = KeywordsStoppingCriteria(keywords, tokenizer, input_ids)
+            streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=15)
+            thread = Thread(target=model.generate, kwargs=dict(
+                inputs=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                images=images,
+                do_sample=do_sample,
+                temperature=temperature,
+                top_p=top_p,
+                max_new_tokens=max_new_tokens,
+                streamer=streamer,
+                stopping_criteria=[stopping_criteria],
+                use_cache=True,
+                pad_token_id=tokenizer.eos_token_id,
+            ))
+            thread.start()
+            new_texts = streamer
 
         generated_text = ori_prompt
         token_count = 0
-        for new_text in streamer:
+        for new_text in new_texts:
             generated_text += new_text
             token_count += len(tokenizer.encode(new_text))
             if token_count >= STREAM_CHECK_MULTIPLE:
@@ -291,14 +261,32 @@ class ModelWorker:
                 if safety_message:
                     print('####### Keyword alarm triggered:', generated_text)
                     yield json.dumps({"text": safety_message , "error_code": 1}).encode() + b"\0"
-                    return  
-                token_count = 0  # 
-                
+                    return
+                token_count = 0  #
 
-            if generated_text.endswith(stop_str):
-                generated_text = generated_text[:-len(stop_str)]
+            if stop_str and stop_str in generated_text[len(ori_prompt):]:
+                generated_text = generated_text[:generated_text.rindex(stop_str)]
+                yield json.dumps({"text": generated_text, "error_code": 0}).encode() + b"\0"
+                return
             yield json.dumps({"text": generated_text, "error_code": 0}).encode() + b"\0"
 
+    def stream_batched(self, input_ids, images, max_new_tokens, temperature, top_p):
+        """Submits a request to the continuous batching scheduler and yields its new text pieces."""
+        request = self.scheduler.submit(
+            input_ids, images=images, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p,
+            stop_token_ids=(self.tokenizer.eos_token_id,))
+        text = ""
+        try:
+            for _ in request.stream():
+                # decode the whole output so multi-token characters are emitted once complete
+                new_text = self.tokenizer.decode(request.output_ids, skip_special_tokens=True)
+                if len(new_text) > len(text) and not new_text.endswith("\ufffd"):
+                    yield new_text[len(text):]
+                    text = new_text
+        finally:
+            # client disconnected, stop string or safety check: free the batch slot
+            request.cancel()
+
     def generate_stream_gate(self, params):
         try:      
             input_text = params.get("prompt", "")
@@ -346,6 +334,9 @@ async def generate_stream(request: Request):
     global model_semaphore, global_counter
     global_counter += 1
     params = await request.json()
+    # queued requests count as well, they are released in finish_request
+    cost = worker.cost_model.estimate(params)
+    worker.outstanding_cost += cost
 
     if model_semaphore is None:
         model_semaphore = asyncio.Semaphore(args.limit_model_concurrency)
@@ -353,7 +344,7 @@ async def generate_stream(request: Request):
     worker.send_heart_beat()
     generator = worker.generate_stream_gate(params)
     background_tasks = BackgroundTasks()
-    background_tasks.add_task(partial(release_model_semaphore, fn=worker.send_heart_beat))
+    background_tasks.add_task(partial(release_model_semaphore, fn=partial(worker.finish_request, cost)))
     return StreamingResponse(generator, background=background_tasks)
 
 
@@ -374,6 +365,9 @@ if __name__ == "__main__":
     parser.add_argument("--device", type=str, default="cuda")
     parser.add_argument("--multi-modal", action="store_true", help="Multimodal mode is automatically detected with model name, please make sure `llava` is included in the model path.")
     parser.add_argument("--limit-model-concurrency", type=int, default=5)
+    parser.add_argument("--continuous-batching", action="store_true", help="Decode concurrent requests in one batch, admitting new ones at token boundaries. Set --limit-model-concurrency >= --max-batch-size.")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-prefills-per-step", type=int, default=1)
     parser.add_argument("--stream-interval", type=int, default=1)
     parser.add_argument("--no-register", action="store_true")
     parser.add_argument("--load-8bit", action="store_true")
@@ -393,5 +387,8 @@ if __name__ == "__main__":
                          args.model_name,
                          args.load_8bit,
                          args.load_4bit,
-                         args.device)
+                         args.device,
+                         args.continuous_batching,
+                         args.max_batch_size,
+                         args.max_prefills_per_step)
     uvicorn.run(app, host=args.host, port=args.port, log_level="info")
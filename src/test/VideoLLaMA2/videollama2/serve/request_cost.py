@@ -0,0 +1,62 @@
+"""
+Request cost estimates for cost-aware dispatch (controller `--dispatch-method least_work`).
+
+Costs are estimated seconds on a worker with `speed` 1. Workers report the summed estimate of
+the requests they hold in their heart beats, and the controller routes each request to the
+worker that would finish it first.
+"""
+import dataclasses
+
+from videollama2.constants import DEFAULT_IMAGE_TOKEN, DEFAULT_VIDEO_TOKEN, NUM_FRAMES
+
+
+@dataclasses.dataclass
+class RequestCostModel:
+    # LLM prefill, per prompt or visual token
+    prefill_token: float = 2e-4
+    # video decoding + preprocessing + vision encoder, per frame
+    frame: float = 0.03
+    # LLM tokens per frame after the STC connector (576 tokens for 8 frames)
+    frame_tokens: int = 72
+    # vision encoder + LLM tokens of one image
+    image: float = 0.05
+    image_tokens: int = 576
+    # decoding, per generated token
+    decode_token: float = 0.03
+    # average share of `max_new_tokens` that is actually generated
+    output_fraction: float = 0.5
+    chars_per_token: float = 4.0
+    # per-request overhead (HTTP, tokenization, streaming)
+    overhead: float = 0.05
+    # frames sampled from a video when the request does not say (`num_frames` of the model config)
+    default_num_frames: int = NUM_FRAMES
+
+    def estimate(self, params, output_tokens=None):
+        """Estimated cost of a `/worker_generate_stream` request.
+
+        Uses `prompt`, `images` and `max_new_tokens` of the request; clients that know more can add
+        `modality` ("text", "image", "video", optionally with a "_text" suffix) and `num_frames`.
+        `output_tokens` replaces the expected output length when it is known (e.g. in simulations).
+        """
+        prompt = params.get("prompt", "")
+        images = params.get("images") or []
+        modality = params.get("modality")
+        if modality is None:
+            if DEFAULT_VIDEO_TOKEN in prompt:
+                modality = "video"
+            elif images or DEFAULT_IMAGE_TOKEN in prompt:
+                modality = "image"
+            else:
+                modality = "text"
+
+        cost = self.overhead + len(prompt) / self.chars_per_token * self.prefill_token
+        if modality.startswith("video"):
+            num_frames = int(params.get("num_frames") or self.default_num_frames)
+            cost += num_frames * (self.frame + self.frame_tokens * self.prefill_token)
+        elif modality.startswith("image"):
+            num_images = max(len(images), prompt.count(DEFAULT_IMAGE_TOKEN), 1)
+            cost += num_images * (self.image + self.image_tokens * self.prefill_token)
+
+        if output_tokens is None:
+            output_tokens = min(int(params.get("max_new_tokens", 256)), 1024) * self.output_fraction
+        return cost + output_tokens * self.decode_token
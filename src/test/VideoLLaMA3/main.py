@@ -1,6 +1,6 @@
 import os
+import sys
 import json
-from tqdm import tqdm
 from transformers import AutoModelForCausalLM, AutoProcessor, AutoModel, AutoImageProcessor
 import torch
 import cv2
@@ -8,6 +8,11 @@ import tempfile
 import numpy as np
 import subprocess
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+from src.utils.video_scheduler import VideoGroupScheduler
+from src.utils.prefix_kv_cache import PrefixKVCache
+from src.utils.frame_dedup import from_env, VISION_FLOPS_PER_FRAME
+
 # ====== 初始化模型 ======
 MODEL_PATH = "./models/VideoLLaMA3-7B"
 model = AutoModelForCausalLM.from_pretrained(
@@ -19,29 +24,29 @@ model = AutoModelForCausalLM.from_pretrained(
 )
 processor = AutoProcessor.from_pretrained(MODEL_PATH, trust_remote_code=True)
 USE_AUDIO_IN_VIDEO = True
+# PREFIX_CACHE=1：视频放在问题之前，每个视频只 prefill 一次视频前缀，各问题复用其 KV cache
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "0") == "1"
+# FRAME_DEDUP=1：对 processor.load_video 解码出的帧按感知哈希去掉近重复帧（时间戳同步删除）
+FRAME_DEDUP = from_env(flops_per_frame=VISION_FLOPS_PER_FRAME["videollama3"])
 
 # ====== 文件路径 ======
 current_tasks = ["1intra_event_reasoning", "3audio_visual_alignment", "5topic_stance_evolution_summarization", "4timeline_reconstruction", "6cross_event_causality", "2multimodal_temporal_localization"]
-for current_task in current_tasks:
-    INPUT_FILE = f"./final_qa_subset/{current_task}.json"
-    OUTPUT_FILE = f"./experiment_frames/videollama_7b/32/{current_task}.json"
-    VIDEO_ROOT = "./datasets/finevideo/videos"
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-
-    # ====== 读取已有结果 ======
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-            results = json.load(f)
-    else:
-        results = {}
-
-    # ====== 读取 QA 数据 ======
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        qa_data = json.load(f)
+VIDEO_ROOT = "./datasets/finevideo/videos"
+
+# ====== 按视频分组（已有结果自动跳过） ======
+scheduler = VideoGroupScheduler(
+    current_tasks,
+    input_pattern="./final_qa_subset/{task}.json",
+    output_pattern="./experiment_frames/videollama_7b"
+                   + ("_prefix_cache" if PREFIX_CACHE else "")
+                   + ("_dedup" if FRAME_DEDUP is not None else "")
+                   + "/32/{task}.json",
+    video_root=VIDEO_ROOT,
+)
 
-    SYSTEM_PROMPT = "You are an expert in long video understanding. Always base your answers strictly on the video content."
+SYSTEM_PROMPT = "You are an expert in long video understanding. Always base your answers strictly on the video content."
 
-    USER_PROMPT = """
+USER_PROMPT = """
     Each question may have one or more correct answer(s). Please think step-by-step, and then output the **option label(s)** ('A','B','C','D') and a **brief explanation** that explain the reason for your choices.
 
     question: {question}
@@ -52,53 +57,75 @@ for current_task in current_tasks:
     "reason": your explanation
     """
 
-    for qa in tqdm(qa_data):
-        qid = qa["question_id"]
-        question = qa["question"]
-        video_id = qa["related_videoID"]
-        options = qa.get("options", "")
-        if qid in results:
-            continue
-
-        try:
-            category, idx = video_id.rsplit("_", 1)
-            video_path = os.path.join(VIDEO_ROOT, category, f"sample_{idx}.mp4")
-        except Exception as e:
-            print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-            continue
-
-        if not os.path.exists(video_path):
-            print(f"⚠️ 视频不存在: {video_path}")
-            continue
-
-        # ====== 构造 messages ======
-        messages = [
-            {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": USER_PROMPT.format(question=question, options=options)},
-                    {"type": "video", "video": {"video_path": video_path, "fps": 1, "max_frames": 32}}
-                ]
-            }
-        ]
-
-        inputs = processor(conversation=messages, return_tensors="pt")
-        inputs = {k: v.cuda() if isinstance(v, torch.Tensor) else v for k, v in inputs.items()}
-        if "pixel_values" in inputs:
-            inputs["pixel_values"] = inputs["pixel_values"].to(torch.bfloat16)
-        output_ids = model.generate(**inputs, max_new_tokens=2048)
-        response = processor.batch_decode(output_ids, skip_special_tokens=True)[0].strip()
-
-        results[qid] = {
-            "question_id": qid,
-            "question": question,
-            "options": options,
-            "video_id": video_id,
-            "model_answer": response
+# ====== 视频解码缓存 ======
+# processor(conversation=...) 内部通过 processor.load_video 解码抽帧；
+# 这里让它对当前视频直接返回已解码的帧，同一视频的后续问题不再重复解码
+_load_video = processor.load_video
+_decoded = {}
+
+
+def _cached_load_video(video_path, **kwargs):
+    key = (video_path, tuple(sorted(kwargs.items())))
+    if key not in _decoded:
+        return _load_video(video_path, **kwargs)
+    return _decoded[key]
+
+
+processor.load_video = _cached_load_video
+
+
+def dedup_frames(decoded, key):
+    """(frames, timestamps) -> 去掉近重复帧后的 (frames, timestamps)，frames 为 [T, C, H, W] 或 [T, H, W, C]"""
+    frames, timestamps = decoded
+    array = np.stack(frames) if isinstance(frames, list) else np.asarray(frames)
+    channels_first = array.shape[1] in (1, 3) and array.shape[-1] not in (1, 3)
+    kept = FRAME_DEDUP.filter(array.transpose(0, 2, 3, 1) if channels_first else array, key=key).kept
+    frames = [frames[i] for i in kept] if isinstance(frames, list) else frames[kept]
+    return frames, [timestamps[i] for i in kept]
+
+
+def load_media(video_path):
+    video = {"video_path": video_path, "fps": 1, "max_frames": 32}
+    kwargs = {k: v for k, v in video.items() if k != "video_path"}
+    _decoded.clear()
+    decoded = _load_video(video_path, **kwargs)
+    if FRAME_DEDUP is not None:
+        decoded = dedup_frames(decoded, video_path)
+    _decoded[(video_path, tuple(sorted(kwargs.items())))] = decoded
+    return video
+
+
+if PREFIX_CACHE:
+    # VideoLLaMA3 自定义的 generate 会重新跑视觉编码器，这里改用词向量 + KV cache 生成
+    prefix_cache = PrefixKVCache(model, [model.config.image_token_index], embed_inputs=True)
+
+
+def answer(video, qa):
+    # ====== 构造 messages ======
+    text = {"type": "text", "text": USER_PROMPT.format(question=qa["question"], options=qa.get("options", ""))}
+    video_item = {"type": "video", "video": video}
+    messages = [
+        {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
+        {
+            "role": "user",
+            "content": [video_item, text] if PREFIX_CACHE else [text, video_item]
         }
+    ]
+
+    inputs = processor(conversation=messages, return_tensors="pt")
+    inputs = {k: v.cuda() if isinstance(v, torch.Tensor) else v for k, v in inputs.items()}
+    if "pixel_values" in inputs:
+        inputs["pixel_values"] = inputs["pixel_values"].to(torch.bfloat16)
+    if PREFIX_CACHE:
+        output_ids = prefix_cache.generate(inputs, max_new_tokens=2048)
+    else:
+        output_ids = model.generate(**inputs, max_new_tokens=2048)
+    return processor.batch_decode(output_ids, skip_special_tokens=True)[0].strip()
 
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
 
-    print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
+scheduler.run(prepare=load_media, answer=answer, desc="VideoLLaMA3")
+if PREFIX_CACHE:
+    print(f"🧠 前缀 KV cache: {prefix_cache.stats()}")
+if FRAME_DEDUP is not None:
+    print(f"🎞️ 帧去重: {FRAME_DEDUP.stats()}")
+    FRAME_DEDUP.dump(os.path.join(os.path.dirname(scheduler.output_files[current_tasks[0]]), "frame_dedup.json"))
@@ -1,17 +1,14 @@
-from google import genai
 from google.genai import types
 import os
 import subprocess
 import json
-from tqdm import tqdm
+import asyncio
 from pydantic import BaseModel
 import base64
 import ffmpeg
+from src.utils.llm_client import AsyncLLMClient
 
-client = genai.Client(
-    api_key=os.getenv('LLM_API_KEY'),
-    http_options=types.HttpOptions(base_url=os.getenv('LLM_BASE_URL'))
-)
+llm = AsyncLLMClient("gemini")
 
 USER_PROMPT = """
 You are an expert in long video understanding. Always base your answers strictly on the video content.
@@ -131,13 +128,13 @@ for current_task in current_tasks:
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
         qa_data = json.load(f)
 
-    for qa in tqdm(qa_data):
+    async def answer_qa(qa):
         qid = qa["question_id"]
         question = qa["question"]
         video_id = qa["related_videoID"]
         options = qa.get("options", "")
         if qid in results:
-            continue
+            return
 
         try:
             category, idx = video_id.rsplit("_", 1)
@@ -145,13 +142,14 @@ for current_task in current_tasks:
             audio_path = os.path.join(AUDIO_ROOT, category, f"sample_{idx}.wav")
         except Exception as e:
             print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-            continue
+            return
 
         print("Processing video:", video_id)
 
         # 预处理视频和音频
         try:
-            video_no_audio_b64, audio_b64 = preprocess_video_for_gemini(
+            video_no_audio_b64, audio_b64 = await asyncio.to_thread(
+                preprocess_video_for_gemini,
                 video_path,
                 audio_path,
                 output_size="480x270",  # 尝试更低的分辨率
@@ -162,7 +160,7 @@ for current_task in current_tasks:
             )
         except Exception as e:
             print(f"⚠️ 视频/音频预处理失败，跳过 {qid}。异常: {e}")
-            continue
+            return
         
         # 2. 准备视频 Part
         video_part = types.Part(
@@ -182,7 +180,7 @@ for current_task in current_tasks:
         )
 
         # 4. 组合成 contents 列表
-        response = client.models.generate_content(
+        response = await llm.generate_content(
             model="gemini-2.5-flash",
             contents=[
                 types.Content(parts=[video_part, audio_part]), # 同时传入视频和音频
@@ -213,4 +211,6 @@ for current_task in current_tasks:
         with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
 
+    asyncio.run(llm.run_all(answer_qa, qa_data, desc="QA 推理"))
+    print(f"API 调用统计: {llm.report()}")
     print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
@@ -0,0 +1,99 @@
+"""
+对比逐帧 process_anyres_video 与整批 process_anyres_video_batch 的数值一致性和 CPU 耗时。
+
+环境变量与 inference/main.py 保持一致；不加 --video 时用随机帧，覆盖 "缩放"（720p）和 "填充到步长"（360p）两条分支。
+用法（在 ola7b 目录下）:
+    python inference/check_video_preprocess.py --frames 64 128
+    python inference/check_video_preprocess.py --video ./datasets/finevideo/videos/xxx/sample_1.mp4
+"""
+import os
+os.environ['VIDEO_RESIZE'] = "0x64"
+os.environ['VIDEO_MAXRES'] = "480"
+os.environ['VIDEO_MINRES'] = "288"
+os.environ['PAD2STRIDE'] = '1'
+import sys
+sys.path.append('./')
+import time
+import argparse
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import CLIPImageProcessor
+
+from ola.mm_utils import process_anyres_video, process_anyres_video_batch
+
+
+def load_image_processor():
+    # 与 oryx_vit.load_model 中的设置一致
+    try:
+        processor = CLIPImageProcessor.from_pretrained("openai/clip-vit-large-patch14")
+    except OSError:
+        # 离线时用默认配置（与 clip-vit-large-patch14 的 preprocessor_config 相同，resize/crop 下面也会关闭）
+        processor = CLIPImageProcessor()
+    processor.image_mean = [0.5, 0.5, 0.5]
+    processor.image_std = [0.5, 0.5, 0.5]
+    processor.do_resize = False
+    processor.do_center_crop = False
+    return processor
+
+
+def per_frame(frames, processor):
+    video = [Image.fromarray(frame) for frame in frames]
+    return torch.cat([process_anyres_video(frame, processor).unsqueeze(0) for frame in video], dim=0)
+
+
+def batched(frames, processor):
+    return process_anyres_video_batch(frames, processor).unsqueeze(1)
+
+
+def compare(name, frames, processor, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        ref = per_frame(frames, processor)
+    t_ref = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = batched(frames, processor)
+    t_out = (time.perf_counter() - start) / repeat
+
+    assert ref.shape == out.shape, (ref.shape, out.shape)
+    diff = (ref - out).abs()
+    # 像素值误差（uint8 级别），归一化后 1 级 = rescale_factor / std
+    level = processor.rescale_factor / processor.image_std[0]
+    print(f"{name}: frames={frames.shape} -> {tuple(out.shape)} | "
+          f"max |diff|={diff.max().item():.4g} ({diff.max().item() / level:.2f} 级), "
+          f"mean={diff.mean().item():.3g}, 差异像素比例={(diff > 1e-6).float().mean().item():.4f} | "
+          f"逐帧 {t_ref * 1000:.1f}ms, 整批 {t_out * 1000:.1f}ms, x{t_ref / t_out:.1f}")
+    return diff.max().item() / level
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--video", default=None)
+    parser.add_argument("--frames", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1.0, help="允许的最大误差（uint8 级）")
+    args = parser.parse_args()
+
+    processor = load_image_processor()
+    rng = np.random.default_rng(0)
+    worst = 0.0
+    for num_frames in args.frames:
+        if args.video:
+            from decord import VideoReader, cpu
+            vr = VideoReader(args.video, ctx=cpu(0))
+            idx = np.linspace(0, len(vr) - 1, num_frames, dtype=int).tolist()
+            cases = {os.path.basename(args.video): vr.get_batch(idx).asnumpy()}
+        else:
+            cases = {
+                "720p (resize)": rng.integers(0, 256, (num_frames, 720, 1280, 3), dtype=np.uint8),
+                "360p (pad)": rng.integers(0, 256, (num_frames, 360, 640, 3), dtype=np.uint8),
+            }
+        for name, frames in cases.items():
+            worst = max(worst, compare(name, frames, processor, args.repeat))
+
+    status = "✅ 一致" if worst <= args.tolerance else "❌ 超出容差"
+    print(f"{status}: 最大误差 {worst:.2f} 级（容差 {args.tolerance} 级）")
+    sys.exit(0 if worst <= args.tolerance else 1)
@@ -11,8 +11,11 @@ os.environ['LOAD_VISION_EARLY'] = '1'
 os.environ['PAD2STRIDE'] = '1'
 import sys
 sys.path.append('./')
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../..")))
 import json
-from tqdm import tqdm
+import time
+import queue
+from collections import OrderedDict
 import torch
 import argparse
 
@@ -25,15 +28,16 @@ from ola.datasets.preprocess import (
 from ola.constants import (
     IGNORE_INDEX, DEFAULT_IMAGE_TOKEN, IMAGE_TOKEN_INDEX, DEFAULT_SPEECH_TOKEN, SPEECH_TOKEN_INDEX
 )
-from ola.mm_utils import KeywordsStoppingCriteria, process_anyres_video, process_anyres_highres_image
+from ola.mm_utils import KeywordsStoppingCriteria, process_anyres_video, process_anyres_highres_image, process_anyres_video_batch
 from ola.conversation import SeparatorStyle
 from decord import VideoReader, cpu
 from PIL import Image
 import numpy as np
-import moviepy.editor as mpy
-# from moviepy import editor as mpy
-import librosa
 import whisper
+from tqdm import tqdm
+
+from src.utils.video_scheduler import VideoGroupScheduler, new_stats
+from src.utils.frame_dedup import from_env, VISION_FLOPS_PER_FRAME
 
 USER_PROMPT = """
 You are an expert in long video understanding. Always base your answers strictly on the video content.
@@ -48,12 +52,13 @@ Output format:
     "reason": your explanation
 """
 
+# 整批视频预处理（process_anyres_video_batch），默认关闭走逐帧 process_anyres_video；
+# 打开前先用 inference/check_video_preprocess.py 在目标机器上确认与逐帧结果一致且更快
+BATCH_VIDEO_PREPROCESS = os.environ.get("OLA_BATCH_VIDEO_PREPROCESS", "0") == "1"
+
 # ========= 函数部分 =========
-def load_audio(audio_file_name):
-    speech_wav, samplerate = librosa.load(audio_file_name, sr=16000)
-    if len(speech_wav.shape) > 1:
-        speech_wav = speech_wav[:, 0]
-    speech_wav = speech_wav.astype(np.float32)
+def speech_features(speech_wav):
+    """16k 单声道波形 -> whisper mel 分块（最多 25 块，每块 30s）"""
     CHUNK_LIM = 480000
 
     speechs, speech_wavs = [], []
@@ -86,30 +91,74 @@ def load_audio(audio_file_name):
     return mels, speech_length, speech_chunks, speech_wavs
 
 
-def extract_audio(video_path):
-    my_clip = mpy.VideoFileClip(video_path)
-    return my_clip.audio
+# 按视频缓存 mel 分块（CPU 张量）。OlaSession.run 对每个视频依次跑完所有帧数设置，
+# 同一视频的各帧数设置相邻执行，只需保留最近一个视频
+MEL_CACHE_SIZE = 1
+_mel_cache = OrderedDict()
+
 
+def load_video_audio(video_path):
+    """
+    用 ffmpeg 管道把音轨直接解码成 16k 单声道 float32 数组（whisper.load_audio），不写临时 wav，
+    多个进程可以同时运行；得到的 mel 分块按视频缓存。
+    """
+    if video_path in _mel_cache:
+        _mel_cache.move_to_end(video_path)
+        return _mel_cache[video_path]
+    features = speech_features(whisper.load_audio(video_path, sr=16000))
+    _mel_cache[video_path] = features
+    if len(_mel_cache) > MEL_CACHE_SIZE:
+        _mel_cache.popitem(last=False)
+    return features
 
-def ask_model(model, tokenizer, image_processor, video_path, text):
-    """核心推理函数，输入视频和问题，返回模型答案"""
 
-    modality = "video"
+def load_media(video_path, image_processor, num_frames=64, frame_filter=None):
+    """
+    抽帧、音频与视频预处理，每个视频只做一次，结果供该视频的所有问题复用
+    frame_filter: 可选的帧去重（src/utils/frame_dedup.FrameDeduplicator），保留帧数随画面变化
+    """
+
     visual = video_path
 
     # 抽帧
     vr = VideoReader(visual, ctx=cpu(0))
     total_frame_num = len(vr)
-    uniform_sampled_frames = np.linspace(0, total_frame_num - 1, 64, dtype=int)
+    uniform_sampled_frames = np.linspace(0, total_frame_num - 1, num_frames, dtype=int)
     frame_idx = uniform_sampled_frames.tolist()
-    spare_frames = vr.get_batch(frame_idx).asnumpy()
-    video = [Image.fromarray(frame) for frame in spare_frames]
+    if frame_filter is not None:
+        spare_frames = frame_filter(lambda idx: vr.get_batch(idx).asnumpy(), frame_idx, 0, total_frame_num - 1,
+                                    key=f"{video_path}@{num_frames}")
+    else:
+        spare_frames = vr.get_batch(frame_idx).asnumpy()
 
     # 音频
-    audio = extract_audio(visual)
-    audio.write_audiofile("./video_audio.wav")
-    video_audio_path = './video_audio.wav'
-    speech, speech_length, speech_chunk, speech_wav = load_audio(video_audio_path)
+    speech, speech_length, speech_chunk, speech_wav = load_video_audio(visual)
+
+    # 视频预处理
+    image_processor.do_resize = False
+    image_processor.do_center_crop = False
+    if BATCH_VIDEO_PREPROCESS:
+        video_processed = process_anyres_video_batch(spare_frames, image_processor).unsqueeze(1)
+    else:
+        video = [Image.fromarray(frame) for frame in spare_frames]
+        video_processed = []
+        for idx, frame in enumerate(video):
+            frame = process_anyres_video(frame, image_processor)
+            video_processed.append(frame.unsqueeze(0))
+        video_processed = torch.cat(video_processed, dim=0)
+    video_processed = video_processed.bfloat16().to("cuda")
+
+    return {
+        "video": video_processed,
+        "speech": speech.bfloat16().to('cuda'),
+        "speech_length": speech_length.to('cuda'),
+        "speech_chunk": speech_chunk.to('cuda'),
+        "speech_wav": speech_wav.to('cuda'),
+    }
+
+
+def ask_model(model, tokenizer, media, text):
+    """核心推理函数，输入 load_media 得到的音视频和问题，返回模型答案"""
 
     # 拼接 prompt
     qs = DEFAULT_SPEECH_TOKEN + DEFAULT_IMAGE_TOKEN + "\n" + text
@@ -120,16 +169,6 @@ def ask_model(model, tokenizer, image_processor, video_path, text):
 
     input_ids = tokenizer_speech_image_token(prompt, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to('cuda')
 
-    # 视频预处理
-    video_processed = []
-    for idx, frame in enumerate(video):
-        image_processor.do_resize = False
-        image_processor.do_center_crop = False
-        frame = process_anyres_video(frame, image_processor)
-        video_processed.append(frame.unsqueeze(0))
-    video_processed = torch.cat(video_processed, dim=0).bfloat16().to("cuda")
-    video_processed = (video_processed, video_processed)
-
     # 生成
     attention_masks = input_ids.ne(151643).long().to('cuda')
     stop_str = conv.sep if conv.sep_style != SeparatorStyle.TWO else conv.sep2
@@ -138,13 +177,13 @@ def ask_model(model, tokenizer, image_processor, video_path, text):
     with torch.inference_mode():
         output_ids = model.generate(
             inputs=input_ids,
-            images=video_processed[0],
-            images_highres=video_processed[1],
+            images=media["video"],
+            images_highres=media["video"],
             modalities="video",
-            speech=[speech.bfloat16().to('cuda')],
-            speech_lengths=[speech_length.to('cuda')],
-            speech_chunks=[speech_chunk.to('cuda')],
-            speech_wav=[speech_wav.to('cuda')],
+            speech=[media["speech"]],
+            speech_lengths=[media["speech_length"]],
+            speech_chunks=[media["speech_chunk"]],
+            speech_wav=[media["speech_wav"]],
             attention_mask=attention_masks,
             stopping_criteria=[stopping_criteria],
             max_new_tokens=2048,
@@ -158,6 +197,86 @@ def ask_model(model, tokenizer, image_processor, video_path, text):
     return outputs.strip()
 
 
+class OlaSession:
+    """
+    常驻的 Ola 推理会话：权重只加载一次，之后依次执行队列中的 (任务文件, 帧数, 输出路径) 作业，
+    六个任务以及 32/64/128 帧消融可以在同一个进程里跑完。
+    相同帧数的作业合并后按视频分组，各帧数设置按视频交错执行（每个视频的音频只处理一次）；
+    模型加载耗时与每题推理耗时分开统计。
+    """
+
+    def __init__(self, model_path, video_root, frame_dedup=None):
+        start = time.perf_counter()
+        self.tokenizer, self.model, self.image_processor, _ = load_pretrained_model(model_path, None)
+        self.model = self.model.to("cuda").eval().bfloat16()
+        self.load_time = time.perf_counter() - start
+        print(f"🚀 Ola 模型加载耗时 {self.load_time:.1f}s")
+        self.video_root = video_root
+        self.jobs = queue.Queue()
+        self.stats = OrderedDict()
+        self.frame_dedup = frame_dedup
+
+    def submit(self, task_file, num_frames, output_file):
+        self.jobs.put((task_file, int(num_frames), output_file))
+
+    def answer(self, media, qa):
+        # 拼接问题
+        prompt = USER_PROMPT.format(question=qa["question"], options=qa.get("options", ""))
+        return ask_model(self.model, self.tokenizer, media, prompt)
+
+    def run(self):
+        """取出当前队列里的全部作业并执行"""
+        by_frames = OrderedDict()
+        while not self.jobs.empty():
+            task_file, num_frames, output_file = self.jobs.get_nowait()
+            files = by_frames.setdefault(num_frames, OrderedDict())
+            name = os.path.splitext(os.path.basename(task_file))[0]
+            files[name if name not in files else output_file] = (task_file, output_file)
+
+        # 按视频为主序：一个视频的所有帧数设置连续处理，音频解码和 mel 只做一次
+        schedulers = OrderedDict()
+        groups = OrderedDict()
+        for num_frames, files in by_frames.items():
+            schedulers[num_frames] = VideoGroupScheduler.from_files(files, self.video_root)
+            groups[num_frames] = schedulers[num_frames].pending_groups()
+            print(f"===== {num_frames} 帧: {len(files)} 个任务文件，"
+                  f"{sum(len(v) for v in groups[num_frames].values())} 个待回答问题 =====")
+            self.stats[num_frames] = new_stats()
+
+        video_ids = OrderedDict.fromkeys(video_id for g in groups.values() for video_id in g)
+        for video_id in tqdm(video_ids, desc=f"Ola {'/'.join(map(str, by_frames))} frames"):
+            for num_frames, scheduler in schedulers.items():
+                if video_id not in groups[num_frames]:
+                    continue
+                scheduler.run_group(
+                    video_id, groups[num_frames][video_id],
+                    prepare=lambda video_path: load_media(video_path, self.image_processor, num_frames,
+                                                          frame_filter=self.frame_dedup),
+                    answer=self.answer,
+                    stats=self.stats[num_frames],
+                )
+        for num_frames, scheduler in schedulers.items():
+            print(f"===== {num_frames} 帧 =====")
+            scheduler.summary(self.stats[num_frames])
+        self.report()
+
+    def report(self):
+        print(f"📊 模型加载 {self.load_time:.1f}s（只加载一次）")
+        for num_frames, st in self.stats.items():
+            per_video = st["prepare_time"] / max(st["videos"], 1)
+            per_question = st["answer_time"] / max(st["questions"], 1)
+            print(f"📊 {num_frames} 帧: {st['videos']} 个视频，预处理 {per_video:.2f}s/视频；"
+                  f"{st['questions']} 个问题，推理 {per_question:.2f}s/题")
+        if self.frame_dedup is not None:
+            print(f"🎞️ 帧去重: {self.frame_dedup.stats()}")
+
+
+def load_jobs(path):
+    """jsonl，每行 {"task_file": ..., "num_frames": ..., "output_file": ...}"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
 # ========= 主逻辑 =========
 if __name__ == "__main__":
     MODEL_PATH = "./models/Ola-7b"  
@@ -167,66 +286,30 @@ if __name__ == "__main__":
                     "4timeline_reconstruction", 
                     "5topic_stance_evolution_summarization", 
                     "6cross_event_causality"] 
-    for curren_task in curren_tasks:
-        print(f"===== 处理任务: {curren_task} =====")
-        INPUT_FILE = f"./final_qa_subset/{curren_task}.json"
-        OUTPUT_FILE = f"./experiment_frames/ola7b_raw/64/{curren_task}.json"
-        VIDEO_ROOT = "./datasets/finevideo/videos"
-        os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-
-        # 加载模型
-        tokenizer, model, image_processor, _ = load_pretrained_model(MODEL_PATH, None)
-        model = model.to("cuda").eval().bfloat16()
-
-        # 已有结果
-        if os.path.exists(OUTPUT_FILE):
-            with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-                results = json.load(f)
-        else:
-            results = {}
-
-        with open(INPUT_FILE, "r", encoding="utf-8") as f:
-            qa_data = json.load(f)
-
-        for qa in tqdm(qa_data):
-            qid = qa["question_id"]
-            question = qa["question"]
-            video_id = qa["related_videoID"]
-            options = qa.get("options", "")
-
-            if qid in results:
-                continue
-
-            try:
-                category, idx = video_id.rsplit("_", 1)
-                video_path = os.path.join(VIDEO_ROOT, category, f"sample_{idx}.mp4")
-            except Exception as e:
-                print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-                continue
-
-            if not os.path.exists(video_path):
-                print(f"⚠️ 视频不存在: {video_path}")
-                continue
-
-            # 拼接问题
-            prompt = USER_PROMPT.format(question=question, options=options)
-
-            # 调用 Ola 模型
-            try:
-                answer = ask_model(model, tokenizer, image_processor, video_path, prompt)
-            except Exception as e:
-                print(f"⚠️ 推理失败: {video_id}, 异常: {e}")
-                continue
-
-            results[qid] = {
-                "question_id": qid,
-                "question": question,
-                "options": options,
-                "video_id": video_id,
-                "model_answer": answer
-            }
-
-            with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-
-        print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
+    VIDEO_ROOT = "./datasets/finevideo/videos"
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, nargs="+", default=[64],
+                        help="帧数设置，每个帧数对六个任务各生成一个作业，如 --frames 32 64 128")
+    parser.add_argument("--jobs", default=None, help="作业列表 jsonl，指定后忽略 --frames")
+    args = parser.parse_args()
+
+    # FRAME_DEDUP=1：抽帧后按感知哈希去掉近重复帧（可用采样区间内的其它帧替换）再做视觉编码
+    frame_dedup = from_env(flops_per_frame=VISION_FLOPS_PER_FRAME["ola"])
+
+    # 加载模型（整个进程只加载一次）
+    session = OlaSession(MODEL_PATH, VIDEO_ROOT, frame_dedup=frame_dedup)
+    output_root = "./experiment_frames/ola7b_raw" + ("_dedup" if frame_dedup is not None else "")
+
+    if args.jobs:
+        for job in load_jobs(args.jobs):
+            session.submit(job["task_file"], job["num_frames"], job["output_file"])
+    else:
+        for num_frames in args.frames:
+            for curren_task in curren_tasks:
+                session.submit(f"./final_qa_subset/{curren_task}.json", num_frames,
+                               f"{output_root}/{num_frames}/{curren_task}.json")
+
+    session.run()
+    if frame_dedup is not None:
+        frame_dedup.dump(f"{output_root}/frame_dedup.json")
@@ -4,6 +4,7 @@ import math
 import ast
 
 import torch
+import numpy as np
 from transformers import StoppingCriteria
 import os
 import io
@@ -142,8 +143,14 @@ def resize_images(image, patch_size=14, base_size=896):
 
     return image
 
-def resize_video(image, patch_size=14, base_size=896):
-    h, w = image.size
+def video_target_size(h, w, patch_size=14, base_size=896):
+    """
+    Target size used by `resize_video`, shared with the batched video path.
+    `h, w` follow `resize_video`'s convention (`h, w = image.size`, i.e. width first).
+
+    Returns:
+        ("resize" | "pad", new_h, new_w)
+    """
     if base_size == 0:
         if h * w > VIDEO_MAXRES * VIDEO_MAXRES:
             # print(f'{h}x{w} larger than max size {MAXRES}, resize to {MAXRES}')
@@ -162,7 +169,7 @@ def resize_video(image, patch_size=14, base_size=896):
     if scale is not None:
         new_h = int(h * scale / patch_size) * patch_size
         new_w = int(w * scale / patch_size) * patch_size
-        image = image.resize((new_h, new_w))
+        return "resize", new_h, new_w
     elif PAD2STRIDE:
         if h % patch_size == 0:
             new_h = h
@@ -173,11 +180,19 @@ def resize_video(image, patch_size=14, base_size=896):
             new_w = w
         else:
             new_w = (w // patch_size + 1) * patch_size
-        image = pad_image(image, (new_h, new_w), value=127)
+        return "pad", new_h, new_w
     else:
         scale = 1.0
         new_h = int(h * scale / patch_size) * patch_size
         new_w = int(w * scale / patch_size) * patch_size
+        return "resize", new_h, new_w
+
+def resize_video(image, patch_size=14, base_size=896):
+    h, w = image.size
+    mode, new_h, new_w = video_target_size(h, w, patch_size=patch_size, base_size=base_size)
+    if mode == "pad":
+        image = pad_image(image, (new_h, new_w), value=127)
+    else:
         image = image.resize((new_h, new_w))
 
     return image
@@ -190,6 +205,57 @@ def process_anyres_video(image, processor):
     else:
         raise ValueError("VIDEO_RESIZE is not set")
 
+def process_anyres_video_batch(frames, processor):
+    """
+    Batched equivalent of calling `process_anyres_video` on every frame, for a CLIP
+    image processor with `do_resize` and `do_center_crop` disabled (as in inference).
+
+    Args:
+        frames: uint8 array / tensor of shape [T, H, W, 3] (RGB, e.g. decord `get_batch`)
+        processor: the vision tower's image processor
+
+    Returns:
+        float32 tensor of shape [T, 3, H', W']
+    """
+    if VIDEO_RESIZE is None:
+        raise ValueError("VIDEO_RESIZE is not set")
+    if getattr(processor, "do_resize", False) or getattr(processor, "do_center_crop", False):
+        raise ValueError("process_anyres_video_batch expects do_resize=False and do_center_crop=False")
+
+    frames = torch.as_tensor(frames)
+    num_frames, height, width, _ = frames.shape
+    # same size computation as `resize_video` (PIL size order: width, height)
+    mode, new_width, new_height = video_target_size(width, height, patch_size=video_ps, base_size=video_base)
+    frames = frames.permute(0, 3, 1, 2)
+
+    if mode == "pad":
+        canvas = torch.full((num_frames, 3, new_height, new_width), 127, dtype=torch.uint8)
+        top = (new_height - height) // 2
+        left = (new_width - width) // 2
+        # matches PIL paste semantics, including cropping when the target is smaller
+        src_top, src_left = max(-top, 0), max(-left, 0)
+        dst_top, dst_left = max(top, 0), max(left, 0)
+        h = min(height - src_top, new_height - dst_top)
+        w = min(width - src_left, new_width - dst_left)
+        canvas[:, :, dst_top:dst_top + h, dst_left:dst_left + w] = \
+            frames[:, :, src_top:src_top + h, src_left:src_left + w]
+        pixels = canvas.float()
+    elif (new_height, new_width) != (height, width):
+        # resize stays on PIL: torch's antialiased bicubic (a=-0.75) drifts several uint8 levels from PIL's (a=-0.5)
+        resized = [np.asarray(Image.fromarray(frame.numpy()).resize((new_width, new_height)))
+                   for frame in frames.permute(0, 2, 3, 1)]
+        pixels = torch.from_numpy(np.stack(resized)).permute(0, 3, 1, 2).float()
+    else:
+        pixels = frames.float()
+
+    if getattr(processor, "do_rescale", True):
+        pixels = pixels * processor.rescale_factor
+    if getattr(processor, "do_normalize", True):
+        mean = torch.tensor(processor.image_mean, dtype=torch.float32).view(1, -1, 1, 1)
+        std = torch.tensor(processor.image_std, dtype=torch.float32).view(1, -1, 1, 1)
+        pixels = (pixels - mean) / std
+    return pixels.contiguous()
+
 def process_anyres_highres_image(image, processor):
     processor2 = None
     if type(processor) is tuple:
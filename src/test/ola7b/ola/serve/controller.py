@@ -18,8 +18,9 @@ import numpy as np
 import requests
 import uvicorn
 
-from omni_speech.constants import CONTROLLER_HEART_BEAT_EXPIRATION
-from omni_speech.utils import build_logger, server_error_msg
+from ola.constants import CONTROLLER_HEART_BEAT_EXPIRATION
+from ola.utils import build_logger, server_error_msg
+from ola.serve.request_cost import RequestCostModel
 
 
 logger = build_logger("controller", "controller.log")
@@ -28,6 +29,7 @@ logger = build_logger("controller", "controller.log")
 class DispatchMethod(Enum):
     LOTTERY = auto()
     SHORTEST_QUEUE = auto()
+    LEAST_WORK = auto()
 
     @classmethod
     def from_str(cls, name):
@@ -35,6 +37,8 @@ class DispatchMethod(Enum):
             return cls.LOTTERY
         elif name == "shortest_queue":
             return cls.SHORTEST_QUEUE
+        elif name == "least_work":
+            return cls.LEAST_WORK
         else:
             raise ValueError(f"Invalid dispatch method")
 
@@ -46,6 +50,8 @@ class WorkerInfo:
     queue_length: int
     check_heart_beat: bool
     last_heart_beat: str
+    # estimated seconds of work held by the worker, see request_cost.py
+    outstanding_cost: float = 0.0
 
 
 def heart_beat_controller(controller):
@@ -55,10 +61,11 @@ def heart_beat_controller(controller):
 
 
 class Controller:
-    def __init__(self, dispatch_method: str):
+    def __init__(self, dispatch_method: str, cost_model: RequestCostModel = None):
         # Dict[str -> WorkerInfo]
         self.worker_info = {}
         self.dispatch_method = DispatchMethod.from_str(dispatch_method)
+        self.cost_model = cost_model or RequestCostModel()
 
         self.heart_beat_thread = threading.Thread(
             target=heart_beat_controller, args=(self,), daemon=True)
@@ -80,7 +87,7 @@ class Controller:
 
         self.worker_info[worker_name] = WorkerInfo(
             worker_status["model_names"], worker_status["speed"], worker_status["queue_length"],
-            check_heart_beat, time.time())
+            check_heart_beat, time.time(), self.outstanding_cost(worker_status))
 
         logger.info(f"Register done: {worker_name}, {worker_status}")
         return True
@@ -117,7 +124,13 @@ class Controller:
 
         return list(model_names)
 
-    def get_worker_address(self, model_name: str):
+    def outstanding_cost(self, worker_status: dict):
+        if worker_status.get("outstanding_cost") is not None:
+            return worker_status["outstanding_cost"]
+        # workers without cost reporting: assume average requests
+        return worker_status.get("queue_length", 0) * self.cost_model.estimate({})
+
+    def get_worker_address(self, model_name: str, params: dict = None):
         if self.dispatch_method == DispatchMethod.LOTTERY:
             worker_names = []
             worker_speeds = []
@@ -167,15 +180,34 @@ class Controller:
             self.worker_info[w_name].queue_length += 1
             logger.info(f"names: {worker_names}, queue_lens: {worker_qlen}, ret: {w_name}")
             return w_name
+        elif self.dispatch_method == DispatchMethod.LEAST_WORK:
+            cost = self.cost_model.estimate(params or {})
+            worker_names = []
+            worker_finish = []
+            for w_name, w_info in self.worker_info.items():
+                if model_name in w_info.model_names:
+                    worker_names.append(w_name)
+                    worker_finish.append((w_info.outstanding_cost + cost) / w_info.speed)
+            if len(worker_names) == 0:
+                return ""
+            min_index = np.argmin(worker_finish)
+            w_name = worker_names[min_index]
+            # counted until the worker reports its own estimate in the next heart beat
+            self.worker_info[w_name].outstanding_cost += cost
+            self.worker_info[w_name].queue_length += 1
+            logger.info(f"names: {worker_names}, cost: {cost:.2f}, finish: {worker_finish}, ret: {w_name}")
+            return w_name
         else:
             raise ValueError(f"Invalid dispatch method: {self.dispatch_method}")
 
-    def receive_heart_beat(self, worker_name: str, queue_length: int):
+    def receive_heart_beat(self, worker_name: str, queue_length: int, outstanding_cost: float = None):
         if worker_name not in self.worker_info:
             logger.info(f"Receive unknown heart beat. {worker_name}")
             return False
 
         self.worker_info[worker_name].queue_length = queue_length
+        self.worker_info[worker_name].outstanding_cost = self.outstanding_cost(
+            {"queue_length": queue_length, "outstanding_cost": outstanding_cost})
         self.worker_info[worker_name].last_heart_beat = time.time()
         logger.info(f"Receive heart beat. {worker_name}")
         return True
@@ -191,7 +223,7 @@ class Controller:
             self.remove_worker(worker_name)
 
     def worker_api_generate_stream(self, params):
-        worker_addr = self.get_worker_address(params["model"])
+        worker_addr = self.get_worker_address(params["model"], params)
         if not worker_addr:
             logger.info(f"no worker: {params['model']}")
             ret = {
@@ -221,6 +253,7 @@ class Controller:
         model_names = set()
         speed = 0
         queue_length = 0
+        outstanding_cost = 0.0
 
         for w_name in self.worker_info:
             worker_status = self.get_worker_status(w_name)
@@ -228,11 +261,13 @@ class Controller:
                 model_names.update(worker_status["model_names"])
                 speed += worker_status["speed"]
                 queue_length += worker_status["queue_length"]
+                outstanding_cost += self.outstanding_cost(worker_status)
 
         return {
             "model_names": list(model_names),
             "speed": speed,
             "queue_length": queue_length,
+            "outstanding_cost": outstanding_cost,
         }
 
 
@@ -261,7 +296,8 @@ async def list_models():
 @app.post("/get_worker_address")
 async def get_worker_address(request: Request):
     data = await request.json()
-    addr = controller.get_worker_address(data["model"])
+    # the request fields (prompt, images, modality, num_frames, ...) are used by least_work
+    addr = controller.get_worker_address(data["model"], data)
     return {"address": addr}
 
 
@@ -269,7 +305,7 @@ async def get_worker_address(request: Request):
 async def receive_heart_beat(request: Request):
     data = await request.json()
     exist = controller.receive_heart_beat(
-        data["worker_name"], data["queue_length"])
+        data["worker_name"], data["queue_length"], data.get("outstanding_cost"))
     return {"exist": exist}
 
 
@@ -290,7 +326,7 @@ if __name__ == "__main__":
     parser.add_argument("--host", type=str, default="localhost")
     parser.add_argument("--port", type=int, default=21001)
     parser.add_argument("--dispatch-method", type=str, choices=[
-        "lottery", "shortest_queue"], default="shortest_queue")
+        "lottery", "shortest_queue", "least_work"], default="shortest_queue")
     args = parser.parse_args()
     logger.info(f"args: {args}")
 
@@ -25,6 +25,7 @@ from omni_speech.utils import (build_logger, server_error_msg,
 from omni_speech.model.builder import load_pretrained_model
 from omni_speech.constants import SPEECH_TOKEN_INDEX, DEFAULT_SPEECH_TOKEN
 from omni_speech.datasets.preprocess import tokenizer_speech_token
+from ola.serve.request_cost import RequestCostModel
 from transformers import TextIteratorStreamer
 from threading import Thread
 
@@ -83,6 +84,8 @@ class ModelWorker:
         self.tokenizer, self.model, self.context_len = load_pretrained_model(
             model_path, model_base, is_lora=is_lora, s2s=s2s, load_8bit=load_8bit, load_4bit=load_4bit, device=self.device, use_flash_attn=use_flash_attn)
         self.unit_tokenizer = build_unit_tokenizer(self.model.config.unit_vocab_size)
+        self.cost_model = RequestCostModel()
+        self.outstanding_cost = 0.0
 
         if not no_register:
             self.register_to_controller()
@@ -113,7 +116,8 @@ class ModelWorker:
             try:
                 ret = requests.post(url, json={
                     "worker_name": self.worker_addr,
-                    "queue_length": self.get_queue_length()}, timeout=5)
+                    "queue_length": self.get_queue_length(),
+                    "outstanding_cost": self.outstanding_cost}, timeout=5)
                 exist = ret.json()["exist"]
                 break
             except requests.exceptions.RequestException as e:
@@ -135,8 +139,13 @@ class ModelWorker:
             "model_names": [self.model_name],
             "speed": 1,
             "queue_length": self.get_queue_length(),
+            "outstanding_cost": self.outstanding_cost,
         }
 
+    def finish_request(self, cost):
+        self.outstanding_cost -= cost
+        self.send_heart_beat()
+
     @torch.inference_mode()
     def generate_stream(self, params):
         tokenizer, model = self.tokenizer, self.model
@@ -233,6 +242,9 @@ async def generate_stream(request: Request):
     global model_semaphore, global_counter
     global_counter += 1
     params = await request.json()
+    # queued requests count as well, they are released in finish_request
+    cost = worker.cost_model.estimate(params)
+    worker.outstanding_cost += cost
 
     if model_semaphore is None:
         model_semaphore = asyncio.Semaphore(args.limit_model_concurrency)
@@ -240,7 +252,7 @@ async def generate_stream(request: Request):
     worker.send_heart_beat()
     generator = worker.generate_stream_gate(params)
     background_tasks = BackgroundTasks()
-    background_tasks.add_task(partial(release_model_semaphore, fn=worker.send_heart_beat))
+    background_tasks.add_task(partial(release_model_semaphore, fn=partial(worker.finish_request, cost)))
     return StreamingResponse(generator, background=background_tasks)
 
 
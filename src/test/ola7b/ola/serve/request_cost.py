@@ -0,0 +1,70 @@
+"""
+Request cost estimates for cost-aware dispatch (controller `--dispatch-method least_work`).
+
+Costs are estimated seconds on a worker with `speed` 1. Workers report the summed estimate of
+the requests they hold in their heart beats, and the controller routes each request to the
+worker that would finish it first.
+"""
+import dataclasses
+import math
+
+from ola.constants import DEFAULT_IMAGE_TOKEN
+
+
+@dataclasses.dataclass
+class RequestCostModel:
+    # LLM prefill, per prompt or multimodal token
+    prefill_token: float = 2e-4
+    # video decoding + preprocessing + Oryx-ViT, per frame
+    frame: float = 0.04
+    # LLM tokens per video frame after pooling
+    frame_tokens: int = 128
+    # Oryx-ViT + LLM tokens of one image at native resolution
+    image: float = 0.1
+    image_tokens: int = 1024
+    # Whisper + BEATs encoders, per 30 s window, and LLM speech tokens per second
+    audio_window: float = 0.08
+    audio_tokens_per_second: float = 12.5
+    audio_sample_rate: int = 16000
+    # decoding, per generated token
+    decode_token: float = 0.03
+    # average share of `max_new_tokens` that is actually generated
+    output_fraction: float = 0.5
+    chars_per_token: float = 4.0
+    # per-request overhead (HTTP, tokenization, streaming)
+    overhead: float = 0.05
+    # frames sampled from a video when the request does not say (inference/main.py default)
+    default_num_frames: int = 64
+
+    def estimate(self, params, output_tokens=None):
+        """Estimated cost of a `/worker_generate_stream` request.
+
+        Uses `prompt`, `audio` (raw samples), `images` and `max_new_tokens` of the request; clients
+        that know more can add `modality` ("text", "image", "video", optionally with a "_text"
+        suffix), `num_frames` and `audio_seconds`. `output_tokens` replaces the expected output
+        length when it is known (e.g. in simulations).
+        """
+        prompt = params.get("prompt", "")
+        images = params.get("images") or []
+        modality = params.get("modality")
+        if modality is None:
+            modality = "image" if images or DEFAULT_IMAGE_TOKEN in prompt else "text"
+
+        cost = self.overhead + len(prompt) / self.chars_per_token * self.prefill_token
+        if modality.startswith("video"):
+            num_frames = int(params.get("num_frames") or self.default_num_frames)
+            cost += num_frames * (self.frame + self.frame_tokens * self.prefill_token)
+        elif modality.startswith("image"):
+            num_images = max(len(images), prompt.count(DEFAULT_IMAGE_TOKEN), 1)
+            cost += num_images * (self.image + self.image_tokens * self.prefill_token)
+
+        audio_seconds = params.get("audio_seconds")
+        if audio_seconds is None and params.get("audio") is not None:
+            audio_seconds = len(params["audio"]) / self.audio_sample_rate
+        if audio_seconds:
+            cost += math.ceil(audio_seconds / 30) * self.audio_window
+            cost += audio_seconds * self.audio_tokens_per_second * self.prefill_token
+
+        if output_tokens is None:
+            output_tokens = min(int(params.get("max_new_tokens", 256)), 1024) * self.output_fraction
+        return cost + output_tokens * self.decode_token
@@ -1,6 +1,6 @@
 import os
+import sys
 import json
-from tqdm import tqdm
 from transformers import Qwen2_5OmniForConditionalGeneration, Qwen2_5OmniProcessor
 from qwen_omni_utils import process_mm_info
 import torch
@@ -10,6 +10,11 @@ import tempfile
 import numpy as np
 import subprocess
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+from src.utils.video_scheduler import VideoGroupScheduler
+from src.utils.prefix_kv_cache import PrefixKVCache
+from src.utils.frame_dedup import from_env, vit_flops
+
 
 # ====== 初始化模型 ======
 MODEL_PATH = "./models/Qwen2.5-Omni-7B"
@@ -17,31 +22,37 @@ model = Qwen2_5OmniForConditionalGeneration.from_pretrained(
     MODEL_PATH, dtype="auto", device_map="auto"
 )
 processor = Qwen2_5OmniProcessor.from_pretrained(MODEL_PATH)
-USE_AUDIO_IN_VIDEO = True
+# USE_AUDIO_IN_VIDEO=0：不把视频音轨交给模型（纯视觉输入），结果写到单独的 *_video_only 目录
+USE_AUDIO_IN_VIDEO = os.getenv("USE_AUDIO_IN_VIDEO", "1") == "1"
+# PREFIX_CACHE=1：视频放在问题之前，每个视频只 prefill 一次音视频前缀，各问题复用其 KV cache
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "0") == "1"
+# FRAME_DEDUP=1：对抽出的帧按感知哈希去掉近重复帧，帧数保持为时间 patch（2）的倍数。
+# Qwen2.5-Omni 按固定 fps 计算视频帧的时间位置并与音频交错，去帧会打乱对齐，所以只在 USE_AUDIO_IN_VIDEO=0 时启用
+FRAME_DEDUP = from_env(multiple_of=2, min_frames=2)
+if FRAME_DEDUP is not None and USE_AUDIO_IN_VIDEO:
+    print("⚠️ FRAME_DEDUP 与 use_audio_in_video 不兼容（音视频按固定 fps 对齐），本次不做帧去重；"
+          "需要去重时设置 USE_AUDIO_IN_VIDEO=0")
+    FRAME_DEDUP = None
 
 # ====== 文件路径 ======
 current_tasks = ["1intra_event_reasoning", "3audio_visual_alignment", "5topic_stance_evolution_summarization", "4timeline_reconstruction", "6cross_event_causality", "2multimodal_temporal_localization"]
+VIDEO_ROOT = "./videos"
+
+# ====== 按视频分组（已有结果自动跳过） ======
+scheduler = VideoGroupScheduler(
+    current_tasks,
+    input_pattern="./final_qa_subset/{task}.json",
+    output_pattern="./experiment/qwen2.5_omni7b"
+                   + ("" if USE_AUDIO_IN_VIDEO else "_video_only")
+                   + ("_prefix_cache" if PREFIX_CACHE else "")
+                   + ("_dedup" if FRAME_DEDUP is not None else "")
+                   + "/{task}.json",
+    video_root=VIDEO_ROOT,
+)
 
-for current_task in current_tasks:
-    INPUT_FILE = f"./final_qa_subset/{current_task}.json"
-    OUTPUT_FILE = f"./experiment/qwen2.5_omni7b/{current_task}.json"
-    VIDEO_ROOT = "./videos"
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-
-    # ====== 读取已有结果 ======
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-            results = json.load(f)
-    else:
-        results = {}
-
-    # ====== 读取 QA 数据 ======
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        qa_data = json.load(f)
-
-    SYSTEM_PROMPT = "You are an expert in long video understanding. Always base your answers strictly on the video content."
+SYSTEM_PROMPT = "You are an expert in long video understanding. Always base your answers strictly on the video content."
 
-    USER_PROMPT = """
+USER_PROMPT = """
     Each question may have one or more correct answer(s). Please think step-by-step, and then output the **option label(s)** ('A','B','C','D') and a **brief explanation** that explain the reason for your choices.
 
     question: {question}
@@ -52,74 +63,82 @@ for current_task in current_tasks:
     "reason": your explanation
     """
 
-    for qa in tqdm(qa_data):
-        qid = qa["question_id"]
-        question = qa["question"]
-        video_id = qa["related_videoID"]
-        options = qa.get("options", "")
-        if qid in results:
-            continue
-
-        try:
-            category, idx = video_id.rsplit("_", 1)
-            video_path = os.path.join(VIDEO_ROOT, category, f"sample_{idx}.mp4")
-        except Exception as e:
-            print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
-            continue
-
-        if not os.path.exists(video_path):
-            print(f"⚠️ 视频不存在: {video_path}")
-            continue
-
-        # ====== 构造 messages ======
-        messages = [
-            {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": USER_PROMPT.format(question=question, options=options)},
-                    {"type": "video", "video": video_path, "fps": 1, "max_frames": 128}
-                ]
-            }
-        ]
-
-        # ====== 处理音视频 ======
-        audios, images, videos = process_mm_info(messages, use_audio_in_video=USE_AUDIO_IN_VIDEO)
-
-        inputs = processor(
-            text=processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False),
-            audio=audios,
-            images=images,
-            videos=videos,
-            return_tensors="pt",
-            padding=True,
-            use_audio_in_video=USE_AUDIO_IN_VIDEO
-        )
-        inputs = inputs.to(model.device).to(model.dtype)
-
-        # ====== 推理 ======
+
+def build_messages(video_path, question="", options=""):
+    text = {"type": "text", "text": USER_PROMPT.format(question=question, options=options)}
+    video = {"type": "video", "video": video_path, "fps": 1, "max_frames": 128}
+    return [
+        {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
+        {
+            "role": "user",
+            "content": [video, text] if PREFIX_CACHE else [text, video]
+        }
+    ]
+
+
+if PREFIX_CACHE:
+    prefix_cache = PrefixKVCache(
+        model.thinker,
+        processor.tokenizer.convert_tokens_to_ids(
+            ["<|VIDEO|>", "<|AUDIO|>", "<|vision_eos|>", "<|audio_eos|>"]),
+        forward_kwargs={"use_audio_in_video": USE_AUDIO_IN_VIDEO},
+    )
+
+
+def load_media(video_path):
+    """抽帧 + 抽取音频，每个视频只做一次"""
+    audios, images, videos = process_mm_info(build_messages(video_path), use_audio_in_video=USE_AUDIO_IN_VIDEO)
+    if FRAME_DEDUP is not None:
+        videos = [dedup_video(video, video_path) for video in videos]
+    return video_path, audios, images, videos
+
+
+def dedup_video(video, key):
+    """video: [T, C, H, W]（0~255 浮点），ViT 每 2 帧、每 14x14 像素一个 patch（32 层、hidden 1280、SwiGLU 3420）"""
+    frames = video.permute(0, 2, 3, 1).clamp(0, 255).to(torch.uint8).numpy()
+    num_patches = video.shape[2] * video.shape[3] // (14 * 14)
+    flops_per_frame = vit_flops(num_patches, 1280, 32, 3420 * 3 // 2) // 2
+    kept = FRAME_DEDUP.filter(frames, key=key, flops_per_frame=flops_per_frame).kept
+    return video[kept]
+
+
+def answer(media, qa):
+    video_path, audios, images, videos = media
+    messages = build_messages(video_path, qa["question"], qa.get("options", ""))
+
+    inputs = processor(
+        text=processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False),
+        audio=audios,
+        images=images,
+        videos=videos,
+        return_tensors="pt",
+        padding=True,
+        use_audio_in_video=USE_AUDIO_IN_VIDEO
+    )
+    inputs = inputs.to(model.device).to(model.dtype)
+
+    # ====== 推理 ======
+    if PREFIX_CACHE:
+        # 只生成文本，直接走 thinker；前缀 KV cache 每个视频只算一次
+        text_ids = prefix_cache.generate(inputs, max_new_tokens=2048)
+    else:
         with torch.inference_mode():
             text_ids_tuple = model.generate(**inputs, use_audio_in_video=USE_AUDIO_IN_VIDEO, max_new_tokens=2048)
 
         # 取第一个元素
         text_ids = text_ids_tuple[0]
-        # 转为 list 再解码
-        response_text = processor.batch_decode(
-            text_ids.tolist(),
-            skip_special_tokens=True,
-            clean_up_tokenization_spaces=False
-        )
-        answer = response_text[0]
-
-        results[qid] = {
-            "question_id": qid,
-            "question": question,
-            "options": options,
-            "video_id": video_id,
-            "model_answer": answer
-        }
-
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-
-    print(f"✅ 完成推理，结果已保存到 {OUTPUT_FILE}")
+    # 转为 list 再解码
+    response_text = processor.batch_decode(
+        text_ids.tolist(),
+        skip_special_tokens=True,
+        clean_up_tokenization_spaces=False
+    )
+    return response_text[0]
+
+
+scheduler.run(prepare=load_media, answer=answer, desc="Qwen2.5-Omni")
+if PREFIX_CACHE:
+    print(f"🧠 前缀 KV cache: {prefix_cache.stats()}")
+if FRAME_DEDUP is not None:
+    print(f"🎞️ 帧去重: {FRAME_DEDUP.stats()}")
+    FRAME_DEDUP.dump(os.path.join(os.path.dirname(scheduler.output_files[current_tasks[0]]), "frame_dedup.json"))
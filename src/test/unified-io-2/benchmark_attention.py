@@ -0,0 +1,94 @@
+"""Benchmark CPU latency and peak memory of the "eager" and "sdpa" attention backends
+
+Runs one encoder self-attention layer with the large model's dimensions at several encoder
+lengths, up to the length of a 128-frame video+audio input. Every (backend, length) runs in
+a fresh process so the peak resident memory of one does not hide the other.
+
+Usage (from the unified-io-2 directory):
+  python benchmark_attention.py
+  python benchmark_attention.py --lengths 1024 4096 --batch-size 2 --threads 8
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+
+from uio2 import layers
+from uio2.config import LARGE, MAX_TEXT_LEN, DEFAULT_SEQUENCE_LEN
+
+
+def encoder_length(num_frames):
+  """Encoder length of text + image + audio inputs with `num_frames` frames of history"""
+  cfg = LARGE
+  return (MAX_TEXT_LEN + DEFAULT_SEQUENCE_LEN["image_input_samples"] +
+          DEFAULT_SEQUENCE_LEN["audio_input_samples"] +
+          num_frames * cfg.image_history_cfg.latents_size +
+          num_frames * cfg.audio_history_cfg.latents_size)
+
+
+def current_rss_mb():
+  with open("/proc/self/statm") as f:
+    return int(f.read().split()[1]) * resource.getpagesize() / 1024**2
+
+
+def _run(backend, length, batch_size, repeat, threads, queue):
+  if threads:
+    torch.set_num_threads(threads)
+  torch.manual_seed(0)
+  t5 = LARGE.t5_config
+  attention = layers.MultiHeadDotProductAttention(
+    t5.emb_dim, t5.num_heads, t5.head_dim, float32_logits=t5.float32_attention_logits,
+    qk_norm=t5.qk_norm, attention_backend=backend).eval()
+  x = torch.randn(batch_size, length, t5.emb_dim)
+  token_mask = torch.ones(batch_size, length, dtype=torch.int32)
+  token_mask[:, -length // 10:] = 0
+  mask = layers.make_attention_mask(token_mask, token_mask)
+
+  before = current_rss_mb()
+  best = None
+  with torch.no_grad():
+    for _ in range(repeat):
+      start = time.perf_counter()
+      attention(x, x, mask=mask)
+      elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+  # ru_maxrss is in KB on Linux
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+  queue.put((best, peak - before))
+
+
+def run(backend, length, batch_size, repeat, threads):
+  ctx = multiprocessing.get_context("spawn")
+  queue = ctx.Queue()
+  proc = ctx.Process(target=_run, args=(backend, length, batch_size, repeat, threads, queue))
+  proc.start()
+  result = queue.get()
+  proc.join()
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--lengths", type=int, nargs="+", default=None,
+                      help="defaults to the encoder lengths for 16, 32, 64 and 128 frames")
+  parser.add_argument("--batch-size", type=int, default=1)
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--threads", type=int, default=None)
+  args = parser.parse_args()
+
+  lengths = args.lengths or [encoder_length(n) for n in [16, 32, 64, 128]]
+  print(f"batch_size={args.batch_size}, emb_dim={LARGE.t5_config.emb_dim}, "
+        f"heads={LARGE.t5_config.num_heads}, lengths={lengths}")
+  for length in lengths:
+    results = {backend: run(backend, length, args.batch_size, args.repeat, args.threads)
+               for backend in layers.ATTENTION_BACKENDS}
+    (t_eager, m_eager), (t_sdpa, m_sdpa) = results["eager"], results["sdpa"]
+    print(f"length={length}: eager {t_eager * 1000:.0f}ms / +{m_eager:.0f}MB, "
+          f"sdpa {t_sdpa * 1000:.0f}ms / +{m_sdpa:.0f}MB, x{t_eager / t_sdpa:.2f} faster, "
+          f"{m_eager / max(m_sdpa, 1):.1f}x less memory")
+
+
+if __name__ == "__main__":
+  main()
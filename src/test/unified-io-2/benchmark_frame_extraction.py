@@ -0,0 +1,59 @@
+"""Benchmark single-pass frame extraction against the per-frame ffmpeg implementation
+
+Usage (from the unified-io-2 directory):
+  python benchmark_frame_extraction.py --videos ./datasets/finevideo/videos/ted_talks/sample_5.mp4
+  python benchmark_frame_extraction.py --videos a.mp4 b.mp4 --frames 32 64 128 --repeat 2
+"""
+import argparse
+import time
+
+import numpy as np
+
+from uio2.video_utils import extract_frames_from_video, get_video_length
+
+
+def timed(fn, repeat):
+  best, out = None, None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, out
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--videos", nargs="+", required=True)
+  parser.add_argument("--frames", type=int, nargs="+", default=[32, 64, 128])
+  parser.add_argument("--repeat", type=int, default=1)
+  args = parser.parse_args()
+
+  totals = {n: [0.0, 0.0] for n in args.frames}
+  mismatched = 0
+  for video in args.videos:
+    length = get_video_length(video)
+    for num_frames in args.frames:
+      t_old, old = timed(lambda: extract_frames_from_video(
+        video, length, num_frames=num_frames, single_pass=False), args.repeat)
+      t_new, new = timed(lambda: extract_frames_from_video(
+        video, length, num_frames=num_frames, single_pass=True), args.repeat)
+      same = old.shape == new.shape and np.array_equal(old, new)
+      if not same:
+        mismatched += 1
+      max_diff = np.abs(old.astype(np.int16) - new.astype(np.int16)).max() if old.shape == new.shape else None
+      totals[num_frames][0] += t_old
+      totals[num_frames][1] += t_new
+      print(f"{video} ({length:.1f}s) frames={num_frames}: per-frame {t_old:.2f}s, "
+            f"single-pass {t_new:.2f}s, x{t_old / t_new:.1f}, shape={new.shape}, "
+            f"identical={same}" + ("" if same else f", max |diff|={max_diff}"))
+
+  print("\nTotal over all videos:")
+  for num_frames, (t_old, t_new) in totals.items():
+    print(f"  {num_frames:>4} frames: per-frame {t_old:.2f}s, single-pass {t_new:.2f}s, x{t_old / t_new:.1f}")
+  if mismatched:
+    print(f"{mismatched} (video, frames) pairs differ from the per-frame output")
+
+
+if __name__ == "__main__":
+  main()
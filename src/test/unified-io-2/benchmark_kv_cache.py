@@ -0,0 +1,86 @@
+"""Benchmark text decoding speed with the dynamic and static self-attention caches
+
+Builds a small randomly initialized text-only UIO2 on CPU and greedily decodes a fixed
+number of tokens (EOS is suppressed with `min_new_tokens`) with each `kv_cache` option.
+
+Usage (from the unified-io-2 directory):
+  python benchmark_kv_cache.py
+  python benchmark_kv_cache.py --tokens 1024 --batch-size 4 --layers 8 --emb-dim 512
+"""
+import argparse
+import time
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+from uio2.config import T5Config
+from uio2.input_modalities import InputTextEmbedder
+from uio2.model import UnifiedIOModel
+from uio2.target_modalities import TextEmbedder
+
+KV_CACHES = ["dynamic", "static", "static_fixed"]
+
+
+class StopAt(StoppingCriteria):
+  """Stop after `n` generated tokens, independently of `max_new_tokens`"""
+
+  def __init__(self, n):
+    self.n = n
+
+  def __call__(self, input_ids, scores, **kwargs):
+    return input_ids.shape[-1] > self.n
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--tokens", type=int, nargs="+", default=[128, 512])
+  parser.add_argument("--max-new-tokens", type=int, default=None,
+                      help="length the static cache is allocated for, defaults to --tokens "
+                           "(`avqa` uses 2048)")
+  parser.add_argument("--batch-size", type=int, default=1)
+  parser.add_argument("--input-len", type=int, default=256)
+  parser.add_argument("--layers", type=int, default=4)
+  parser.add_argument("--emb-dim", type=int, default=256)
+  parser.add_argument("--repeat", type=int, default=2)
+  parser.add_argument("--threads", type=int, default=None)
+  args = parser.parse_args()
+
+  if args.threads:
+    torch.set_num_threads(args.threads)
+  torch.manual_seed(0)
+  cfg = T5Config(
+    vocab_size=33280, emb_dim=args.emb_dim, num_heads=args.emb_dim // 64, head_dim=64,
+    mlp_dim=args.emb_dim * 4, num_encoder_layers=args.layers, num_decoder_layers=args.layers,
+    encoder_max_text_length=args.input_len, decoder_max_text_length=max(args.tokens) + 1,
+  )
+  model = UnifiedIOModel(cfg, {"text": InputTextEmbedder(cfg)}, {"text": TextEmbedder(cfg)}).eval()
+  batch = {"inputs/text/tokens": torch.randint(2, cfg.vocab_size, (args.batch_size, args.input_len))}
+  print(f"config: emb_dim={cfg.emb_dim}, layers={cfg.num_decoder_layers}, batch_size={args.batch_size}, "
+        f"threads={torch.get_num_threads()}")
+
+  for n_tokens in args.tokens:
+    max_new_tokens = args.max_new_tokens or n_tokens
+    results = {}
+    for kv_cache in KV_CACHES:
+      best = None
+      for _ in range(args.repeat):
+        start = time.perf_counter()
+        with torch.no_grad():
+          # The static cache is allocated for `max_new_tokens`, generation stops at `n_tokens`
+          out = model.generate(batch, modality="text", use_cache=True, kv_cache=kv_cache,
+                               max_new_tokens=max_new_tokens, min_new_tokens=n_tokens,
+                               stopping_criteria=StoppingCriteriaList([StopAt(n_tokens)]))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+      results[kv_cache] = (best, out)
+    t_dynamic, reference = results["dynamic"]
+    line = [f"{n_tokens} tokens (cache for {max_new_tokens}):"]
+    for kv_cache, (elapsed, out) in results.items():
+      tok_s = args.batch_size * n_tokens / elapsed
+      same = torch.equal(out, reference)
+      line.append(f"{kv_cache} {tok_s:.1f} tok/s x{t_dynamic / elapsed:.2f}{'' if same else ' (DIFFERENT)'}")
+    print(" | ".join(line))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,88 @@
+"""Report the memory saved by building UIO2 with only the modalities a task needs
+
+For the large/xl/xxl configs the parameters are counted on the meta device, so nothing is
+allocated. With `--model` the checkpoint is also loaded, full and pruned, each in a fresh
+process, and the peak resident memory of the loading process is reported.
+
+Usage (from the unified-io-2 directory):
+  python benchmark_modality_pruning.py
+  python benchmark_modality_pruning.py --targets text --inputs text image_history audio_history
+  python benchmark_modality_pruning.py --model ./models/uio2-large
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+
+from uio2.config import CONFIG_MAP, INPUT_MODALITIES
+from uio2.model import UnifiedIOModel
+
+# What the AVQA evaluation (`main.py`) feeds the model: video frames with the first frame
+# encoded as an image, the audio track with its first segment encoded as audio
+AVQA_INPUTS = list(INPUT_MODALITIES)
+
+
+def module_bytes(model, dtype_size):
+  """Bytes of parameters and buffers per top-level group of `model`"""
+  out = {}
+  for name, tensor in list(model.named_parameters()) + list(model.named_buffers()):
+    parts = name.split(".")
+    group = ".".join(parts[:2]) if parts[0] in ("input_embedders", "target_embedders") else parts[0]
+    out[group] = out.get(group, 0) + tensor.numel() * dtype_size
+  return out
+
+
+def _load(model_dir, input_modalities, target_modalities, queue):
+  start = time.perf_counter()
+  model = UnifiedIOModel.from_pretrained(
+    model_dir, input_modalities=input_modalities, target_modalities=target_modalities)
+  elapsed = time.perf_counter() - start
+  n_params = sum(p.numel() for p in model.parameters())
+  # ru_maxrss is in KB on Linux
+  queue.put((elapsed, n_params, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2))
+
+
+def measure_load(model_dir, input_modalities, target_modalities):
+  ctx = multiprocessing.get_context("spawn")
+  queue = ctx.Queue()
+  proc = ctx.Process(target=_load, args=(model_dir, input_modalities, target_modalities, queue))
+  proc.start()
+  result = queue.get()
+  proc.join()
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--configs", nargs="+", default=["large", "xl", "xxl"])
+  parser.add_argument("--inputs", nargs="+", default=AVQA_INPUTS)
+  parser.add_argument("--targets", nargs="+", default=["text"])
+  parser.add_argument("--dtype-size", type=int, default=4, help="bytes per parameter, 2 for bf16")
+  parser.add_argument("--model", default=None, help="checkpoint to load full and pruned")
+  args = parser.parse_args()
+
+  print(f"inputs={args.inputs}, targets={args.targets}, {args.dtype_size} bytes/param")
+  for name in args.configs:
+    with torch.device("meta"):
+      full = module_bytes(UnifiedIOModel(CONFIG_MAP[name]), args.dtype_size)
+      pruned = module_bytes(UnifiedIOModel(
+        CONFIG_MAP[name], input_modalities=args.inputs, target_modalities=args.targets), args.dtype_size)
+    full_total, pruned_total = sum(full.values()), sum(pruned.values())
+    print(f"{name}: {full_total / 1024**3:.2f}GB -> {pruned_total / 1024**3:.2f}GB, "
+          f"saves {(full_total - pruned_total) / 1024**3:.2f}GB "
+          f"({100 * (full_total - pruned_total) / full_total:.1f}%)")
+    for group in sorted(full):
+      if group not in pruned:
+        print(f"  not built: {group} {full[group] / 1024**2:.0f}MB")
+
+  if args.model:
+    for label, inputs, targets in [("full", None, None), ("pruned", args.inputs, args.targets)]:
+      elapsed, n_params, max_rss = measure_load(args.model, inputs, targets)
+      print(f"{args.model} {label}: {n_params / 1e6:.0f}M parameters, loaded in {elapsed:.1f}s, "
+            f"peak RSS {max_rss:.2f}GB")
+
+
+if __name__ == "__main__":
+  main()
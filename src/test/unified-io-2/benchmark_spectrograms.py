@@ -0,0 +1,62 @@
+"""Check and benchmark batched mel spectrograms against the per-segment librosa implementation
+
+Usage (from the unified-io-2 directory):
+  python benchmark_spectrograms.py                      # random 10 minute waveform
+  python benchmark_spectrograms.py --audio clip.wav --frames 32 64 128
+"""
+import argparse
+import time
+
+import numpy as np
+
+from uio2 import config
+from uio2.audio_utils import extract_spectrograms_from_audio, read_audio_file
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--audio", default=None, help="audio file, random noise if not given")
+  parser.add_argument("--seconds", type=float, default=600.0, help="length of the random waveform")
+  parser.add_argument("--frames", type=int, nargs="+", default=[32, 64, 128],
+                      help="number of segments, as for a video with this many frames")
+  parser.add_argument("--rtol", type=float, default=1e-4)
+  parser.add_argument("--repeats", type=int, default=3, help="timed runs per path, the fastest is reported")
+  args = parser.parse_args()
+
+  if args.audio:
+    waveform = read_audio_file(args.audio)
+  else:
+    waveform = np.random.default_rng(0).standard_normal(
+      int(args.seconds * config.AUDIO_SAMPLING_RATE)).astype(np.float32)
+  length = waveform.size / config.AUDIO_SAMPLING_RATE
+
+  def timed(**kwargs):
+    times = []
+    for _ in range(args.repeats):
+      start = time.perf_counter()
+      out = extract_spectrograms_from_audio(waveform, **kwargs)
+      times.append(time.perf_counter() - start)
+    return out, min(times)
+
+  ok = True
+  for num_frames in args.frames:
+    kwargs = dict(audio_length=length, audio_segment_length=length / num_frames,
+                  spectrogram_length=config.AUDIO_SPECTRUM_LENGTH)
+    # warm up both paths (librosa's first call pays for imports and numba compilation)
+    for batched in (False, True):
+      extract_spectrograms_from_audio(waveform, batched=batched, **kwargs)
+    ref, t_ref = timed(batched=False, **kwargs)
+    out, t_out = timed(batched=True, **kwargs)
+
+    rel = np.abs(out - ref).max() / np.abs(ref).max()
+    # UIO2 consumes log(clip(spectrogram, 1e-5)), so also compare in that space
+    log_diff = np.abs(np.log(np.clip(out, 1e-5, 1e5)) - np.log(np.clip(ref, 1e-5, 1e5))).max()
+    ok &= out.shape == ref.shape and rel <= args.rtol
+    print(f"segments={num_frames}: shape={out.shape}, max rel diff={rel:.2e}, max log diff={log_diff:.2e}, "
+          f"per-segment {t_ref * 1000:.0f}ms, batched {t_out * 1000:.0f}ms, x{t_ref / t_out:.1f}")
+
+  print("parity OK" if ok else f"parity FAILED (rtol={args.rtol})")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,110 @@
+"""Check the "sdpa" attention backend against "eager"
+
+Compares `layers.MultiHeadDotProductAttention` outputs for the mask/bias combinations the
+model uses (padding masks with fully-masked rows, decoder masks, extra biases), scaled
+cosine attention, `float32_logits` on and off and bfloat16 inputs, then compares encoder
+outputs and answer-option scores of a small randomly initialized text-only UIO2.
+
+Usage (from the unified-io-2 directory):
+  python check_attention_backends.py
+  python check_attention_backends.py --length 2048 --tolerance 1e-4
+"""
+import argparse
+import sys
+
+import torch
+
+from uio2 import layers
+from uio2.config import T5Config
+from uio2.input_modalities import InputTextEmbedder
+from uio2.model import UnifiedIOModel
+from uio2.target_modalities import TextEmbedder
+
+
+def padding_mask(batch, length, n_pad):
+  mask = torch.ones(batch, length, dtype=torch.int32)
+  mask[:, length - n_pad:] = 0
+  return mask
+
+
+def layer_cases(length):
+  q_mask = padding_mask(2, length, length // 4)
+  kv_mask = padding_mask(2, length, length // 3)
+  decoder_mask = layers.make_decoder_mask(padding_mask(2, length, length // 4))
+  cross_mask = layers.make_attention_mask(q_mask, kv_mask)
+  rel_bias = torch.randn(1, 8, length, length) * 0.1
+  return [
+    # name, attention kwargs, forward kwargs, dtype
+    ("padding mask", dict(), dict(mask=cross_mask), torch.float32),
+    ("decoder mask", dict(), dict(mask=decoder_mask), torch.float32),
+    ("mask + bias", dict(), dict(mask=cross_mask, bias=rel_bias), torch.float32),
+    ("no mask", dict(), dict(), torch.float32),
+    ("scaled cosine", dict(scaled_cosine=True, qk_norm=False), dict(mask=cross_mask), torch.float32),
+    ("no depth normalize", dict(depth_normalize=False), dict(mask=cross_mask), torch.float32),
+    ("float32_logits=False", dict(float32_logits=False), dict(mask=cross_mask), torch.float32),
+    ("bfloat16", dict(), dict(mask=cross_mask), torch.bfloat16),
+  ]
+
+
+def max_diff(a, b, mask=None):
+  diff = (a.float() - b.float()).abs()
+  if mask is not None:
+    diff = diff[mask.bool()]
+  return diff.max().item()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--length", type=int, default=512)
+  parser.add_argument("--tolerance", type=float, default=1e-5)
+  parser.add_argument("--bf16-tolerance", type=float, default=5e-2)
+  args = parser.parse_args()
+  torch.manual_seed(0)
+
+  failed = 0
+  for name, attn_kwargs, forward_kwargs, dtype in layer_cases(args.length):
+    attention = layers.MultiHeadDotProductAttention(512, 8, 64, **attn_kwargs).eval().to(dtype)
+    x_q = torch.randn(2, args.length, 512, dtype=dtype)
+    x_kv = torch.randn(2, args.length, 512, dtype=dtype)
+    with torch.no_grad():
+      attention.attention_backend = "eager"
+      expected = attention(x_q, x_kv, **forward_kwargs)
+      attention.attention_backend = "sdpa"
+      actual = attention(x_q, x_kv, **forward_kwargs)
+    diff = max_diff(expected, actual)
+    tolerance = args.bf16_tolerance if dtype == torch.bfloat16 else args.tolerance
+    ok = diff <= tolerance and torch.isfinite(actual).all().item()
+    failed += not ok
+    print(f"{name}: max |diff|={diff:.2e} {'OK' if ok else 'MISMATCH'}")
+
+  cfg = T5Config(vocab_size=1024, emb_dim=256, num_heads=4, head_dim=64, mlp_dim=1024,
+                 num_encoder_layers=2, num_decoder_layers=2, encoder_max_text_length=args.length)
+  model = UnifiedIOModel(cfg, {"text": InputTextEmbedder(cfg)}, {"text": TextEmbedder(cfg)}).eval()
+  tokens = torch.randint(2, cfg.vocab_size, (2, args.length))
+  tokens[1, args.length // 2:] = 0  # padding
+  options = torch.randint(2, cfg.vocab_size, (6, 5))
+  options[:, -1] = 1
+  outputs = {}
+  with torch.no_grad():
+    for backend in layers.ATTENTION_BACKENDS:
+      model.set_attention_backend(backend)
+      encoding = model.encode_for_scoring({"inputs/text/tokens": tokens[:1]})
+      outputs[backend] = (
+        model.encoder(model.encode_batch({"text": {"tokens": tokens}})),
+        model.score_answer_options(None, options, encoding=encoding),
+      )
+  valid = (tokens > 0).unsqueeze(-1).expand_as(outputs["eager"][0])
+  for name, ix, mask in [("encoder outputs", 0, valid), ("option scores", 1, None)]:
+    diff = max_diff(outputs["eager"][ix], outputs["sdpa"][ix], mask)
+    ok = diff <= args.tolerance * 10
+    failed += not ok
+    print(f"model {name}: max |diff|={diff:.2e} {'OK' if ok else 'MISMATCH'}")
+
+  if failed:
+    print(f"{failed} checks failed")
+    sys.exit(1)
+  print("all checks passed")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,114 @@
+"""Check the "numpy" pre-processing backend against the "tf" backend on a set of fixtures
+
+Synthetic fixtures cover landscape, portrait and up-sampled frames, images, silent audio,
+image histories and text targets; `--videos` adds real videos loaded with `load_video`.
+The numpy preprocessor is built and run first, so the script also reports whether it
+imported TensorFlow.
+
+Usage (from the unified-io-2 directory):
+  python check_preprocessing_backends.py
+  python check_preprocessing_backends.py --videos a.mp4 b.mp4 --repeat 5
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from uio2.preprocessing import UnifiedIOPreprocessor
+
+PROMPT = "What is happening in this video?"
+
+
+def fixtures(videos, num_frames):
+  rng = np.random.RandomState(0)
+
+  def frames(n, h, w):
+    return rng.randint(0, 256, (n, h, w, 3), dtype=np.uint8)
+
+  def spectrograms(n):
+    return rng.randn(n, 256, 128).astype(np.float32)
+
+  out = [
+    ("text only", dict(text_inputs="Describe a cat.")),
+    ("text target", dict(text_inputs="What color is the sky?", text_targets="blue")),
+    ("image 480x640", dict(text_inputs="Describe the image.", image_inputs=frames(1, 480, 640)[0])),
+    ("image 64x48 (upsampled)", dict(text_inputs="Describe the image.", image_inputs=frames(1, 64, 48)[0])),
+    ("image history", dict(text_inputs=PROMPT, image_history=list(frames(3, 360, 640)))),
+    ("video 720p", dict(text_inputs=PROMPT, video_inputs=frames(num_frames, 720, 1280))),
+    ("video 360x640 + audio", dict(text_inputs=PROMPT, video_inputs=frames(num_frames, 360, 640),
+                                   audio_inputs=spectrograms(num_frames))),
+    ("video portrait", dict(text_inputs=PROMPT, video_inputs=frames(num_frames, 640, 360))),
+    ("silent audio", dict(text_inputs="What can be heard?", audio_inputs=np.zeros((2, 256, 128), np.float32))),
+  ]
+  if videos:
+    from uio2.video_utils import load_video
+    for video in videos:
+      video_frames, video_audio = load_video(video, num_frames, use_audio=True)
+      out.append((video, dict(text_inputs=PROMPT, video_inputs=video_frames, audio_inputs=video_audio)))
+  return out
+
+
+def compare(expected, actual):
+  """Returns a list of differences between two pre-processed examples"""
+  problems = []
+  if set(expected) != set(actual):
+    problems.append(f"keys differ: missing {sorted(set(expected) - set(actual))}, "
+                    f"extra {sorted(set(actual) - set(expected))}")
+  for key in sorted(set(expected) & set(actual)):
+    a, b = np.asarray(expected[key]), np.asarray(actual[key])
+    if a.dtype != b.dtype or a.shape != b.shape:
+      problems.append(f"{key}: {a.dtype}{list(a.shape)} != {b.dtype}{list(b.shape)}")
+    elif np.issubdtype(a.dtype, np.floating):
+      diff = np.abs(a - b).max() if a.size else 0.0
+      if diff > 1e-4:
+        problems.append(f"{key}: max |diff|={diff:.2e}")
+    elif not np.array_equal(a, b):
+      problems.append(f"{key}: {int((a != b).sum())} of {a.size} values differ")
+  return problems
+
+
+def timed(preprocessor, kwargs, repeat):
+  best, out = None, None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    out = preprocessor(target_modality="text", **kwargs)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, out
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--preprocessor", default="./uio2-preprocessor")
+  parser.add_argument("--tokenizer", default="tokenizer.model")
+  parser.add_argument("--videos", nargs="*", default=[])
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--num-frames", type=int, default=None,
+                      help="frames per video fixture, defaults to the preprocessor's `num_frames`")
+  args = parser.parse_args()
+
+  numpy_pre = UnifiedIOPreprocessor.from_pretrained(
+    args.preprocessor, tokenizer=args.tokenizer, backend="numpy")
+  cases = fixtures(args.videos, args.num_frames or numpy_pre.sequence_length["num_frames"])
+  numpy_out = [timed(numpy_pre, kwargs, args.repeat) for _, kwargs in cases]
+  print(f"numpy backend imported tensorflow: {'tensorflow' in sys.modules}")
+
+  tf_pre = UnifiedIOPreprocessor.from_pretrained(
+    args.preprocessor, tokenizer=args.tokenizer, backend="tf")
+  failed = 0
+  for (name, kwargs), (t_np, out_np) in zip(cases, numpy_out):
+    t_tf, out_tf = timed(tf_pre, kwargs, args.repeat)
+    problems = compare(out_tf, out_np)
+    failed += bool(problems)
+    status = "OK" if not problems else "MISMATCH"
+    print(f"{name}: {status}, tf {t_tf * 1000:.1f}ms, numpy {t_np * 1000:.1f}ms  x{t_tf / t_np:.2f}")
+    for problem in problems:
+      print(f"  {problem}")
+  print(f"{len(cases) - failed}/{len(cases)} fixtures match")
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
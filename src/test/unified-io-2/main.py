@@ -1,19 +1,43 @@
 import os
+import sys
 import json
-from tqdm import tqdm
+import time
 import torch
-import tensorflow as tf
+from tqdm import tqdm
 from uio2.model import UnifiedIOModel
 from uio2.runner import TaskRunner
 from uio2.preprocessing import UnifiedIOPreprocessor
+from uio2.avqa_pipeline import avqa_loader, generate_answers
 import cv2
 import numpy as np
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+from src.utils.video_scheduler import VideoGroupScheduler, video_path_of
+from src.utils.frame_dedup import from_env, VISION_FLOPS_PER_FRAME
+
 # ====== 基础配置 ======
 model_type = "xxl"
 MODEL_PATH = f"./models/uio2-{model_type}"
 PREPROCESSOR_PATH = "./uio2-preprocessor"
 VIDEO_ROOT = "./datasets/finevideo/videos"
+# UIO2_MODE=generate：自回归生成答案（原方式，需再用正则解析选项）
+# UIO2_MODE=mcq：用 score_answer_options 直接为选项打分，model_answer 即选项列表
+UIO2_MODE = os.getenv("UIO2_MODE", "generate")
+# mcq 模式下多选的处理方式：subsets（一次编码为所有选项组合打分）或 yesno（逐选项判断）
+MCQ_MULTI_MODE = os.getenv("MCQ_MULTI_MODE", "subsets")
+# 预处理后端：numpy（默认，不导入 TensorFlow）或 tf（原实现）
+UIO2_PREPROCESS_BACKEND = os.getenv("UIO2_PREPROCESS_BACKEND", "numpy")
+# UIO2_BATCH_SIZE>0（仅 generate 模式）：预处理放到 DataLoader 子进程，多个问题拼成一个 padding 批次生成
+UIO2_BATCH_SIZE = int(os.getenv("UIO2_BATCH_SIZE", "0"))
+UIO2_NUM_WORKERS = int(os.getenv("UIO2_NUM_WORKERS", "4"))
+# UIO2_TEXT_TARGET_ONLY=1（默认）：只构建文本输出头，不创建/加载图像与音频 VQGAN 的权重，节省显存与内存
+UIO2_TEXT_TARGET_ONLY = os.getenv("UIO2_TEXT_TARGET_ONLY", "1") == "1"
+# UIO2_ATTENTION_BACKEND=sdpa：用 F.scaled_dot_product_attention 计算注意力，不显式生成注意力矩阵，长视频序列更省内存
+UIO2_ATTENTION_BACKEND = os.getenv("UIO2_ATTENTION_BACKEND", "eager")
+# UIO2_KV_CACHE=static / static_fixed：解码时使用预分配的 KV cache（原地写入），dynamic 为原来的逐步拼接
+UIO2_KV_CACHE = os.getenv("UIO2_KV_CACHE", "dynamic")
+# FRAME_DEDUP=1：抽帧后按感知哈希去掉近重复帧（可在该帧的时间段内另取一帧替换），image history 帧数随画面变化
+FRAME_DEDUP = from_env(flops_per_frame=VISION_FLOPS_PER_FRAME["uio2"])
 
 if torch.cuda.is_available():
     device = torch.device("cuda")
@@ -21,8 +45,11 @@ else:
     device = torch.device("cpu")
 
 print("🚀 加载 UnifiedIO2 模型与预处理...")
-preprocessor = UnifiedIOPreprocessor.from_pretrained(PREPROCESSOR_PATH, tokenizer="tokenizer.model")
-model = UnifiedIOModel.from_pretrained(MODEL_PATH).to(device)
+preprocessor = UnifiedIOPreprocessor.from_pretrained(PREPROCESSOR_PATH, tokenizer="tokenizer.model",
+                                                     backend=UIO2_PREPROCESS_BACKEND)
+model = UnifiedIOModel.from_pretrained(
+    MODEL_PATH, target_modalities=["text"] if UIO2_TEXT_TARGET_ONLY else None,
+    attention_backend=UIO2_ATTENTION_BACKEND).to(device)
 runner = TaskRunner(model, preprocessor)
 
 USER_PROMPT = """
@@ -40,72 +67,62 @@ Output format:
 
 current_tasks = ["1intra_event_reasoning", "3audio_visual_alignment", "5topic_stance_evolution_summarization", "4timeline_reconstruction", "6cross_event_causality", "2multimodal_temporal_localization"] 
 
-
-for current_task in current_tasks:
-    print(f"===== 处理任务: {model_type}, {current_task} =====")
-    INPUT_FILE = f"./final_qa_subset/{current_task}.json"
-    OUTPUT_FILE = f"./experiment_frames/unifiedio2_{model_type}/128/{current_task}.json"
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    # ====== 读取历史结果（断点续跑） ======
-    if os.path.exists(OUTPUT_FILE):
-        with open(OUTPUT_FILE, "r", encoding="utf-8") as f:
-            results = json.load(f)
-    else:
-        results = {}
-
-    # ====== 读取 QA 数据 ======
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        qa_data = json.load(f)
-
-    print(f"📋 读取 {len(qa_data)} 个问题")
-
-    # ====== 主推理循环 ======
-    #for qa in tqdm(qa_data, desc="Running UnifiedIO2 Inference"):
-    for i, qa in enumerate(tqdm(qa_data, desc="Running UnifiedIO2 Inference")):
-        # if i == 259:
-        #     continue
-        # if i == 49:
-        #     continue
-        # if i == 423:
-        #     continue
-        qid = qa["question_id"]
-        question = qa["question"]
-        options = qa.get("options", "")
-        video_id = qa["related_videoID"]
-
-        if qid in results:
-            continue
-
-        # ====== 定位视频路径 ======
-        try:
-            category, idx = video_id.rsplit("_", 1)
-            video_path = os.path.join(VIDEO_ROOT, category, f"sample_{idx}.mp4")
-        except Exception as e:
-            print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常 {e}")
-            continue
-
+print(f"===== 处理任务: {model_type}, {len(current_tasks)} 个任务按视频分组 =====")
+scheduler = VideoGroupScheduler(
+    current_tasks,
+    input_pattern="./final_qa_subset/{task}.json",
+    output_pattern=(f"./experiment_frames/unifiedio2_{model_type}_mcq_{MCQ_MULTI_MODE}"
+                    if UIO2_MODE == "mcq" else f"./experiment_frames/unifiedio2_{model_type}")
+                   + ("_dedup" if FRAME_DEDUP is not None else "") + "/128/{task}.json",
+    video_root=VIDEO_ROOT,
+)
+
+
+def answer(media, qa):
+    frames, spectrograms = media
+    if UIO2_MODE == "mcq":
+        result = runner.avqa_mcq(frames, qa["question"], qa.get("options", []), audio=spectrograms,
+                                 multi_mode=MCQ_MULTI_MODE)
+        return {"model_answer": result["answer"], "option_scores": result["scores"]}
+    prompt = USER_PROMPT.format(question=qa["question"], options=qa.get("options", ""))
+    return runner.avqa(frames, prompt, audio=spectrograms, kv_cache=UIO2_KV_CACHE)
+
+
+def run_batched():
+    videos = []
+    for video_id, items in scheduler.pending_groups().items():
+        video_path = video_path_of(VIDEO_ROOT, video_id)
         if not os.path.exists(video_path):
-            print(f"⚠️ 视频不存在 {video_path}")
+            print(f"⚠️ 视频不存在: {video_path}")
             continue
-
-        # ====== 构造输入 ======
-        try:
-            model_answer = runner.avqa(video_path, USER_PROMPT.format(question=question, options=options))
-        except Exception as e:
-            print(f"推理失败: {qid}, 异常: {e}")
+        prompts = [((task, qa), USER_PROMPT.format(question=qa["question"], options=qa.get("options", "")))
+                   for task, qa in items]
+        videos.append((video_path, prompts))
+    print(f"📋 {sum(len(p) for _, p in videos)} 个待回答问题，{len(videos)} 个视频，"
+          f"batch_size={UIO2_BATCH_SIZE}，{UIO2_NUM_WORKERS} 个预处理进程")
+
+    # 去重在 DataLoader 子进程中进行，保留帧记录随每个视频回传，由 generate_answers 合并到 FRAME_DEDUP
+    loader = avqa_loader(videos, preprocessor, num_workers=UIO2_NUM_WORKERS, frame_filter=FRAME_DEDUP)
+    stats = {}
+    start = time.perf_counter()
+    answers = generate_answers(runner, loader, UIO2_BATCH_SIZE, stats=stats, kv_cache=UIO2_KV_CACHE)
+    for (task, qa), output, error in tqdm(answers,
+                                          total=sum(len(p) for _, p in videos), desc="Running UnifiedIO2 Inference"):
+        if error is not None:
+            print(f"⚠️ 推理失败: {task}/{qa['question_id']}, 异常: {error}")
             continue
+        scheduler.save(task, qa, output)
+    elapsed = time.perf_counter() - start
+    print(f"⏱️ 共 {elapsed:.1f}s，等待预处理 {stats['wait_time']:.1f}s，生成 {stats['generate_time']:.1f}s"
+          f"（{stats['batches']} 个批次，{stats['questions'] / max(elapsed, 1e-6):.2f} 题/s）")
 
-        # ====== 保存结果 ======
-        results[qid] = {
-            "question_id": qid,
-            "question": question,
-            "options": options,
-            "video_id": video_id,
-            "model_answer": model_answer
-        }
 
-        # 实时写入
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-
-    print(f"\n推理完成，结果已保存到：{OUTPUT_FILE}")
+if UIO2_BATCH_SIZE > 0 and UIO2_MODE == "generate":
+    run_batched()
+else:
+    # 每个视频只解码一次帧和音频频谱，供它的所有问题复用
+    scheduler.run(prepare=lambda video: runner.load_av(video, frame_filter=FRAME_DEDUP), answer=answer,
+                  desc="Running UnifiedIO2 Inference")
+if FRAME_DEDUP is not None:
+    print(f"🎞️ 帧去重: {FRAME_DEDUP.stats()}")
+    FRAME_DEDUP.dump(os.path.join(os.path.dirname(scheduler.output_files[current_tasks[0]]), "frame_dedup.json"))
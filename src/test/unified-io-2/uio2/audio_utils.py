@@ -1,4 +1,5 @@
 """Utility functions for pre-processing audio"""
+import functools
 import logging
 import subprocess
 from os.path import exists
@@ -13,6 +14,11 @@ from uio2 import config
 BUFFER_FROM_END = 0.1
 WAV_MAX_VALUE = 32768.0
 
+# Spectrogram parameters we manually selected for sound quality
+N_FFT = 1024
+HOP_LENGTH = 256
+N_MELS = 128
+
 
 def get_num_segments(audio_length, audio_segment_length):
   num_segments = int(audio_length // audio_segment_length)
@@ -71,10 +77,10 @@ def make_spectrogram(waveform, sample_rate=16000):
 
   # Parameters we manually selected for sound quality
   params = {
-    'n_fft': 1024,
-    'hop_length': 256,
+    'n_fft': N_FFT,
+    'hop_length': HOP_LENGTH,
     'window': scipy.signal.windows.hann,
-    'n_mels': 128,
+    'n_mels': N_MELS,
     'fmin': 0.0,
     'fmax': sample_rate / 2.0,
     'center': True,
@@ -84,12 +90,55 @@ def make_spectrogram(waveform, sample_rate=16000):
   return mel
 
 
+@functools.lru_cache(maxsize=8)
+def _mel_basis(sample_rate):
+  try:
+    from librosa.filters import mel
+  except ImportError as e:
+    raise ValueError("Librosa must be install for audio pre-processing", e)
+  return mel(sr=sample_rate, n_fft=N_FFT, n_mels=N_MELS, fmin=0.0, fmax=sample_rate / 2.0)
+
+
+@functools.lru_cache(maxsize=1)
+def _stft_window():
+  # librosa calls a callable window as `window(n_fft)`, i.e. scipy's symmetric Hann
+  return scipy.signal.windows.hann(N_FFT).astype(np.float32)
+
+
+def make_spectrograms(segments, sample_rate=16000, batch_size=32):
+  """Batched `make_spectrogram` for equal-length waveform segments
+
+  Frames every segment with stride tricks, runs one single-precision FFT per batch of
+  segments (`np.fft` always computes in float64) and applies the cached mel filterbank
+  with a single matmul.
+
+  Args:
+    segments: [N, num_samples] float32 waveforms
+    batch_size: segments per FFT call, bounds the [batch, frames, n_fft] buffer
+
+  Returns: [N, 128, num_frames] mel power spectrograms, as `make_spectrogram` per segment
+  """
+  segments = np.asarray(segments, dtype=np.float32)
+  mel_basis = _mel_basis(sample_rate)
+  window = _stft_window()
+  out = []
+  for start in range(0, len(segments), batch_size):
+    # center=True, pad_mode="reflect"
+    padded = np.pad(segments[start:start + batch_size], ((0, 0), (N_FFT // 2, N_FFT // 2)), mode="reflect")
+    frames = np.lib.stride_tricks.sliding_window_view(padded, N_FFT, axis=-1)[:, ::HOP_LENGTH]
+    stft = scipy.fft.rfft(frames * window, axis=-1, workers=-1)  # complex64
+    power = stft.real ** 2 + stft.imag ** 2  # [batch, num_frames, n_fft // 2 + 1]
+    out.append(np.matmul(mel_basis, power.transpose(0, 2, 1)))
+  return np.concatenate(out, 0)
+
+
 def extract_spectrograms_from_audio(
     waveform: np.ndarray,
     audio_length,
     audio_segment_length: float = config.AUDIO_SEGMENT_LENGTH,
     spectrogram_length: float = config.AUDIO_SPECTRUM_LENGTH,
     sampling_rate: int = config.AUDIO_SAMPLING_RATE,
+    batched: bool = True,
 ) -> List[np.ndarray]:
   """Turns a waveform in a list of melspectograms UIO2 can process"""
   num_segments = get_num_segments(audio_length, audio_segment_length)
@@ -106,7 +155,7 @@ def extract_spectrograms_from_audio(
   waveform = waveform[:max_samples]
 
   # split waveform into segments
-  spectrograms = []
+  segments = []
   for i in range(num_segments):
     if audio_segment_length <= spectrogram_length:
       ts_start = int(boundaries[i] * sampling_rate)
@@ -133,16 +182,18 @@ def extract_spectrograms_from_audio(
       end = start + int(sampling_rate * spectrogram_length)
       waveform_segment = waveform[start:end]
 
-    # Create spectrogram from waveform
-    spectrogram = make_spectrogram(
-      waveform_segment, sampling_rate,
-    )  # shape (128, 256)
-    spectrograms.append(spectrogram)
+    segments.append(waveform_segment)
 
-  if len(spectrograms) == 0:
+  if len(segments) == 0:
     assert num_segments == 0
     raise ValueError("Couldn't make spectrograms: num_segments is 0")
 
+  # Create spectrograms from waveform segments, each of shape (128, 256)
+  if batched:
+    spectrograms = make_spectrograms(np.stack(segments), sampling_rate)
+  else:
+    spectrograms = [make_spectrogram(x, sampling_rate) for x in segments]
+
   # (N,128,256) is (# of segments, # of mel bands in spectrogram, # of hops in spectrogram)
   spectrograms = np.stack(spectrograms).astype(np.float32)
   assert spectrograms.shape[1:] == (128, 256)
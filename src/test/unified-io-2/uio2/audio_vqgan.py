@@ -112,7 +112,7 @@ class Transformer(nn.Module):
     super().__init__()
     self.dropout = nn.Dropout(dropout_rate)
     self.num_layers = num_layers
-    dpr = [x.item() for x in torch.linspace(0, droppath_rate, num_layers)]
+    dpr = [x.item() for x in torch.linspace(0, droppath_rate, num_layers, device="cpu")]
     for lyr in range(self.num_layers):
       self.add_module(
         f"encoderblock_{lyr}", TransformerLayer(
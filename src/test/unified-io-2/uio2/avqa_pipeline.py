@@ -0,0 +1,147 @@
+"""Batched audio-visual QA: pre-process in DataLoader workers, generate for padded batches
+
+Frame extraction, spectrograms and the pre-processing of each video run in worker
+processes while the model generates for the previous batch. Each dataset item is one video
+with all of its prompts, so a video is still decoded only once however many questions it has.
+
+Usage:
+  loader = avqa_loader([(video_file, [(key, prompt), ...]), ...], preprocessor, num_workers=4)
+  for key, answer, error in generate_answers(runner, loader, batch_size=8):
+    ...
+"""
+import logging
+import time
+from typing import Any, List, Sequence, Tuple
+
+from torch.utils.data import DataLoader, Dataset
+
+from uio2.video_utils import load_video
+
+
+class AvqaVideoDataset(Dataset):
+  """One item per video: decode it once and pre-process every prompt about it
+
+  Args:
+    videos: list of (video_file, [(key, prompt), ...]), keys are returned with the answers
+    preprocessor: `UnifiedIOPreprocessor`
+    max_frames: number of frames to sample, defaults to the preprocessor's sequence length
+    frame_filter: passed to `load_video`, runs in the worker processes; the `records` it adds
+      for a video (e.g. `FrameDeduplicator.records`) are returned with that video's item
+  """
+
+  def __init__(self, videos: Sequence[Tuple[str, List[Tuple[Any, str]]]], preprocessor,
+               max_frames=None, frame_filter=None):
+    self.videos = list(videos)
+    self.preprocessor = preprocessor
+    self.frame_filter = frame_filter
+    if max_frames is None:
+      max_frames = preprocessor.sequence_length["num_frames"]
+    self.max_frames = max_frames
+
+  def __len__(self):
+    return len(self.videos)
+
+  def __getitem__(self, ix):
+    """Returns (keys, examples, error, filter_records), errors are returned so one bad video does not
+    stop the loader"""
+    video_file, prompts = self.videos[ix]
+    keys = [key for key, _ in prompts]
+    seen = set(getattr(self.frame_filter, "records", ()))
+    try:
+      frames, spectrograms = load_video(video_file, self.max_frames, use_audio=True,
+                                        frame_filter=self.frame_filter)
+      examples = [
+        self.preprocessor(text_inputs=prompt, video_inputs=frames, audio_inputs=spectrograms,
+                          use_video_audio=True, target_modality="text")
+        for _, prompt in prompts
+      ]
+    except Exception as e:
+      return keys, None, f"{video_file}: {e}", self._new_filter_records(seen)
+    return keys, examples, None, self._new_filter_records(seen)
+
+  def _new_filter_records(self, seen):
+    # In a worker process the filter is a copy, so its records have to travel back with the item
+    records = getattr(self.frame_filter, "records", None)
+    if not records:
+      return {}
+    return {key: record for key, record in records.items() if key not in seen}
+
+
+def _no_collate(item):
+  # Items are batched across videos in the main process, see `generate_answers`
+  return item
+
+
+def avqa_loader(videos, preprocessor, num_workers=4, max_frames=None, prefetch_factor=2,
+                multiprocessing_context=None, frame_filter=None) -> DataLoader:
+  """DataLoader that yields the pre-processed (keys, examples, error, filter_records) of one video at a time
+
+  Workers only run the pre-processing, the model stays in the main process. With the default
+  "fork" start method the caller's script does not need an `if __name__ == "__main__"` guard.
+  """
+  kwargs = {}
+  if num_workers > 0:
+    kwargs = dict(prefetch_factor=prefetch_factor, multiprocessing_context=multiprocessing_context)
+  return DataLoader(
+    AvqaVideoDataset(videos, preprocessor, max_frames, frame_filter),
+    batch_size=None, shuffle=False, num_workers=num_workers, collate_fn=_no_collate, **kwargs)
+
+
+def generate_answers(runner, loader, batch_size=8, max_tokens=2048, stats=None, **gen_args):
+  """Generate answers for the prompts in `loader`, `batch_size` prompts at a time
+
+  Examples from consecutive videos are packed into the same batch, padded by
+  `preprocessing.build_batch`.
+
+  Args:
+    runner: `TaskRunner`
+    loader: DataLoader from `avqa_loader`
+    batch_size: number of prompts to generate for at once
+    max_tokens: max number of generated tokens
+    stats: optional dictionary, updated with the time spent waiting for the loader and generating
+
+  The `frame_filter` records returned by the workers are merged into the dataset's `frame_filter`
+  in this process, so its `stats()` / `dump()` cover the whole run.
+
+  Yields: (key, answer, error) for each prompt, `answer` is None if pre-processing or generation failed
+  """
+  if stats is not None:
+    stats.update(wait_time=0.0, generate_time=0.0, batches=0, questions=0)
+
+  def _flush(keys, examples):
+    start = time.perf_counter()
+    try:
+      answers = runner.predict_text_batch(examples, max_tokens=max_tokens, **gen_args)
+    except Exception as e:
+      logging.exception("Generation failed")
+      answers, error = [None] * len(keys), str(e)
+    else:
+      error = None
+    if stats is not None:
+      stats["generate_time"] += time.perf_counter() - start
+      stats["batches"] += 1
+      stats["questions"] += len(keys)
+    for key, answer in zip(keys, answers):
+      yield key, answer, error
+
+  frame_filter = getattr(loader.dataset, "frame_filter", None)
+  pending_keys, pending_examples = [], []
+  start = time.perf_counter()
+  for keys, examples, error, filter_records in loader:
+    if stats is not None:
+      stats["wait_time"] += time.perf_counter() - start
+    if filter_records and hasattr(frame_filter, "records"):
+      frame_filter.records.update(filter_records)
+    if error is not None:
+      for key in keys:
+        yield key, None, error
+    else:
+      pending_keys += keys
+      pending_examples += examples
+      while len(pending_keys) >= batch_size:
+        yield from _flush(pending_keys[:batch_size], pending_examples[:batch_size])
+        pending_keys, pending_examples = pending_keys[batch_size:], pending_examples[batch_size:]
+    start = time.perf_counter()
+
+  if pending_keys:
+    yield from _flush(pending_keys, pending_examples)
@@ -1,10 +1,8 @@
 """Utility pre-processing functions"""
 from typing import Optional
 
-import tensorflow as tf
-from tensorflow.python.ops import control_flow_ops
-
 from uio2 import config
+from uio2.lazy_import import tf
 
 
 def apply_with_random_selector(x, func, num_cases):
@@ -17,6 +15,7 @@ def apply_with_random_selector(x, func, num_cases):
     The result of func(x, sel), where func receives the value of the
     selector as a python integer, but sel is sampled dynamically.
   """
+  from tensorflow.python.ops import control_flow_ops
   sel = tf.random.uniform([], maxval=num_cases, dtype=tf.int32)
   # Pass the real x only to one of the func calls.
   return control_flow_ops.merge([
@@ -161,7 +160,7 @@ def resize_and_pad(
     image, desired_output_size, target_image=None, boxes=None, box_labels=None,
     random_scale_min=0.1, random_scale_max=2.0, do_random_scale=False,
     shrink_both_sides=True, filter_box=True, desired_target_size=None, random_scale_ratio=0.0,
-    resize_method=tf.image.ResizeMethod.BILINEAR, boxes_normalized=False
+    resize_method=None, boxes_normalized=False
 ):
   """Resizes and pads an input image/video to `desired_output_size`
 
@@ -176,6 +175,8 @@ def resize_and_pad(
     image_mask: A mask showing which pixels are padding in the output image
     meta-data: Meta-data about the transformation and the boxes/masks that were also transformed
   """
+  if resize_method is None:
+    resize_method = tf.image.ResizeMethod.BILINEAR
   desired_height, desired_width = desired_output_size
   desired_height_f = tf.cast(desired_height, dtype=tf.float32)
   desired_width_f = tf.cast(desired_width, dtype=tf.float32)
@@ -377,7 +378,7 @@ def values_to_tokens(vals, clss=None):
   return tokens
 
 
-def _shift_right_by_one(tensor: tf.Tensor, bos_id: int = 0) -> tf.Tensor:
+def _shift_right_by_one(tensor: "tf.Tensor", bos_id: int = 0) -> "tf.Tensor":
   """Shift the input tensor to the right by one position without wrapping
 
   From seqio: https://github.com/google/seqio
@@ -399,11 +400,11 @@ def _shift_right_by_one(tensor: tf.Tensor, bos_id: int = 0) -> tf.Tensor:
 
 
 def make_autoregressive_inputs(
-    targets: tf.Tensor,
-    sequence_id: tf.Tensor = None,
-    output_dtype: Optional[tf.dtypes.DType] = None,
+    targets: "tf.Tensor",
+    sequence_id: "tf.Tensor" = None,
+    output_dtype: Optional["tf.dtypes.DType"] = None,
     bos_id: int = 0,
-) -> tf.Tensor:
+) -> "tf.Tensor":
   """Shift tokens right and add BOS to build decoder inputs
 
   from seqio: https://github.com/google/seqio
@@ -0,0 +1,136 @@
+"""NumPy/torch versions of the inference pre-processing functions in `data_utils`
+
+These reproduce the TF ops used by the "tf" pre-processing backend closely enough to produce
+the same features (see `check_preprocessing_backends.py`) without importing TensorFlow.
+Only the inference path is supported, random scale augmentation still requires TF.
+"""
+import einops
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from uio2 import config
+
+# Frames resized at once, keeps the float copy of long high-resolution videos small
+RESIZE_CHUNK = 16
+
+
+def convert_image_dtype(image):
+  """`tf.image.convert_image_dtype(image, tf.float32)`"""
+  if image.dtype == np.uint8:
+    return image.astype(np.float32) * np.float32(1.0 / 255)
+  return image.astype(np.float32)
+
+
+def resize_bilinear_antialias(image, size):
+  """`tf.image.resize(image, size, BILINEAR, antialias=True)` for a [H, W, C] or [T, H, W, C] image
+
+  torch's anti-aliased bilinear kernel is the same triangle filter, scaled by the
+  down-sampling factor, as TF's `scale_and_translate`.
+  """
+  is_video = image.ndim == 4
+  frames = image if is_video else image[None]
+  if tuple(frames.shape[1:3]) == tuple(size):
+    out = frames.astype(np.float32)
+  else:
+    out = np.empty((len(frames),) + tuple(size) + frames.shape[3:], dtype=np.float32)
+    for start in range(0, len(frames), RESIZE_CHUNK):
+      chunk = torch.from_numpy(np.ascontiguousarray(frames[start:start + RESIZE_CHUNK], dtype=np.float32))
+      chunk = F.interpolate(chunk.permute(0, 3, 1, 2), size=tuple(size), mode="bilinear",
+                            align_corners=False, antialias=True)
+      out[start:start + RESIZE_CHUNK] = chunk.permute(0, 2, 3, 1).numpy()
+  return out if is_video else out[0]
+
+
+def resize_nearest(image, size):
+  """`tf.image.resize(image, size, NEAREST_NEIGHBOR)` for a [..., H, W, C] array, keeps the dtype"""
+  h, w = image.shape[-3:-1]
+  out_h, out_w = size
+  # TF2 uses half pixel centers: in = floor((out + 0.5) * in_size / out_size), in float32
+  ys = np.floor((np.arange(out_h, dtype=np.float32) + np.float32(0.5)) * np.float32(h / out_h))
+  xs = np.floor((np.arange(out_w, dtype=np.float32) + np.float32(0.5)) * np.float32(w / out_w))
+  ys = np.minimum(ys.astype(np.int64), h - 1)
+  xs = np.minimum(xs.astype(np.int64), w - 1)
+  return image[..., ys, :, :][..., xs, :]
+
+
+def resize_and_pad_default(image, is_input=True, is_history=False):
+  """`data_utils.resize_and_pad_default` with `is_training=False`
+
+  Returns:
+    image: The resized and padded image/video
+    image_mask: int32 mask showing which pixels are not padding
+    image_info: meta-data about the resizing, as in `data_utils.resize_and_pad`
+  """
+  if is_history:
+    desired_height, desired_width = config.IMAGE_HISTORY_INPUT_SIZE
+  elif is_input:
+    desired_height, desired_width = config.IMAGE_INPUT_SIZE
+  else:
+    desired_height, desired_width = config.IMAGE_TARGET_SIZE
+
+  image = np.asarray(image)
+  is_video = image.ndim == 4
+  height, width = image.shape[1:3] if is_video else image.shape[:2]
+
+  # Same float32 arithmetic as TF so the scaled sizes round identically
+  height_f, width_f = np.float32(height), np.float32(width)
+  image_scale = min(np.float32(desired_height) / height_f, np.float32(desired_width) / width_f)
+  scaled_height = int(height_f * image_scale)
+  scaled_width = int(width_f * image_scale)
+
+  image = convert_image_dtype(image)
+  image = resize_bilinear_antialias(image, (scaled_height, scaled_width))
+  image = np.clip(image, 0.0, 1.0)
+  image = image[..., :desired_height, :desired_width, :]
+  h, w = image.shape[-3:-1]
+
+  top_pad = (desired_height - h) // 2
+  left_pad = (desired_width - w) // 2
+  out_shape = image.shape[:-3] + (desired_height, desired_width)
+  image_mask = np.zeros(out_shape, dtype=np.int32)
+  image_mask[..., top_pad:top_pad + h, left_pad:left_pad + w] = 1
+  padded = np.zeros(out_shape + (image.shape[-1],), dtype=np.float32)
+  padded[..., top_pad:top_pad + h, left_pad:left_pad + w, :] = image
+
+  image_info = np.array([
+    top_pad, left_pad, np.float32(1.0) / image_scale, height, width,
+    0.0, 0.0, 0.0, 0.0, scaled_height, scaled_width,
+  ], dtype=np.float32)
+  return padded, image_mask, image_info
+
+
+def normalize_image(image, offset=config.IMAGE_VIT_MEAN, scale=config.IMAGE_VIT_STD):
+  return (image - np.asarray(offset, dtype=image.dtype)) / np.asarray(scale, dtype=image.dtype)
+
+
+def trim_or_pad_2d(x, batch, seq_len):
+  x = x[:batch, :seq_len]
+  pad = [(0, batch - x.shape[0]), (0, seq_len - x.shape[1])] + [(0, 0)] * (x.ndim - 2)
+  return np.pad(x, pad)
+
+
+def sample_patches(mask, n_patches, rng=np.random):
+  """Select `n_patches` positions from `mask`, valid positions first in a random order"""
+  valid = np.flatnonzero(mask)
+  masked = np.flatnonzero(mask == 0)
+  ixs = np.concatenate([rng.permutation(valid), rng.permutation(masked)])[:n_patches]
+  return ixs.astype(np.int32)
+
+
+def patch_mask(masks, patch_grid):
+  """Pixel mask(s) [..., H, W] -> patch mask [..., n_patches], as done in `preprocess_inputs`"""
+  if masks.ndim == 2:
+    return resize_nearest(masks[..., None], patch_grid).reshape(-1).astype(np.int32)
+  return resize_nearest(masks[..., None], patch_grid).reshape(masks.shape[0], -1).astype(np.int32)
+
+
+def to_patches(image, d, is_history):
+  if is_history:
+    return einops.rearrange(image, 't (h dh) (w dw) c -> t (h w) (dh dw c)', dh=d, dw=d)
+  return einops.rearrange(image, '(h dh) (w dw) c -> (h w) (dh dw c)', dh=d, dw=d)
+
+
+def make_autoregressive_inputs(targets, bos_id=config.BOS_ID):
+  """Shift 1-D tokens right and add BOS"""
+  return np.concatenate([np.full([1], bos_id, dtype=targets.dtype), targets[:-1]])
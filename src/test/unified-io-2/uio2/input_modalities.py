@@ -10,9 +10,9 @@ import torch.nn as nn
 from uio2.config import Config, T5Config, ImageResamplerConfig, AudioResamplerConfig
 from uio2.data_utils import normalize_image, sample_patches, trim_or_pad_tf_2d
 from uio2.seq_features import InputSequence
-from uio2 import layers, config
+from uio2 import layers, config, data_utils_np
+from uio2.lazy_import import tf
 from uio2.perceiver import Resampler
-import tensorflow as tf
 import numpy as np
 
 
@@ -30,6 +30,13 @@ class ModalityEncoder:
     """
     raise NotImplementedError(self.__class__)
 
+  def preprocess_inputs_np(self, features: Dict, vocab, sequence_length) -> Optional[Dict]:
+    """NumPy version of `preprocess_inputs` used by the "numpy" pre-processing backend
+
+    Returns: the same dictionary as `preprocess_inputs`, but of numpy arrays
+    """
+    raise NotImplementedError(f"{self.__class__.__name__} requires the TF pre-processing backend")
+
   def get_encoder(self, config: Config) -> nn.Module:
     """
     Args:
@@ -100,6 +107,21 @@ class InputTextEncoder(ModalityEncoder):
         "mask": tf.cast(tokens != config.PAD_ID, tf.int32),
       }
 
+  def preprocess_inputs_np(self, features, vocab, sequence_length) -> Dict:
+    text_inputs = features.get("text_inputs")
+    if text_inputs is None:
+      return {}
+    if isinstance(text_inputs, str):
+      text_inputs = np.asarray(vocab.encode(text_inputs), dtype=np.int32)
+    # Add EOS
+    text_inputs = text_inputs[:config.MAX_TEXT_LEN-1]
+    tokens = np.pad(text_inputs, [[0, 1]], constant_values=config.EOS_ID)
+    return {
+      "tokens": tokens,
+      "pos_ids": np.arange(tokens.shape[0], dtype=np.int32),
+      "mask": (tokens != config.PAD_ID).astype(np.int32),
+    }
+
   def get_encoder(self, config: T5Config) -> nn.Module:
     return InputTextEmbedder(config)
 
@@ -255,6 +277,42 @@ class InputImageViTEncoder(ModalityEncoder):
       'pos_ids': image_encoder_pos_ids
     }
 
+  def preprocess_inputs_np(self, features, output_features, sequence_length) -> Dict:
+    image_inputs = features.get("image_inputs")
+    if image_inputs is None:
+      return {}
+    if "image_encoder_pos_ids" in features:
+      raise NotImplementedError("Pre-sampled image patches require the TF pre-processing backend")
+
+    input_padding_size = np.array(config.IMAGE_INPUT_SIZE, dtype=np.int32) // config.IMAGE_INPUT_D
+    n_patches = np.prod(input_padding_size)
+    image_samples = sequence_length.get('image_input_samples', None)
+    if image_samples is None:
+      image_samples = n_patches
+    if isinstance(image_samples, float):
+      image_samples = int(n_patches*image_samples)
+
+    image_inputs = data_utils_np.normalize_image(
+      image_inputs, offset=config.IMAGE_VIT_MEAN, scale=config.IMAGE_VIT_STD)
+    image_input_masks = features.get("image_input_masks")
+    assert image_input_masks is not None
+    if len(image_input_masks.shape) != 1:
+      image_input_masks = data_utils_np.patch_mask(image_input_masks, input_padding_size)
+
+    image_inputs = data_utils_np.to_patches(image_inputs, config.IMAGE_INPUT_D, is_history=False)
+    if image_samples < n_patches:
+      image_encoder_pos_ids = data_utils_np.sample_patches(image_input_masks, image_samples)
+      image_inputs = image_inputs[image_encoder_pos_ids]
+      image_input_masks = image_input_masks[image_encoder_pos_ids]
+    else:
+      image_encoder_pos_ids = np.arange(image_samples, dtype=np.int32)
+
+    return {
+      'input': image_inputs,
+      'mask': image_input_masks,
+      'pos_ids': image_encoder_pos_ids
+    }
+
 
 class ViTHistoryEmbedder(nn.Module):
   """Embeds image or audio history using an encoder and then a perciever"""
@@ -372,6 +430,39 @@ class ViTHistoryEmbedder(nn.Module):
     return InputSequence(video_features, mask=video_mask, position_embed=video_pos_emb)
 
 
+def _history_inputs_np(input, input_masks, input_size, d, n_patches, sequence_length, length_key):
+  """NumPy `preprocess_inputs` shared by the image and audio history encoders, `input` is normalized"""
+  input_padding_size = np.array(input_size, dtype=np.int32) // d
+  total_patches = int(np.prod(input_padding_size))
+  if n_patches is None:
+    n_patches = total_patches
+
+  assert input_masks is not None
+  if len(input_masks.shape) != 2:
+    input_masks = data_utils_np.patch_mask(input_masks, input_padding_size)
+
+  temporal_len = sequence_length.get('num_frames')
+  if temporal_len is None:
+    temporal_len = max(sequence_length[length_key], 1)
+
+  input = data_utils_np.to_patches(input, d, is_history=True)
+  if n_patches < total_patches:
+    encoder_pos_ids = np.stack([data_utils_np.sample_patches(m, n_patches) for m in input_masks])
+    input = np.take_along_axis(input, encoder_pos_ids[:, :, None], axis=1)
+    input_masks = np.take_along_axis(input_masks, encoder_pos_ids, axis=1)
+  else:
+    # Like the TF version, padding frames also get position ids
+    encoder_pos_ids = np.tile(np.arange(n_patches, dtype=np.int32)[None, :], [temporal_len, 1])
+
+  # Pad everything to be a constant shape
+  spatial_len = input.shape[1]
+  return {
+    "input": data_utils_np.trim_or_pad_2d(input, temporal_len, spatial_len),
+    "mask": data_utils_np.trim_or_pad_2d(input_masks, temporal_len, spatial_len),
+    "pos_ids": data_utils_np.trim_or_pad_2d(encoder_pos_ids, temporal_len, spatial_len)
+  }
+
+
 class InputImageHistoryViTEncoder(ModalityEncoder):
   def __init__(self, image_encoder, resampler_config, max_images_per_batch=None) -> None:
     super().__init__()
@@ -384,7 +475,7 @@ class InputImageHistoryViTEncoder(ModalityEncoder):
       self.image_encoder, self.resampler_config, config, "image", self.max_images_per_batch)
 
   def preprocess_inputs(
-      self, features: Dict, output_features, sequence_length) -> Dict[str, tf.Tensor]:
+      self, features: Dict, output_features, sequence_length) -> Dict[str, "tf.Tensor"]:
     input = features.get("image_history_inputs")
     if input is None:
       return {}
@@ -458,6 +549,18 @@ class InputImageHistoryViTEncoder(ModalityEncoder):
       "pos_ids": trim_or_pad_tf_2d(encoder_pos_ids, temporal_len, spatial_len)
     }
 
+  def preprocess_inputs_np(self, features, output_features, sequence_length) -> Dict:
+    input = features.get("image_history_inputs")
+    if input is None:
+      return {}
+    if "image_history_encoder_pos_ids" in features:
+      raise NotImplementedError("Pre-sampled image patches require the TF pre-processing backend")
+    return _history_inputs_np(
+      data_utils_np.normalize_image(input), features.get("image_history_input_masks"),
+      config.IMAGE_HISTORY_INPUT_SIZE, config.IMAGE_HISTORY_INPUT_D,
+      sequence_length.get('image_history_input_samples'), sequence_length,
+      "inputs/image_history/input")
+
 
 class InputAudioViTEncoder(ModalityEncoder):
   def __init__(self, audio_encoder, use_vit = False, freeze_vit = True) -> None:
@@ -536,6 +639,37 @@ class InputAudioViTEncoder(ModalityEncoder):
       'pos_ids': audio_encoder_pos_ids
     }
 
+  def preprocess_inputs_np(self, features, output_features, sequence_length) -> Dict:
+    audio_inputs = features.get("audio_inputs")
+    if audio_inputs is None:
+      return {}
+    if "audio_encoder_pos_ids" in features:
+      raise NotImplementedError("Pre-sampled audio patches require the TF pre-processing backend")
+
+    audio_samples = sequence_length['audio_input_samples']
+    input_padding_size = np.array(config.AUDIO_INPUT_SIZE, dtype=np.int32) // config.AUDIO_INPUT_D
+    n_patches = np.prod(input_padding_size)
+
+    audio_inputs = (audio_inputs - config.AUDIO_VIT_MEAN) / config.AUDIO_VIT_STD
+    audio_input_masks = features.get("audio_input_masks")
+    assert audio_input_masks is not None
+    if len(audio_input_masks.shape) != 1:
+      audio_input_masks = data_utils_np.patch_mask(audio_input_masks, input_padding_size)
+
+    audio_inputs = data_utils_np.to_patches(audio_inputs, config.AUDIO_INPUT_D, is_history=False)
+    if audio_samples < n_patches:
+      audio_encoder_pos_ids = data_utils_np.sample_patches(audio_input_masks, audio_samples)
+      audio_inputs = audio_inputs[audio_encoder_pos_ids]
+      audio_input_masks = audio_input_masks[audio_encoder_pos_ids]
+    else:
+      audio_encoder_pos_ids = np.arange(audio_samples, dtype=np.int32)
+
+    return {
+      'input': audio_inputs,
+      'mask': audio_input_masks,
+      'pos_ids': audio_encoder_pos_ids
+    }
+
 
 class InputAudioHistoryViTEncoder(ModalityEncoder):
   def __init__(self, audio_encoder, resampler_config, max_images_per_batch=None) -> None:
@@ -549,7 +683,7 @@ class InputAudioHistoryViTEncoder(ModalityEncoder):
       self.audio_encoder, self.resampler_config, config, "audio", self.max_images_per_batch)
 
   def preprocess_inputs(
-      self, features: Dict, output_features, sequence_length) -> Dict[str, tf.Tensor]:
+      self, features: Dict, output_features, sequence_length) -> Dict[str, "tf.Tensor"]:
     input = features.get("audio_history_inputs")
     if input is None:
       return {}
@@ -625,3 +759,15 @@ class InputAudioHistoryViTEncoder(ModalityEncoder):
       "pos_ids": trim_or_pad_tf_2d(encoder_pos_ids, temporal_len, spatial_len)
     }
 
+  def preprocess_inputs_np(self, features, output_features, sequence_length) -> Dict:
+    input = features.get("audio_history_inputs")
+    if input is None:
+      return {}
+    if "audio_history_encoder_pos_ids" in features:
+      raise NotImplementedError("Pre-sampled audio patches require the TF pre-processing backend")
+    return _history_inputs_np(
+      (input - config.AUDIO_VIT_MEAN) / config.AUDIO_VIT_STD, features.get("audio_history_input_masks"),
+      config.AUDIO_HISTORY_INPUT_SIZE, config.AUDIO_HISTORY_INPUT_D,
+      sequence_length.get('audio_history_input_samples'), sequence_length,
+      "inputs/audio_history/input")
+
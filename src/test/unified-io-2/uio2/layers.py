@@ -13,7 +13,7 @@ from torch.nn import functional as F
 from typing import Any, Callable, Iterable, Optional, Sequence, Tuple, Union, List
 import einops
 
-from transformers import DynamicCache
+from transformers import Cache, DynamicCache
 
 
 def space_to_depth(
@@ -501,6 +501,122 @@ def dot_product_attention(query: torch.Tensor,
   return torch.einsum('bhqk,bkhd->bqhd', attn_weights, value)
 
 
+class StaticKVCache(Cache):
+  """Self-attention key/value cache with buffers preallocated for `max_length` tokens
+
+  `DynamicCache` concatenates the new keys/values onto the cache at every decoding step,
+  re-allocating and copying it each time, this cache writes them in-place instead.
+
+  Args:
+    num_layers: number of decoder layers
+    batch_size: batch size, including any classifier-free guidance or beam copies
+    num_heads: number of attention heads
+    head_dim: dimension of each head
+    max_length: maximum number of decoded tokens
+    fixed_shape: if True, return the full buffers and mask the positions that have not been
+      written with `attention_bias`, so every decoding step has the same tensor shapes.
+      Otherwise return views of the written positions.
+  """
+
+  def __init__(self, num_layers, batch_size, num_heads, head_dim, max_length,
+               dtype=torch.float32, device=None, fixed_shape=False):
+    shape = (batch_size, num_heads, max_length, head_dim)
+    self.key_cache = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(num_layers)]
+    self.value_cache = [torch.zeros(shape, dtype=dtype, device=device) for _ in range(num_layers)]
+    self.lengths = [0] * num_layers
+    self.max_length = max_length
+    self.fixed_shape = fixed_shape
+    self._positions = torch.arange(max_length, device=device)
+
+  def __getitem__(self, layer_idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    if self.fixed_shape:
+      return self.key_cache[layer_idx], self.value_cache[layer_idx]
+    n = self.lengths[layer_idx]
+    return self.key_cache[layer_idx][:, :, :n], self.value_cache[layer_idx][:, :, :n]
+
+  def __len__(self):
+    return len(self.key_cache)
+
+  def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+    """Write `[batch, num_heads, length, head_dim]` keys/values after the cached ones"""
+    start = self.lengths[layer_idx]
+    end = start + key_states.shape[-2]
+    if end > self.max_length:
+      raise ValueError(f"StaticKVCache is full, it was allocated for {self.max_length} tokens")
+    self.key_cache[layer_idx][:, :, start:end] = key_states
+    self.value_cache[layer_idx][:, :, start:end] = value_states
+    self.lengths[layer_idx] = end
+    return self[layer_idx]
+
+  def get_seq_length(self, layer_idx: Optional[int] = 0) -> int:
+    return self.lengths[layer_idx]
+
+  def get_max_length(self) -> Optional[int]:
+    return self.max_length
+
+  def attention_bias(self, layer_idx, dtype):
+    """`[1, 1, 1, max_length]` bias that hides the positions that have not been written yet"""
+    bias = torch.zeros(self.max_length, dtype=dtype, device=self._positions.device)
+    bias.masked_fill_(self._positions >= self.lengths[layer_idx], -1e10)
+    return bias.reshape(1, 1, 1, -1)
+
+  def reorder_cache(self, beam_idx: torch.LongTensor):
+    """Reorders the cache for beam search, given the selected beam indices."""
+    for cache in self.key_cache + self.value_cache:
+      cache.copy_(cache.index_select(0, beam_idx.to(cache.device)))
+
+
+ATTENTION_BACKENDS = ("eager", "sdpa")
+
+
+def sdpa_attention(query: torch.Tensor,
+                   key: torch.Tensor,
+                   value: torch.Tensor,
+                   bias: Optional[torch.Tensor] = None,
+                   dropout_rate: float = 0.,
+                   float32_logits: bool = False,
+                   depth_normalize=True,
+                   logit_scale=None,
+                   logit_scale_max=math.log(1. / 0.01),
+                   ):
+  """`dot_product_attention` using `F.scaled_dot_product_attention`
+
+  Takes and returns the same shapes as `dot_product_attention`, but the fused kernels do not
+  materialize the `[batch, num_heads, q_length, kv_length]` attention weights. `bias` is
+  passed as an additive float mask, so the 0/-1e10 masks built by `MultiHeadDotProductAttention`
+  behave as before, including for fully-masked padding rows. Attention logit clipping is not
+  supported.
+
+  With `float32_logits` the values are also cast to float32, since SDPA needs one dtype for
+  q, k and v, so outputs can differ from `dot_product_attention` by rounding.
+  """
+  dtype = query.dtype
+  if float32_logits:
+    query, key, value = query.to(torch.float32), key.to(torch.float32), value.to(torch.float32)
+
+  # SDPA uses [batch, num_heads, length, depth]
+  query, key, value = query.transpose(1, 2), key.transpose(1, 2), value.transpose(1, 2)
+
+  if logit_scale is not None:
+    if logit_scale_max is not None:
+      logit_scale = torch.clamp(logit_scale, max=logit_scale_max)
+    query = F.normalize(query, dim=-1) * torch.exp(logit_scale).to(query.dtype)
+    key = F.normalize(key, dim=-1)
+    scale = 1.0
+  else:
+    scale = 1.0 / np.sqrt(query.shape[-1]) if depth_normalize else 1.0
+
+  if bias is not None:
+    bias = bias.to(query.dtype)
+    if query.dtype == torch.float16:
+      # -1e10 is -inf in float16, which would turn fully-masked rows into NaNs
+      bias = torch.clamp(bias, min=torch.finfo(torch.float16).min / 2)
+
+  out = F.scaled_dot_product_attention(
+    query, key, value, attn_mask=bias, dropout_p=dropout_rate, scale=scale)
+  return out.transpose(1, 2).to(dtype)
+
+
 class MultiHeadDotProductAttention(nn.Module):
   """Multi-head dot-product attention.
 
@@ -512,6 +628,8 @@ class MultiHeadDotProductAttention(nn.Module):
       dropout_rate: dropout rate
       float32_logits: bool, if True then compute logits in float32 to avoid
         numerical issues with bfloat16.
+      attention_backend: "eager" to use `dot_product_attention` or "sdpa" to use
+        `sdpa_attention`, layers that clip attention logits always use "eager".
   """
 
   def __init__(
@@ -528,9 +646,13 @@ class MultiHeadDotProductAttention(nn.Module):
       depth_normalize: bool = True,
       clip_attn_logit: Any = None,
       scaled_cosine: bool = False,
-      layer_idx: int=None
+      layer_idx: int=None,
+      attention_backend: str = "eager",
   ):
     super().__init__()
+    if attention_backend not in ATTENTION_BACKENDS:
+      raise ValueError(f"Unknown attention backend: {attention_backend}")
+    self.attention_backend = attention_backend
     self.num_heads = num_heads
     self.head_dim = head_dim
     assert emb_dim == num_heads * head_dim, "embed_dim must be divisible by num_heads"
@@ -579,6 +701,24 @@ class MultiHeadDotProductAttention(nn.Module):
     if use_bias:
       nn.init.zeros_(self.out.bias)
 
+  def project_kv(self, inputs_kv: torch.Tensor, k_sinusoids: Optional[torch.Tensor] = None):
+    """Project `inputs_kv` to multi-headed keys and values
+
+    The result can be passed to `forward` as `kv` to reuse it for several queries that attend
+    to the same inputs, e.g. when scoring many answer options against one encoder output.
+
+    Returns:
+      key and value of shape `[batch, kv_length, num_heads, head_dim]`.
+    """
+    bs, kv_len = inputs_kv.shape[:2]
+    key = self.key(inputs_kv).reshape(bs, kv_len, self.num_heads, self.head_dim)
+    value = self.value(inputs_kv).reshape(bs, kv_len, self.num_heads, self.head_dim)
+    if self.qk_norm:
+      key = self.key_norm(key)
+    if k_sinusoids is not None:
+      key = apply_rotary(key, k_sinusoids)
+    return key, value
+
   def forward(
       self,
       inputs_q: torch.Tensor,
@@ -590,7 +730,8 @@ class MultiHeadDotProductAttention(nn.Module):
       k_sinusoids: Optional[torch.Tensor] = None,
       attn_pattern_mask: Optional[torch.Tensor] = None,
       *,
-      past_key_values: Optional[DynamicCache]=None,
+      kv: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+      past_key_values: Optional[Cache]=None,
       decode: bool = False) -> torch.Tensor:
     """Applies multi-head dot product attention on the input data.
 
@@ -606,27 +747,29 @@ class MultiHeadDotProductAttention(nn.Module):
         `[batch, q_length, n * 2 (cos then sin) * rotary_hsize <= size_per_head]` where n: 1(d) or 2(d).
       k_sinusoids: sinusoidal values for the block diagonal matrix of key RoPE.
         `[batch, kv_length, 2 (cos then sin) * rotary_hsize <= size_per_head]` where n: 1(d) or 2(d).
+      kv: key/values from `project_kv`, used instead of projecting `inputs_kv`.
+        A batch size of 1 is broadcast to the batch size of `inputs_q`.
       decode: Whether to prepare and use an autoregressive cache.
 
     Returns:
       output of shape `[batch, length, q_features]`.
     """
     bs, q_len, emb_dim = inputs_q.shape
-    kv_len = inputs_kv.shape[1]
     # Project inputs_q/inputs_kv to multi-headed q/k/v
     # dimensions are then [batch, length, num_heads, head_dim]
     query = self.query(inputs_q).reshape(bs, q_len, self.num_heads, self.head_dim)
-    key = self.key(inputs_kv).reshape(bs, kv_len, self.num_heads, self.head_dim)
-    value = self.value(inputs_kv).reshape(bs, kv_len, self.num_heads, self.head_dim)
-
     if self.qk_norm:
       query = self.query_norm(query)
-      key = self.key_norm(key)
-    
     if q_sinusoids is not None:
       query = apply_rotary(query, q_sinusoids)
-    if k_sinusoids is not None:
-      key = apply_rotary(key, k_sinusoids)
+
+    if kv is None:
+      key, value = self.project_kv(inputs_kv, k_sinusoids)
+    else:
+      key, value = kv
+      if key.shape[0] != bs:
+        key = key.expand(bs, -1, -1, -1)
+        value = value.expand(bs, -1, -1, -1)
     
     # Convert the 0/1 attention mask to an attention bias.
     if mask is not None:
@@ -659,18 +802,31 @@ class MultiHeadDotProductAttention(nn.Module):
       key = torch.transpose(key, 1, 2)
       value = torch.transpose(value, 1, 2)
       assert attention_bias is None
+      if isinstance(past_key_values, StaticKVCache) and past_key_values.fixed_shape:
+        attention_bias = past_key_values.attention_bias(self.layer_idx, query.dtype)
 
     # Apply attention.
-    x = dot_product_attention(
-        query,
-        key,
-        value,
-        bias=attention_bias,
-        dropout_fn=self.attn_drop,
-        depth_normalize=self.depth_normalize,
-        clip_attn_logit=self.clip_attn_logit,
-        float32_logits=self.float32_logits, 
-        logit_scale=logit_scale)
+    if self.attention_backend == "sdpa" and not self.clip_attn_logit:
+      x = sdpa_attention(
+          query,
+          key,
+          value,
+          bias=attention_bias,
+          dropout_rate=self.dropout_rate if self.training else 0.,
+          depth_normalize=self.depth_normalize,
+          float32_logits=self.float32_logits,
+          logit_scale=logit_scale)
+    else:
+      x = dot_product_attention(
+          query,
+          key,
+          value,
+          bias=attention_bias,
+          dropout_fn=self.attn_drop,
+          depth_normalize=self.depth_normalize,
+          clip_attn_logit=self.clip_attn_logit,
+          float32_logits=self.float32_logits, 
+          logit_scale=logit_scale)
 
     if self.use_head_scale:
       head_scale = self.head_scale.reshape(1, 1, self.num_heads, 1)
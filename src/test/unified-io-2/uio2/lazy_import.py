@@ -0,0 +1,26 @@
+"""Deferred imports for heavy optional dependencies
+
+TensorFlow is only needed by the "tf" pre-processing backend and a few training/post-processing
+helpers, importing it through `LazyModule` keeps it out of processes that never use those paths.
+"""
+import importlib
+import sys
+
+
+class LazyModule:
+  """Stand-in for a module that imports it on first attribute access"""
+
+  def __init__(self, name):
+    self._name = name
+    self._module = None
+
+  def __getattr__(self, item):
+    if self._module is None:
+      self._module = importlib.import_module(self._name)
+    return getattr(self._module, item)
+
+  def is_loaded(self):
+    return self._module is not None or self._name in sys.modules
+
+
+tf = LazyModule("tensorflow")
@@ -1,5 +1,7 @@
 import copy
+import dataclasses
 import json
+import logging
 import math
 from os.path import join
 from typing import Any, Optional, Tuple, List, Dict, Union
@@ -129,9 +131,11 @@ class DecoderLayer(nn.Module):
               decoder_sinusoids=None,
               encoder_sinusoids=None,
               attn_pattern_mask=None,
-              past_key_values: Optional[DynamicCache]=None
+              past_key_values: Optional[DynamicCache]=None,
+              cross_kv=None,
               ):
     # inputs: embedded inputs to the decoder with shape [batch, length, emb_dim]
+    # cross_kv: optional (key, value) of `encoded` from `encoder_decoder_attention.project_kv`
     x = self.pre_self_attention_norm(inputs)
 
     # Self-attention block
@@ -160,7 +164,8 @@ class DecoderLayer(nn.Module):
         encoder_decoder_mask,
         cross_abs_pos_bias,
         q_sinusoids=decoder_sinusoids,
-        k_sinusoids=encoder_sinusoids)
+        k_sinusoids=encoder_sinusoids,
+        kv=cross_kv)
 
       y = self.drop(y)
 
@@ -214,6 +219,7 @@ class Decoder(nn.Module, GenerationMixin):
     output_attentions=False,
     output_hidden_states=False,
     logit_weights=None,
+    cross_kv=None,
   ):
     if output_attentions or output_hidden_states:
       raise NotImplementedError()
@@ -226,11 +232,7 @@ class Decoder(nn.Module, GenerationMixin):
     y = self.drop(y)
 
     cross_abs_pos_bias = None
-    use_rope = (
-        encoder_pos_emb is not None and decoder_pos_emb is not None and
-        decoder_embedding.shape[-1] != decoder_pos_emb.shape[-1] and
-        decoder_pos_emb.shape[-1] == encoder_pos_emb.shape[-1]
-    )
+    use_rope = self.use_rope(decoder_embedding, decoder_pos_emb, encoder_pos_emb)
     encoder_sinusoids = encoder_pos_emb if use_rope else None
     decoder_sinusoids = decoder_pos_emb if use_rope else None
 
@@ -260,7 +262,8 @@ class Decoder(nn.Module, GenerationMixin):
         decoder_sinusoids=decoder_sinusoids,
         encoder_sinusoids=encoder_sinusoids,
         attn_pattern_mask=attn_pattern_lyr,
-        past_key_values=past_key_values
+        past_key_values=past_key_values,
+        cross_kv=None if cross_kv is None else cross_kv.get(lyr_ix),
       )
 
     y = self.decoder_norm(y)
@@ -276,6 +279,37 @@ class Decoder(nn.Module, GenerationMixin):
     else:
       return y
 
+  @staticmethod
+  def use_rope(decoder_embedding, decoder_pos_emb, encoder_pos_emb):
+    """Whether the position embeddings are RoPE sinusoids instead of embeddings to add"""
+    return (
+        encoder_pos_emb is not None and decoder_pos_emb is not None and
+        decoder_embedding.shape[-1] != decoder_pos_emb.shape[-1] and
+        decoder_pos_emb.shape[-1] == encoder_pos_emb.shape[-1]
+    )
+
+  def project_cross_kv(self, encoded, encoder_sinusoids=None):
+    """Cross-attention keys/values of `encoded` for each layer that attends to the encoder
+
+    Returns a {layer_index: (key, value)} dictionary that can be passed to `forward` as
+    `cross_kv`, so decoder calls with the same encoder output skip re-projecting it.
+    """
+    cross_kv = {}
+    for lyr_ix in range(self.config.num_decoder_layers):
+      lyr: DecoderLayer = self.get_submodule(f'layers_{lyr_ix}')
+      if not lyr.enable_xattention:
+        continue
+      attention = lyr.encoder_decoder_attention
+      key, value = attention.project_kv(encoded, encoder_sinusoids)
+      if attention.float32_logits:
+        # The attention functions would cast the keys for every call otherwise,
+        # `sdpa_attention` also casts the values
+        key = key.to(torch.float32)
+        if attention.attention_backend == "sdpa":
+          value = value.to(torch.float32)
+      cross_kv[lyr_ix] = (key, value)
+    return cross_kv
+
   def _expand_inputs_for_generation(
       self,
       expand_size: int = 1,
@@ -292,7 +326,7 @@ class Decoder(nn.Module, GenerationMixin):
   def prepare_inputs_for_generation(
       self, input_ids, encoder_pos_emb, encoded, encoder_mask, modality, use_cache,
       embed_token_id, logit_weights, past_key_values=None, attention_mask=None,
-      _clf_free_guidance=False
+      _clf_free_guidance=False, static_cache_length=None, static_cache_fixed_shape=False,
   ):
     if _clf_free_guidance:
       # Ignore the sampled ids for the guidance batches and just use ones for the main batch
@@ -321,7 +355,11 @@ class Decoder(nn.Module, GenerationMixin):
       decoder_attn_mask = layers.make_decoder_mask(seq.mask)
 
     if use_cache:
-      if past_key_values is None:
+      if past_key_values is None and static_cache_length is not None:
+        past_key_values = layers.StaticKVCache(
+          cfg.num_decoder_layers, input_ids.shape[0], cfg.num_heads, cfg.head_dim,
+          static_cache_length, encoded.dtype, device, static_cache_fixed_shape)
+      elif past_key_values is None:
         past_key_values = DynamicCache()
     else:
       past_key_values = None
@@ -338,6 +376,10 @@ class Decoder(nn.Module, GenerationMixin):
       logit_weights=logit_weights,
     )
 
+  def _reorder_cache(self, past_key_values, beam_idx):
+    past_key_values.reorder_cache(beam_idx)
+    return past_key_values
+
   def can_generate(self):
     return True
 
@@ -346,10 +388,78 @@ class Decoder(nn.Module, GenerationMixin):
     return self.decoder_norm.scale.device
 
 
+# When "image"/"audio" is pruned the history encoder registers the shared ViT itself, under
+# its own name, while full checkpoints store it once under the image/audio input encoder
+_SHARED_VIT_ALIASES = [
+  ("input_embedders.image_history.vit_image_encoder.", "input_embedders.image.image_encoder."),
+  ("input_embedders.audio_history.vit_image_encoder.", "input_embedders.audio.image_encoder."),
+]
+
+
+def restrict_modalities(config: Config, input_modalities=None, target_modalities=None) -> Config:
+  """Copy of `config` that only builds the given input/target modalities, keeping their order"""
+  changes = {}
+  for name, requested, available in [
+    ("input_modalities", input_modalities, config.input_modalities),
+    ("target_modalities", target_modalities, config.target_modalities),
+  ]:
+    if requested is None:
+      continue
+    unknown = set(requested) - set(available)
+    if unknown:
+      raise ValueError(f"Requested {name} that do not exist: {sorted(unknown)}")
+    changes[name] = tuple(x for x in available if x in requested)
+  return dataclasses.replace(config, **changes)
+
+
+def load_safetensors_subset(model: nn.Module, model_file, strict=False):
+  """Load the weights `model` has from a safetensors checkpoint
+
+  The file is memory-mapped and only the tensors the model needs are read, so weights of
+  modules that were not built (see `restrict_modalities`) never become resident.
+
+  Returns: number of checkpoint tensors that were skipped
+  """
+  from safetensors import safe_open
+
+  missing = []
+  with safe_open(model_file, framework="pt", device="cpu") as f, torch.no_grad():
+    stored = set(f.keys())
+    used = set()
+    for name, tensor in model.state_dict().items():
+      key = name
+      if key not in stored:
+        for prefix, stored_prefix in _SHARED_VIT_ALIASES:
+          if name.startswith(prefix):
+            key = stored_prefix + name[len(prefix):]
+      if key not in stored:
+        missing.append(name)
+        continue
+      tensor.copy_(f.get_tensor(key))
+      used.add(key)
+  if missing:
+    if strict:
+      raise RuntimeError(f"Missing keys in {model_file}: {missing}")
+    logging.warning(f"{len(missing)} parameters not found in {model_file}, e.g. {missing[:3]}")
+  return len(stored) - len(used)
+
+
 class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
-  """UnifiedIO Model"""
+  """UnifiedIO Model
+
+  Args:
+    config: `Config`, its dictionary, or a `T5Config` if `input_encoders`/`target_encoders` are given
+    input_modalities: only build these input modalities of a `Config`, defaults to all of them
+    target_modalities: only build these target modalities of a `Config`, e.g. ["text"] to
+                       skip the image and audio VQGANs when only text is generated
+    attention_backend: "eager" or "sdpa", see `set_attention_backend`
+
+  `from_pretrained` passes `input_modalities`/`target_modalities` through and, for
+  safetensors checkpoints, only reads the weights of the modules that were built.
+  """
 
-  def __init__(self, config, input_encoders=None, target_encoders=None):
+  def __init__(self, config, input_encoders=None, target_encoders=None,
+               input_modalities=None, target_modalities=None, attention_backend="eager"):
     super().__init__()
     if isinstance(config, dict):  # Support create from dictionary for `PyTorchModelHubMixin`
       config = Config.from_dict(config)
@@ -358,6 +468,7 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
       # Initialize from full Config
       assert input_encoders is None
       assert target_encoders is None
+      config = restrict_modalities(config, input_modalities, target_modalities)
       input_encoders = get_input_modalities(
         config.input_modalities, config.image_vit_cfg, config.audio_vit_cfg,
         config.image_history_cfg, config.audio_history_cfg, config.use_image_vit, config.use_audio_vit,
@@ -402,6 +513,21 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
 
     self.encoder = Encoder(cfg)
     self.decoder = Decoder(cfg)
+    self.set_attention_backend(attention_backend)
+
+  def set_attention_backend(self, backend):
+    """Compute attention with explicit attention weights ("eager") or with
+    `F.scaled_dot_product_attention` ("sdpa") in every `layers.MultiHeadDotProductAttention`
+
+    "sdpa" avoids materializing the attention matrix, which matters for the long encoder
+    sequences of many-frame videos. The ViTs in `image_embedder`/`audio_embedder` use their
+    own attention and are not affected.
+    """
+    if backend not in layers.ATTENTION_BACKENDS:
+      raise ValueError(f"Unknown attention backend: {backend}")
+    for module in self.modules():
+      if isinstance(module, layers.MultiHeadDotProductAttention):
+        module.attention_backend = backend
 
   def set_modalities(
       self,
@@ -437,9 +563,27 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
 
     self._apply(_convert)
 
+  @torch.no_grad()
+  def encode_for_scoring(self, batch):
+    """Encode the inputs of `batch` once so they can be re-used by `score_answer_options`
+
+    Args:
+      batch: batch of inputs with batch size 1, targets in this batch are ignored
+
+    Returns:
+      Dictionary with the input sequence and encoder output, `score_answer_options` adds
+      the decoder's cross-attention keys/values to it the first time it is used
+    """
+    batch = unflatten_dict(batch)
+    input_seq = self.encode_batch(batch["inputs"])
+    if input_seq.batch_size != 1:
+      raise NotImplementedError("Only batch 1 supported")
+    return dict(input_seq=input_seq, encoded=self.encoder(input_seq), cross_kv=None)
+
   @torch.no_grad()
   def score_answer_options(
-      self, batch, options, option_batch_size=None, average_loss=True):
+      self, batch, options, option_batch_size=None, average_loss=True,
+      encoding=None, reuse_cross_kv=True):
     """Scores multiple answers options for one set of inputs
 
     Args:
@@ -447,6 +591,10 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
       options: Tensor of tokenized text answer options, includes EOS but not BOS and padded with 0
       option_batch_size: Compute answers for batches of options at a time to reduce memory
       average_loss: Do average loss per token instead of total loss
+      encoding: output of `encode_for_scoring` to use instead of encoding `batch`, for
+                scoring several sets of options against the same inputs
+      reuse_cross_kv: Project the encoder output to cross-attention keys/values once and
+                      share them between all option batches, instead of per batch
 
     Returns:
       The scores of each answer option
@@ -466,16 +614,24 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
     target_seq: seq_features.TargetSequence = self.target_embedders["text"](
       input_tokens, mask=options > 0, shared_embed=self.text_token_embedder)
 
-    batch = unflatten_dict(batch)
-    input_seq = self.encode_batch(batch["inputs"])
-    if input_seq.batch_size != 1:
-      raise NotImplementedError("Only batch 1 supported")
-    encoder_hidden = self.encoder(input_seq)
+    if encoding is None:
+      encoding = self.encode_for_scoring(batch)
+    input_seq = encoding["input_seq"]
+    encoder_hidden = encoding["encoded"]
     encoder_decoder_mask = layers.make_attention_mask(
       target_seq.mask, input_seq.mask).to(encoder_hidden.dtype)
     options = options.to(torch.long)  # for cross entropy
     decoder_attn_mask = layers.make_decoder_mask(target_seq.mask)
 
+    cross_kv = None
+    if reuse_cross_kv:
+      if encoding["cross_kv"] is None:
+        use_rope = self.decoder.use_rope(
+          target_seq.input_embedding, target_seq.position_embed, input_seq.position_embed)
+        encoding["cross_kv"] = self.decoder.project_cross_kv(
+          encoder_hidden, input_seq.position_embed if use_rope else None)
+      cross_kv = encoding["cross_kv"]
+
     all_loses = []
     for batch_i in range(n_batches):
       sl = slice(batch_i * option_batch_size, (batch_i + 1) * option_batch_size)
@@ -489,7 +645,8 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
         encoder_pos_emb=input_seq.position_embed.expand(bs, -1, -1),
         encoder_decoder_mask=encoder_decoder_mask[sl],
         decoder_bias=None,
-        attn_pattern_mask=target_seq.attn_pattern_mask[sl]
+        attn_pattern_mask=target_seq.attn_pattern_mask[sl],
+        cross_kv=cross_kv,
       )
       embed = self.shared_embedding["text"]
       logits = F.linear(out_hidden, embed.weight)
@@ -512,6 +669,7 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
       modality="text",
       negative_prompt=None,
       guidance_scale=10,
+      kv_cache="dynamic",
       **kwargs,
   ):
     """Generate outputs
@@ -522,6 +680,9 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
       modality: text, image, or audio, modality to encode
       negative_prompt: batch to use for classifier free guidance
       guidance_scale: scale of classifier free guidance
+      kv_cache: self-attention cache used with `use_cache=True`, "dynamic" for `DynamicCache`,
+                "static" for a `layers.StaticKVCache` preallocated for the maximum generation
+                length, or "static_fixed" to also keep the shapes of every decoding step fixed
       **kwargs: Most other parameters for `GenerationMixin.generate` should work, but fair warning
                 we haven't tested everything and some will not be supported
 
@@ -596,6 +757,16 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
     bs = mask.shape[0]
     input_ids = torch.zeros((bs, 1), dtype=torch.long, device=input_seq.embed.device)
 
+    if kv_cache in ("static", "static_fixed"):
+      max_new_tokens = kwargs.get("max_new_tokens") or generation_config.max_new_tokens
+      if max_new_tokens is None:
+        raise ValueError("A static cache needs `max_new_tokens`")
+      # Plus one for the BOS token
+      kwargs["static_cache_length"] = max_new_tokens + 1
+      kwargs["static_cache_fixed_shape"] = kv_cache == "static_fixed"
+    elif kv_cache != "dynamic":
+      raise ValueError(f"Unknown kv_cache: {kv_cache}")
+
     def embed_token_id(input_id, mask, cur_index=None):
       # Turn a generated input id into an embedding
       return self.target_embedders[modality](
@@ -737,6 +908,15 @@ class UnifiedIOModel(nn.Module, GenerationMixin, PyTorchModelHubMixin):
 
     return logits
 
+  @classmethod
+  def _load_as_safetensor(cls, model, model_file, map_location, strict):
+    skipped = load_safetensors_subset(model, model_file, strict)
+    if skipped:
+      logging.info(f"Skipped {skipped} checkpoint tensors of modalities that were not built")
+    if map_location != "cpu":
+      model.to(map_location)
+    return model
+
   def _save_pretrained(self, save_directory) -> None:
     if self.full_config is None:
       raise ValueError("Must be built from Config to be saved")
@@ -133,7 +133,7 @@ class PerceiverResampler(nn.Module):
     self.context_norm = layers.UIOLayerNorm(config.emb_dim)
     self.perceiver_norm = layers.UIOLayerNorm(config.emb_dim)
 
-    dpr = [x.item() for x in torch.linspace(0, config.droppath_rate, config.num_layers)]
+    dpr = [x.item() for x in torch.linspace(0, config.droppath_rate, config.num_layers, device="cpu")]
     for lyr in range(config.num_layers):
       if lyr in config.xattention_index:
         self.add_module(f'layers_{lyr}', CrossAttention(config, droppath_rate=dpr[lyr]))
@@ -4,17 +4,17 @@ import json
 from typing import Dict, List
 
 import numpy as np
-import tensorflow as tf
 import torch
 from huggingface_hub import PyTorchModelHubMixin
 from transformers import ProcessorMixin, FeatureExtractionMixin
 from transformers.utils import PushToHubMixin
 
-from uio2 import config
+from uio2 import config, data_utils_np
 from uio2.audio_utils import load_audio
 from uio2.config import get_tokenizer, Config
 from uio2.data_utils import resize_and_pad_default, values_to_tokens
 from uio2.get_modality_processor import get_input_modalities, get_target_modalities
+from uio2.lazy_import import tf
 from uio2.utils import flatten_dict
 from uio2.video_utils import load_video, remove_bars_from_frames
 
@@ -28,7 +28,7 @@ class UnifiedIOPreprocessor(FeatureExtractionMixin):
   }
 
   @staticmethod
-  def from_config(cfg: Config, tokenizer):
+  def from_config(cfg: Config, tokenizer, backend="tf"):
     input_encoders = get_input_modalities(
       cfg.input_modalities, cfg.image_vit_cfg, cfg.audio_vit_cfg,
       cfg.image_history_cfg, cfg.audio_history_cfg, cfg.use_image_vit, cfg.use_audio_vit,
@@ -37,16 +37,16 @@ class UnifiedIOPreprocessor(FeatureExtractionMixin):
     target_encoders = get_target_modalities(
       cfg.target_modalities, cfg.image_vqgan, cfg.audio_vqgan)
     return UnifiedIOPreprocessor(
-      input_encoders, target_encoders, cfg.sequence_length, tokenizer, cfg)
+      input_encoders, target_encoders, cfg.sequence_length, tokenizer, cfg, backend=backend)
 
   @staticmethod
-  def from_dict(data, tokenizer=None, sequence_length=None):
+  def from_dict(data, tokenizer=None, sequence_length=None, backend="tf"):
     if tokenizer is None:
       raise ValueError("Tokenizer path must be given: `tokenizer=path/to/tokenizer`")
     cfg = Config.from_dict(data["config"])
     if sequence_length is not None:
       cfg.sequence_length = sequence_length
-    return UnifiedIOPreprocessor.from_config(cfg, tokenizer)
+    return UnifiedIOPreprocessor.from_config(cfg, tokenizer, backend=backend)
 
   def __init__(
       self,
@@ -54,9 +54,19 @@ class UnifiedIOPreprocessor(FeatureExtractionMixin):
       target_encoders,
       sequence_length,
       tokenizer,
-      config: config.Config=None
+      config: config.Config=None,
+      backend="tf",
   ):
+    """
+    Args:
+      backend: "tf" to pre-process with TensorFlow ops, or "numpy" to use NumPy/torch ops that
+               produce the same features without importing TF. "numpy" only supports inference,
+               so no `is_training` augmentation, box inputs, or image/audio targets
+    """
     super().__init__()
+    if backend not in ("tf", "numpy"):
+      raise ValueError(f"Unknown pre-processing backend: {backend}")
+    self.backend = backend
     self.input_encoders = input_encoders
     self.target_encoders = target_encoders
     self.sequence_length = sequence_length
@@ -126,6 +136,12 @@ class UnifiedIOPreprocessor(FeatureExtractionMixin):
 
     Returns batch of tensors that can be passed into the UIO2 model
     """
+    if self.backend == "numpy":
+      return self._preprocess_np(
+        text_inputs, target_modality, box_inputs, image_inputs, audio_inputs, video_inputs,
+        use_video_audio, encode_frame_as_image, encode_audio_segment_as_audio, image_history,
+        image_targets, audio_targets, text_targets, is_training)
+
     targets = [image_targets, audio_targets, text_targets]
     assert sum(x is not None for x in targets) <= 1, "Can have at most one target"
     if target_modality is None:
@@ -306,16 +322,112 @@ class UnifiedIOPreprocessor(FeatureExtractionMixin):
     features = self.unified_io_preprocessor(features)
     return {k: v.numpy() for k, v in features.items()}
 
+  def _preprocess_np(
+      self, text_inputs, target_modality, box_inputs, image_inputs, audio_inputs, video_inputs,
+      use_video_audio, encode_frame_as_image, encode_audio_segment_as_audio, image_history,
+      image_targets, audio_targets, text_targets, is_training):
+    """`__call__` for the "numpy" backend, same steps as the TF version for inference inputs"""
+    if is_training:
+      raise NotImplementedError("Training augmentation requires the TF pre-processing backend")
+    if box_inputs is not None or image_targets is not None or audio_targets is not None:
+      raise NotImplementedError("Box inputs and image/audio targets require the TF pre-processing backend")
+    if target_modality is None:
+      if text_targets is None:
+        raise ValueError("No targets and not `target_modality` given")
+      target_modality = "text"
+
+    features = {}
+    text_inputs = self.PREFIXES[target_modality] + text_inputs
+
+    if isinstance(image_inputs, str):
+      image_inputs = self.load_image(image_inputs)
+
+    if image_history is not None:
+      assert video_inputs is None
+      image_history = [self.load_image(x) if isinstance(x, str) else x for x in image_history]
+      parts = [data_utils_np.resize_and_pad_default(x, is_input=True, is_history=True)
+               for x in image_history]
+      features["image_history_inputs"] = np.stack([x[0] for x in parts])
+      features["image_history_input_masks"] = np.stack([x[1] for x in parts])
+
+    video_audio = None
+    if video_inputs is not None:
+      if encode_frame_as_image is not None and image_inputs is not None:
+        raise ValueError("Asked to encode a frame as an image, but also given an image input")
+      max_frame = self.sequence_length["num_frames"]
+      if encode_frame_as_image is not None:
+        max_frame += 1
+      if isinstance(video_inputs, str):
+        video_inputs, video_audio = load_video(video_inputs, max_frame, use_audio=use_video_audio)
+      else:
+        assert video_inputs.shape[0] <= max_frame
+      assert len(video_inputs.shape) == 4 and video_inputs.shape[-1] == 3
+
+      video_inputs = remove_bars_from_frames(video_inputs, black_bar=True, threshold=16)
+      if encode_frame_as_image is not None:
+        image_inputs = video_inputs[encode_frame_as_image]
+        video_inputs = np.delete(video_inputs, encode_frame_as_image, axis=0)
+      video_inputs, video_mask, _ = data_utils_np.resize_and_pad_default(
+        video_inputs, is_input=True, is_history=True)
+      features["image_history_inputs"] = video_inputs
+      features["image_history_input_masks"] = video_mask
+
+    if video_audio is not None or audio_inputs is not None:
+      if video_audio is not None and audio_inputs is not None:
+        raise ValueError("Have audio from both the video and as `audio_inputs`")
+      if isinstance(audio_inputs, str):
+        spectograms = load_audio(audio_inputs)
+      elif isinstance(audio_inputs, np.ndarray):
+        spectograms = audio_inputs
+        if len(spectograms.shape) == 2:
+          spectograms = np.expand_dims(spectograms, 0)
+      else:
+        spectograms = video_audio
+
+      spectograms = np.transpose(spectograms, [0, 2, 1])
+      mask = (spectograms != 0).astype(np.int32)
+      audio = np.log(np.clip(spectograms, 1e-5, 1e5)) * mask.astype(spectograms.dtype)
+      audio = np.expand_dims(audio, -1)
+
+      if encode_audio_segment_as_audio is not None:
+        features["audio_inputs"] = audio[encode_audio_segment_as_audio]
+        features["audio_input_masks"] = mask[encode_audio_segment_as_audio]
+        audio = np.delete(audio, encode_audio_segment_as_audio, axis=0)
+        mask = np.delete(mask, encode_audio_segment_as_audio, axis=0)
+      if len(audio) > 0:
+        features["audio_history_inputs"] = audio
+        features["audio_history_input_masks"] = mask
+
+    if image_inputs is not None:
+      image_inputs, image_inputs_mask, image_info = data_utils_np.resize_and_pad_default(
+        image_inputs, is_input=True)
+      features["image_inputs"] = image_inputs
+      features["image_input_masks"] = image_inputs_mask
+      features["meta/image_info"] = image_info
+
+    if text_targets:
+      features["text_targets"] = text_targets
+
+    features["text_inputs"] = text_inputs
+    return self.unified_io_preprocessor(features)
+
   def unified_io_preprocessor(self, features):
+    if self.backend == "numpy":
+      preprocess = lambda encoder: encoder.preprocess_inputs_np(
+        features, self.tokenizer, self.sequence_length)
+    else:
+      preprocess = lambda encoder: encoder.preprocess_inputs(
+        features, self.tokenizer, self.sequence_length)
+
     input_features = {}
     for k, v in self.input_encoders.items():
-      fe = v.preprocess_inputs(features, self.tokenizer, self.sequence_length)
+      fe = preprocess(v)
       if fe:
         input_features[k] = fe
 
     target_features = {}
     for k, v in self.target_encoders.items():
-      fe = v.preprocess_inputs(features, self.tokenizer, self.sequence_length)
+      fe = preprocess(v)
       if fe:
         target_features[k] = fe
 
@@ -1,11 +1,11 @@
 """Runner to use the model for specific tasks"""
+import itertools
 import json
 import logging
 import re
 from os.path import join, dirname
 
 import numpy as np
-import tensorflow as tf
 from typing import List
 
 import torch
@@ -14,8 +14,10 @@ from transformers import LogitsProcessor
 
 from uio2 import config
 from uio2.hifigan.models import Generator as HifiganGenerator
-from uio2.preprocessing import UnifiedIOPreprocessor
+from uio2.lazy_import import tf
+from uio2.preprocessing import UnifiedIOPreprocessor, build_batch
 from uio2.prompt import Prompt
+from uio2.video_utils import load_video
 from uio2.utils import flatten_dict, pad_and_stack, token_to_float, undo_box_preprocessing, \
   extra_id_to_float, extract_locations_from_token_ids, undo_image_preprocessing
 
@@ -228,7 +230,8 @@ class TaskRunner:
   """Wraps a UIO2 model and UIO2 preprocessor and does a set of tasks.
 
   This is intended mostly to demonstrate how to use the model for these different tasks.
-  To run these tasks efficiently batch the inputs and run the pre-processing inside a DataLoader.
+  To run these tasks efficiently batch the inputs and run the pre-processing inside a DataLoader,
+  `uio2.avqa_pipeline` does this for audio-visual QA using `predict_text_batch`.
   """
 
   def __init__(self, model, uio2_preprocessor: UnifiedIOPreprocessor, prompts=None,
@@ -238,7 +241,15 @@ class TaskRunner:
     if prompts is None:
       prompts = Prompt()
     self.prompt = prompts
-    self.spectogram_converter = SpectogramConverter(use_hifigan_for_audio)
+    self.use_hifigan_for_audio = use_hifigan_for_audio
+    self._spectogram_converter = None
+
+  @property
+  def spectogram_converter(self):
+    # Only built for audio generation, so text-only runners never touch HiFi-GAN
+    if self._spectogram_converter is None:
+      self._spectogram_converter = SpectogramConverter(self.use_hifigan_for_audio)
+    return self._spectogram_converter
 
   @property
   def tokenizer(self):
@@ -268,6 +279,31 @@ class TaskRunner:
             processed_batch[k] = torch.as_tensor(v, device=self.device)[None, ...]
     return processed_batch
 
+  def padded_batch(self, examples):
+    """Pad and stack pre-processed examples with `build_batch`, same dtypes as `singleton_batch`"""
+    batch = {}
+    for k, v in build_batch(examples).items():
+      if v.dtype == np.int32 or v.dtype == np.int64:
+        batch[k] = torch.as_tensor(v, device=self.device, dtype=torch.long)
+      elif v.dtype == np.float32 or v.dtype == np.float64:
+        batch[k] = torch.as_tensor(v, device=self.device, dtype=torch.float32)
+      else:
+        batch[k] = torch.as_tensor(v, device=self.device)
+    return batch
+
+  def predict_text_batch(self, examples, max_tokens, detokenize=True, **gen_args):
+    """Generate text for a list of pre-processed examples in one padded batch"""
+    tokens = self.model.generate(
+      batch=self.padded_batch(examples), modality="text",
+      use_cache=True, max_new_tokens=max_tokens,
+      **gen_args
+    )
+    tokens = tokens.cpu()
+    if detokenize:
+      return [self.tokenizer.decode(row) for row in tokens]
+    else:
+      return list(tokens)
+
   def predict_text(self, example, max_tokens, detokenize=True, **gen_args):
     tokens = self.model.generate(
       batch=self.singleton_batch(example), modality="text",
@@ -501,11 +537,82 @@ class TaskRunner:
     text = self.predict_text(batch, max_tokens=64)
     return text
 
-  def avqa(self, video, prompt):
-    example = self.uio2_preprocessor(text_inputs=prompt, video_inputs=video, use_video_audio=True, target_modality="text")
-    out = self.predict_text(example, max_tokens=2048)
+  def load_av(self, video, frame_filter=None):
+    """Decode the frames and audio spectrograms of a video file once
+
+    `frame_filter` is passed to `load_video`, see `video_utils.extract_frames_from_video`
+
+    Returns: (frames, spectrograms) that can be passed to `avqa` for any number of prompts
+    """
+    max_frames = self.uio2_preprocessor.sequence_length["num_frames"]
+    return load_video(video, max_frames, use_audio=True, frame_filter=frame_filter)
+
+  def avqa(self, video, prompt, audio=None, **gen_args):
+    """Answer a prompt about a video
+
+    Args:
+      video: video file, or frames from `load_av`
+      audio: spectrograms from `load_av` when `video` is given as frames
+      **gen_args: passed to `UnifiedIOModel.generate`, e.g. `kv_cache="static"`
+    """
+    example = self.uio2_preprocessor(text_inputs=prompt, video_inputs=video, audio_inputs=audio,
+                                     use_video_audio=True, target_modality="text")
+    out = self.predict_text(example, max_tokens=2048, **gen_args)
     return out
 
+  MCQ_PROMPT = "{question}\nOptions:\n{options}\nAnswer with the label(s) of all correct options."
+  YESNO_PROMPT = "{question}\nCandidate answer: {option}\nIs the candidate answer correct? Answer yes or no."
+
+  def _option_scores(self, example, candidates, option_batch_size=None):
+    """Probability of each text candidate from one encoder pass, softmax over -mean token loss"""
+    tensors = pad_and_stack([self.tokenizer.encode(x) for x in candidates], add_eos=True).to(self.device)
+    losses = self.model.score_answer_options(self.singleton_batch(example), tensors, option_batch_size)
+    return torch.softmax(-losses.float(), dim=0).cpu().numpy()
+
+  def avqa_mcq(self, video, question, options, audio=None, multi_mode="subsets", option_batch_size=None):
+    """Answer a multiple-choice question about a video by scoring options instead of generating
+
+    Args:
+      video: video file, or frames from `load_av`
+      question: question text
+      options: option strings such as "A: ..."; the label is the text before the first ":"
+      audio: spectrograms from `load_av` when `video` is given as frames
+      multi_mode: how to allow more than one correct option
+        "subsets": score every non-empty set of labels (e.g. "A, C") with a single encoder pass,
+                   per-label scores are the marginal probability of sets containing the label
+        "yesno": ask a yes/no question per option, per-label scores are P(yes)
+      option_batch_size: passed to `score_answer_options`
+
+    Returns: {"answer": [labels], "scores": {label: probability}}
+    """
+    labels = [opt.split(":", 1)[0].strip() if ":" in opt else chr(ord("A") + i)
+              for i, opt in enumerate(options)]
+
+    if multi_mode == "subsets":
+      prompt = self.MCQ_PROMPT.format(question=question, options="\n".join(options))
+      example = self.uio2_preprocessor(text_inputs=prompt, video_inputs=video, audio_inputs=audio,
+                                       use_video_audio=True, target_modality="text")
+      subsets = [c for n in range(1, len(labels) + 1) for c in itertools.combinations(labels, n)]
+      probs = self._option_scores(example, [", ".join(c) for c in subsets], option_batch_size)
+      scores = {label: float(sum(p for c, p in zip(subsets, probs) if label in c)) for label in labels}
+      answer = list(subsets[int(np.argmax(probs))])
+
+    elif multi_mode == "yesno":
+      scores = {}
+      for label, option in zip(labels, options):
+        prompt = self.YESNO_PROMPT.format(question=question, option=option)
+        example = self.uio2_preprocessor(text_inputs=prompt, video_inputs=video, audio_inputs=audio,
+                                         use_video_audio=True, target_modality="text")
+        scores[label] = float(self._option_scores(example, ["yes", "no"], option_batch_size)[0])
+      answer = [label for label in labels if scores[label] >= 0.5]
+      if not answer:
+        answer = [max(scores, key=scores.get)]
+
+    else:
+      raise ValueError(f"Unknown multi_mode: {multi_mode}")
+
+    return {"answer": answer, "scores": scores}
+
   def audio_captioning(self, audio):
     """Caption an audio clip
 
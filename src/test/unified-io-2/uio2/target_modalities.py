@@ -11,8 +11,8 @@ from uio2.input_modalities import ModalityEncoder
 from uio2.seq_features import TargetSequence
 from uio2.image_vqgan import VQGAN
 from uio2.audio_vqgan import ViTVQGAN
-from uio2 import layers, config
-import tensorflow as tf
+from uio2 import layers, config, data_utils_np
+from uio2.lazy_import import tf
 
 
 TEXT_MODALITY_INDEX = 0
@@ -85,6 +85,29 @@ class TargetTextEncoder(ModalityEncoder):
       "mask": tf.cast(tokens > config.PAD_ID, tf.int32)
     }
 
+  def preprocess_inputs_np(self, features, vocab, sequence_length) -> Dict:
+    text_targets = features.get(f"text_targets")
+    if "segment_ids" in features:
+      raise NotImplementedError()
+    if text_targets is None:
+      return {}
+
+    if isinstance(text_targets, str):
+      tokens = np.asarray(vocab.encode(text_targets), dtype=np.int32)
+    else:
+      tokens = np.asarray(text_targets)
+
+    tokens = tokens[..., :config.MAX_TEXT_LEN-1]
+    tokens = np.pad(tokens, [[0, 1]], constant_values=config.EOS_ID)
+    sh = tokens.shape[0]
+    return {
+      "targets": tokens,
+      "inputs": data_utils_np.make_autoregressive_inputs(tokens, bos_id=config.BOS_ID),
+      "pos_ids": np.arange(sh, dtype=np.int32),
+      "segment_ids": np.ones((sh,), dtype=np.int32),
+      "mask": (tokens > config.PAD_ID).astype(np.int32)
+    }
+
   def get_encoder(self, config: T5Config) -> nn.Module:
     return TextEmbedder(config)
 
@@ -252,8 +275,14 @@ class TargetImageVQGANEmbedder(ModalityEncoder):
     super().__init__()
     self.config = config
 
+  def preprocess_inputs_np(self, features: Dict, tokenizer, sequence_length) -> Dict:
+    for k in ["image_targets", "image_target_masks", "image_target_task_masks"]:
+      if features.pop(k, None) is not None:
+        raise NotImplementedError("Image targets require the TF pre-processing backend")
+    return {}
+
   def preprocess_inputs(
-      self, features: Dict, tokenizer, sequence_length) -> Optional[Dict[str, tf.Tensor]]:
+      self, features: Dict, tokenizer, sequence_length) -> Optional[Dict[str, "tf.Tensor"]]:
     image_target_size = config.IMAGE_TARGET_SIZE
     image_target_d = config.IMAGE_TARGET_D
     target_padding_size = tf.constant(
@@ -430,8 +459,14 @@ class TargetAudioVQGANEmbedder(ModalityEncoder):
   def get_encoder(self, config: T5Config) -> nn.Module:
     return AudioVQGAN(config, self.config)
 
+  def preprocess_inputs_np(self, features: Dict, tokenizer, sequence_length) -> Dict:
+    for k in ["audio_targets", "audio_target_masks", "audio_target_task_masks"]:
+      if features.pop(k, None) is not None:
+        raise NotImplementedError("Audio targets require the TF pre-processing backend")
+    return {}
+
   def preprocess_inputs(
-      self, features: Dict, tokenizer, sequence_length) -> Optional[Dict[str, tf.Tensor]]:
+      self, features: Dict, tokenizer, sequence_length) -> Optional[Dict[str, "tf.Tensor"]]:
     target_size = config.AUDIO_TARGET_SIZE
     target_d = config.AUDIO_TARGET_D
 
@@ -2,11 +2,12 @@
 from typing import Union
 
 import numpy as np
-import tensorflow as tf
 import torch
 import torch.utils._device
 from torch.nn import functional as F
 
+from uio2.lazy_import import tf
+
 
 def flatten_dict(d, sep="/"):
   _out = dict()
@@ -122,8 +123,10 @@ def undo_box_preprocessing(boxes, image_info):
 
 
 def undo_image_preprocessing(image, image_info, gray_scale=False,
-                             resize_method=tf.image.ResizeMethod.NEAREST_NEIGHBOR, to_int=False):
+                             resize_method=None, to_int=False):
   """Resizes/crops an image to match the size/scale before pre-processing"""
+  if resize_method is None:
+    resize_method = tf.image.ResizeMethod.NEAREST_NEIGHBOR
   if gray_scale:
     image = tf.reduce_mean(image, -1, keepdims=True)
 
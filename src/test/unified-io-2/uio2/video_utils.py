@@ -1,6 +1,7 @@
 """Video utils for video pre-processing"""
 import logging
 import os.path
+import re
 import subprocess
 from io import BytesIO
 import numpy
@@ -66,6 +67,48 @@ def extract_single_frame_from_video(video_file, t, verbosity=0):
   return frame
 
 
+_SHOWINFO_RE = re.compile(r"pts_time:\s*(\S+).*?\bs:(\d+)x(\d+)")
+
+
+def extract_frames_single_pass(video_file, times, timeout=None):
+  """Extract the frames at all `times` with a single ffmpeg decode
+
+  Equivalent to calling `extract_single_frame_from_video` for every time: each
+  time maps to the first frame whose timestamp is at or after it (the frame an
+  accurate `-ss` seek returns), but the video is decoded once and only the
+  selected frames leave ffmpeg.
+
+  Returns: [len(times), H, W, 3] uint8 array
+  """
+  timecodes = [float('{:.3f}'.format(t)) for t in times]
+  targets = sorted(set(timecodes))
+  # keep a frame if it is the first one to reach any of the targets
+  select = "+".join(f"gte(t,{t:.3f})*not(gte(prev_t,{t:.3f}))" for t in targets)
+  cmd = [
+    'ffmpeg', '-nostdin', '-hide_banner', '-i', str(video_file),
+    '-map', '0:v:0', '-vf', f"setpts=PTS-STARTPTS,select='{select}',showinfo",
+    '-vsync', '0', '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1',
+  ]
+  out = subprocess.run(cmd, capture_output=True, timeout=timeout)
+  if out.returncode != 0:
+    raise ValueError(f"Error on loading {video_file}", out.stderr.decode("utf-8", "ignore")[-1000:])
+
+  info = _SHOWINFO_RE.findall(out.stderr.decode("utf-8", "ignore"))
+  if len(info) == 0:
+    raise ValueError(f"Error on getting frames at times {timecodes} from {video_file}")
+  width, height = int(info[0][1]), int(info[0][2])
+  frame_times = np.array([float(x[0]) for x in info])
+  frames = np.frombuffer(out.stdout, dtype=np.uint8)
+  frames = frames[:len(info) * height * width * 3].reshape(len(info), height, width, 3)
+
+  # several times can fall on the same frame, so map every time back to its frame
+  idx = np.searchsorted(frame_times, np.array(timecodes) - 1e-6)
+  if np.any(idx >= len(frame_times)):
+    bad = [t for t, i in zip(timecodes, idx) if i >= len(frame_times)]
+    raise ValueError(f"Error on getting frame at time {bad[0]:.3f}s from {video_file}")
+  return frames[idx]
+
+
 def get_num_segments(video_length, video_segment_length):
   num_segments = int(video_length // video_segment_length)
 
@@ -80,7 +123,14 @@ def extract_frames_from_video(video_path,
                               video_length,
                               video_segment_length=None,
                               times=None,
-                              num_frames=None):
+                              num_frames=None,
+                              single_pass=True,
+                              frame_filter=None):
+  """
+  frame_filter: optional `frame_filter(decode, times, start, end, key=video_path)` that returns the
+    frames to keep (e.g. `src/utils/frame_dedup.FrameDeduplicator`), used when `times` is not
+    given; it can decode extra times within each frame's segment
+  """
   if times is None:  # automatically calculate the times if not set
 
     # make sure one and only one of video_segment_length and num_frames is None
@@ -100,7 +150,15 @@ def extract_frames_from_video(video_path,
     extract_times = times
     boundaries = None
 
-  # TODO can we do this in one call to ffmpeg?
+  if frame_filter is not None and boundaries is not None:
+    def decode(times):
+      return extract_frames_single_pass(video_path, times).astype(np.uint8)
+    return frame_filter(decode, extract_times, boundaries[0], boundaries[-1] - BUFFER_FROM_END,
+                        key=str(video_path))
+
+  if single_pass:
+    return extract_frames_single_pass(video_path, extract_times).astype(np.uint8)
+
   frames = [extract_single_frame_from_video(video_path, time) for time in extract_times]
 
   # check to see if any extraction failed
@@ -119,6 +177,7 @@ def extract_frames_and_spectrograms_from_video(
     num_frames=None,
     *,
     use_audio,
+    frame_filter=None,
 ):
   if times is None:
     # get actual video length
@@ -145,6 +204,7 @@ def extract_frames_and_spectrograms_from_video(
     video_segment_length=video_segment_length,
     times=times,
     num_frames=num_frames,
+    frame_filter=frame_filter,
   )
 
   spectrograms = None
@@ -168,6 +228,7 @@ def load_video(
     max_frames: int = 5,
     audio_segment_length: float = 4.08,
     use_audio: bool=True,
+    frame_filter=None,
 ):
   if skvideo_io is None:
     raise ValueError("Need to install skvideo to load videos")
@@ -179,6 +240,7 @@ def load_video(
     audio_segment_length=audio_segment_length,
     num_frames=max_frames,
     use_audio=use_audio,
+    frame_filter=frame_filter,
   )
   return frames, spectrograms
 
@@ -22,11 +22,12 @@ import functools
 import threading
 from typing import ClassVar, Iterable, Optional, Sequence, Union
 
-import tensorflow.compat.v2 as tf
 
 from sentencepiece import sentencepiece_model_pb2
 import sentencepiece as sentencepiece_processor
 
+from uio2.lazy_import import tf
+
 
 class SentencePieceVocabulary:
   """Wrapper for nlp/sentencepiece encoder.
@@ -146,8 +147,13 @@ class SentencePieceVocabulary:
     # sentencepiece::ModelInterface::pad_piece when using the vocabulary in
     # SeqIO preprocessors.
     with cls._load_model_lock:
-      # Handle cases where SP can't load the file, but gfile can.
-      with tf.io.gfile.GFile(sentencepiece_model_file, "rb") as f:
+      # Handle cases where SP can't load the file, but gfile can. Local files are opened
+      # directly so loading the tokenizer does not import TF.
+      if "://" in sentencepiece_model_file:
+        open_fn = tf.io.gfile.GFile
+      else:
+        open_fn = open
+      with open_fn(sentencepiece_model_file, "rb") as f:
         sp_model = f.read()
         model = sentencepiece_model_pb2.ModelProto.FromString(sp_model)
 
@@ -338,11 +344,11 @@ class SentencePieceVocabulary:
     import tensorflow_text as tf_text
     return tf_text.SentencepieceTokenizer(model=self.sp_model)
 
-  def encode_tf(self, s: tf.Tensor) -> tf.Tensor:
+  def encode_tf(self, s: "tf.Tensor") -> "tf.Tensor":
     """Tokenizes string Scalar to an int32 Tensor, without adding EOS."""
     return self._encode_tf(s)
 
-  def decode_tf(self, ids: tf.Tensor) -> tf.Tensor:
+  def decode_tf(self, ids: "tf.Tensor") -> "tf.Tensor":
     """Detokenizes int32 batched Tensor through first EOS."""
     clean_ids = ids
 
@@ -0,0 +1,138 @@
+import os
+import json
+from collections import OrderedDict
+
+
+def split_video_id(video_id):
+    """
+    "expert_interviews_101" -> ("expert_interviews", "101")
+    """
+    category, idx = video_id.rsplit("_", 1)
+    return category, idx
+
+
+class VideoEvents:
+    """
+    单个视频解析后的紧凑表示：
+    events: {event_id(str): {"start", "end", "video_caption", "audio_caption"}}，保持文件中的顺序
+    """
+    __slots__ = ("video_id", "summary", "events")
+
+    def __init__(self, video_id, summary, events):
+        self.video_id = video_id
+        self.summary = summary
+        self.events = events
+
+    def get(self, event_ids=None):
+        """按文件顺序返回指定 event_id 的事件；event_ids 为 None 时返回全部"""
+        if event_ids is None:
+            return list(self.events.values())
+        wanted = {str(eid) for eid in event_ids}
+        return [ev for eid, ev in self.events.items() if eid in wanted]
+
+
+def _compact_event(seg):
+    return {
+        "start": seg.get("start"),
+        "end": seg.get("end"),
+        "video_caption": seg.get("video_caption", "") or "",
+        "audio_caption": seg.get("audio_caption", "") or "",
+    }
+
+
+class EventIndex:
+    """
+    event_lists / caption_result 的共享加载器，每个 sample_<idx>.json 只解析一次，
+    解析结果放在容量为 maxsize 的 LRU 中。
+
+    两种数据源（二选一）：
+    - event_root: ./event_lists/<category>/sample_<idx>.json（含 events_list，score.py 使用）
+    - video_caption_root / audio_caption_root: 按 chunk_id 合并的逐段字幕（subset 的 caption baseline 使用），
+      可以只给其中一个
+    """
+
+    def __init__(self, event_root=None, video_caption_root=None, audio_caption_root=None, maxsize=256):
+        if event_root is None and video_caption_root is None and audio_caption_root is None:
+            raise ValueError("EventIndex 需要 event_root 或至少一个 caption root")
+        if event_root is not None and (video_caption_root is not None or audio_caption_root is not None):
+            raise ValueError("event_root 与 caption root 不能同时指定")
+        self.event_root = event_root
+        self.video_caption_root = video_caption_root
+        self.audio_caption_root = audio_caption_root
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # ------------------------
+    # 解析
+    # ------------------------
+    def _read_json(self, root, video_id):
+        category, idx = split_video_id(video_id)
+        path = os.path.join(root, category, f"sample_{idx}.json")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _parse_event_list(self, video_id):
+        data = self._read_json(self.event_root, video_id)
+        events = OrderedDict()
+        for ev in data.get("events_list", []):
+            events[str(ev.get("event_id"))] = _compact_event(ev)
+        return VideoEvents(data.get("video_id", video_id), data.get("summary", ""), events)
+
+    def _parse_captions(self, video_id):
+        events = OrderedDict()
+        for root, key in ((self.video_caption_root, "video_caption"),
+                          (self.audio_caption_root, "audio_caption")):
+            if root is None:
+                continue
+            for seg in self._read_json(root, video_id):
+                if not isinstance(seg, dict):
+                    continue
+                if seg.get("chunk_id") is None:
+                    # 编造序号可能与真实 chunk_id 撞车，把不相关的视频/音频字幕合并到一起
+                    print(f"⚠️ {video_id} 的 {key} 中有缺少 chunk_id 的片段，已跳过")
+                    continue
+                eid = str(seg["chunk_id"])
+                ev = events.get(eid)
+                if ev is None:
+                    ev = events[eid] = _compact_event(seg)
+                ev[key] = seg.get(key, "") or ""
+        return VideoEvents(video_id, "", events)
+
+    # ------------------------
+    # 对外接口
+    # ------------------------
+    def load(self, video_id):
+        """返回 VideoEvents，命中缓存时不再读文件"""
+        entry = self._cache.get(video_id)
+        if entry is not None:
+            self._cache.move_to_end(video_id)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        if self.event_root is not None:
+            entry = self._parse_event_list(video_id)
+        else:
+            entry = self._parse_captions(video_id)
+        self._cache[video_id] = entry
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return entry
+
+    def get_events(self, video_id, event_ids=None):
+        """[{"start", "end", "video_caption", "audio_caption"}, ...]，按文件顺序"""
+        return self.load(video_id).get(event_ids)
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "maxsize": self.maxsize}
+
+
+def concat_captions(events, key):
+    """
+    拼接 events 中所有 key（video_caption / audio_caption）文本，过滤空白
+    """
+    captions = [ev.get(key, "") for ev in events]
+    captions = [c.strip() for c in captions if c and c.strip()]
+    return " ".join(captions)
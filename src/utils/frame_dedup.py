@@ -0,0 +1,261 @@
+"""
+感知哈希去重帧：在视觉编码器之前去掉近重复帧。
+
+讲座、软件教程、TED 等视频有大段几乎不变的画面，均匀采样的 32~128 帧里很多帧与前一帧几乎相同，
+却都要过一遍 ViT。这里对解码出的 uint8 帧计算 64 位 dHash（灰度缩到 8x9 后比较相邻像素），
+与上一个保留帧的汉明距离不超过 threshold 的帧视为近重复：
+  - 能按位置继续解码时（select），先在该帧所在的采样区间内另取 candidates-1 个候选帧，
+    用其中与上一保留帧差异最大且不重复的一帧替换它；
+  - 区间内都是重复画面（或只有已解码的帧，filter）时直接丢弃。
+每个视频保留/替换了哪些帧记录在 records 中，stats() 汇总帧数与按 vit_flops 估算的视觉编码器 FLOPs 节省。
+
+用法:
+    dedup = FrameDeduplicator(threshold=6, candidates=2, flops_per_frame=VISION_FLOPS_PER_FRAME["videollama2"])
+    frames = dedup(lambda idx: vr.get_batch(idx).asnumpy(), frame_idx, 0, len(vr) - 1, key=video_path)
+    ...
+    print(dedup.stats()); dedup.dump("./experiment/xxx/frame_dedup.json")
+
+不加载模型、只统计一批视频的去重比例和 FLOPs 节省（按 FineVideo 类别汇总）:
+    python -m src.utils.frame_dedup ./datasets/finevideo/videos/academic_lectures/*.mp4 --frames 32 128
+"""
+import os
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+def vit_flops(num_patches, hidden_size, num_layers, mlp_size=None):
+    """一帧过 ViT 的前向 FLOPs 估算：每层 QKV/输出投影 4d²、MLP 2·d·mlp、注意力 2N²d 次乘加"""
+    mlp_size = mlp_size or 4 * hidden_size
+    macs = num_layers * (num_patches * (4 * hidden_size ** 2 + 2 * hidden_size * mlp_size)
+                         + 2 * num_patches ** 2 * hidden_size)
+    return 2 * macs
+
+
+# 各评测模型视觉编码器每帧 FLOPs 的估算（Qwen2.5-Omni 随分辨率变化，这里按 448x252、每 2 帧一组 patch）
+VISION_FLOPS_PER_FRAME = {
+    "videollama2": vit_flops(577, 1024, 24),              # CLIP ViT-L/14-336
+    "videollama3": vit_flops(27 * 27, 1152, 27, 4304),    # SigLIP so400m/14，按 384x384 估算
+    "ola": vit_flops(30 * 17, 1152, 27, 4304),            # Oryx-ViT/16，VIDEO_MAXRES=480
+    "qwen2.5omni": vit_flops(32 * 18, 1280, 32, 3420 * 3 // 2) // 2,
+    "uio2": vit_flops(257, 768, 11, 3072),                # image history ViT-B/16，256x256
+}
+
+
+def frame_hashes(frames, hash_size=8):
+    """frames: [T, H, W, 3] 数组 -> [T, hash_size² / 8] uint8，每帧一个 dHash"""
+    frames = np.asarray(frames)
+    # 先隔行隔列取样再转灰度，哈希只看 8x9 的块均值，不需要全分辨率
+    step = max(1, min(frames.shape[1], frames.shape[2]) // (8 * hash_size))
+    small = frames[:, ::step, ::step].astype(np.float32)
+    gray = small[..., 0] * 0.299 + small[..., 1] * 0.587 + small[..., 2] * 0.114
+    # 块均值缩放到 hash_size x (hash_size + 1)
+    height, width = gray.shape[1:]
+    rows = np.linspace(0, height, hash_size + 1).astype(int)[:-1]
+    cols = np.linspace(0, width, hash_size + 2).astype(int)[:-1]
+    blocks = np.add.reduceat(np.add.reduceat(gray, rows, axis=1), cols, axis=2)
+    counts = np.outer(np.diff(np.append(rows, height)), np.diff(np.append(cols, width)))
+    blocks = blocks / counts
+    bits = blocks[:, :, 1:] > blocks[:, :, :-1]
+    return np.packbits(bits.reshape(len(frames), -1), axis=1)
+
+
+def hamming(a, b):
+    """两组哈希逐行的汉明距离（可广播）"""
+    return np.unpackbits(np.bitwise_xor(a, b), axis=-1).sum(-1)
+
+
+@dataclass
+class DedupResult:
+    frames: np.ndarray                            # 保留下来的帧 [K, H, W, 3]
+    positions: list                               # 每个保留帧的解码位置（帧号或秒）
+    kept: list                                    # 保留帧对应原采样序列中的下标
+    replaced: list = field(default_factory=list)  # 被区间内候选帧替换的采样下标
+    decoded: int = 0                              # 实际解码的帧数（含候选帧）
+
+
+class FrameDeduplicator:
+    """
+    threshold:       汉明距离不超过该值（64 位中）视为近重复
+    candidates:      每个采样区间的候选帧数（含原采样帧），1 表示只丢弃不替换
+    min_frames:      至少保留的帧数，不足时按与上一保留帧的差异从大到小补回
+    multiple_of:     保留帧数对齐到该倍数（如 Qwen 的时间 patch 为 2），不足时同样补回
+    flops_per_frame: 每帧视觉编码器 FLOPs，stats() 用它估算节省量
+    """
+
+    def __init__(self, threshold=6, candidates=1, min_frames=1, multiple_of=1, flops_per_frame=None, hash_size=8):
+        self.threshold = threshold
+        self.candidates = candidates
+        self.min_frames = min_frames
+        self.multiple_of = multiple_of
+        self.flops_per_frame = flops_per_frame
+        self.hash_size = hash_size
+        self.records = {}
+
+    def __call__(self, decode, positions, start, end, key=None):
+        return self.select(decode, positions, start, end, key=key).frames
+
+    def select(self, decode, positions, start, end, key=None, flops_per_frame=None):
+        """
+        decode(positions) -> [n, H, W, 3] uint8：按帧号（int）或时间（float）解码
+        positions:        均匀采样的位置；第 i 帧的采样区间为与相邻采样点的中点之间，两端到 start / end
+        flops_per_frame:  该视频每帧的视觉编码器 FLOPs（分辨率随视频变化时），默认用构造时的值
+        """
+        positions = list(positions)
+        frames = np.asarray(decode(positions))
+        hashes = frame_hashes(frames, self.hash_size)
+        candidates = [[(i, positions[i])] for i in range(len(positions))]
+        decoded = len(positions)
+
+        choice = self._assign(candidates, hashes)
+        duplicates = [i for i, c in enumerate(choice) if c is None]
+        if self.candidates > 1 and duplicates:
+            extra = []
+            for i in duplicates:
+                for position in self._segment_candidates(positions, i, start, end):
+                    candidates[i].append((len(positions) + len(extra), position))
+                    extra.append(position)
+            if extra:
+                extra_frames = np.asarray(decode(extra))
+                frames = np.concatenate([frames, extra_frames])
+                hashes = np.concatenate([hashes, frame_hashes(extra_frames, self.hash_size)])
+                decoded += len(extra)
+                choice = self._assign(candidates, hashes)
+
+        rows = [c for c in choice if c is not None]
+        kept = [i for i, c in enumerate(choice) if c is not None]
+        result = DedupResult(
+            frames=frames[rows],
+            positions=[self._position_of(candidates[i], row) for i, row in zip(kept, rows)],
+            kept=kept,
+            replaced=[i for i, row in zip(kept, rows) if row != i],
+            decoded=decoded,
+        )
+        self._record(key, len(positions), result, flops_per_frame)
+        return result
+
+    def filter(self, frames, key=None, flops_per_frame=None):
+        """只对已解码好的帧去重（不能再取候选帧），frames: [T, H, W, 3]"""
+        frames = np.asarray(frames)
+        candidates = [[(i, i)] for i in range(len(frames))]
+        choice = self._assign(candidates, frame_hashes(frames, self.hash_size))
+        kept = [i for i, c in enumerate(choice) if c is not None]
+        result = DedupResult(frames=frames[kept], positions=kept, kept=kept, decoded=len(frames))
+        self._record(key, len(frames), result, flops_per_frame)
+        return result
+
+    def _assign(self, candidates, hashes):
+        """按时间顺序为每个采样区间选一帧（hashes 的行号），重复区间为 None"""
+        choice, last, dropped = [], None, {}
+        for i, segment in enumerate(candidates):
+            rows = [row for row, _ in segment]
+            if last is None:
+                choice.append(rows[0])
+                last = hashes[rows[0]]
+                continue
+            distances = hamming(hashes[rows], last)
+            # 原采样帧不重复时优先保留它，否则取区间内差异最大的候选帧
+            best = 0 if distances[0] > self.threshold else int(np.argmax(distances))
+            if distances[best] > self.threshold:
+                choice.append(rows[best])
+                last = hashes[rows[best]]
+            else:
+                choice.append(None)
+                dropped[i] = int(distances[0])
+
+        target = max(self.min_frames, sum(c is not None for c in choice))
+        target = min(-(-target // self.multiple_of) * self.multiple_of, len(choice))
+        # 保留帧太少时，把差异最大的重复帧补回（用原采样帧）
+        for i in sorted(dropped, key=lambda i: -dropped[i])[:target - sum(c is not None for c in choice)]:
+            choice[i] = candidates[i][0][0]
+        return choice
+
+    def _segment_candidates(self, positions, i, start, end):
+        lo = start if i == 0 else (positions[i - 1] + positions[i]) / 2
+        hi = end if i == len(positions) - 1 else (positions[i] + positions[i + 1]) / 2
+        # 区间等分为 candidates 份，取原采样帧所在份以外各份的中点（原帧落在分界上时算作前一份，候选帧偏后）
+        n = self.candidates
+        width = (hi - lo) / n
+        own = min(max(int(np.ceil((positions[i] - lo) / width)) - 1, 0), n - 1) if width > 0 else 0
+        out = [lo + (j + 0.5) * width for j in range(n) if j != own]
+        if all(isinstance(p, (int, np.integer)) for p in positions):
+            out = sorted({int(round(p)) for p in out} - {positions[i]})
+        return out
+
+    @staticmethod
+    def _position_of(segment, row):
+        return next(position for r, position in segment if r == row)
+
+    def _record(self, key, total, result, flops_per_frame=None):
+        if key is None:
+            key = f"#{len(self.records)}"
+        self.records[key] = {
+            "total": total,
+            "flops_per_frame": flops_per_frame or self.flops_per_frame,
+            "kept": result.kept,
+            "replaced": result.replaced,
+            "positions": [float(p) if isinstance(p, (float, np.floating)) else int(p) for p in result.positions],
+        }
+
+    def stats(self):
+        total = sum(r["total"] for r in self.records.values())
+        kept = sum(len(r["kept"]) for r in self.records.values())
+        out = {
+            "videos": len(self.records),
+            "frames": total,
+            "kept": kept,
+            "replaced": sum(len(r["replaced"]) for r in self.records.values()),
+            "dropped_ratio": round(1 - kept / total, 4) if total else 0.0,
+        }
+        if any(r["flops_per_frame"] for r in self.records.values()):
+            flops = [(r["total"], len(r["kept"]), r["flops_per_frame"] or 0) for r in self.records.values()]
+            out["vision_tflops_saved"] = round(sum((t - k) * f for t, k, f in flops) / 1e12, 2)
+            out["vision_tflops_total"] = round(sum(t * f for t, _, f in flops) / 1e12, 2)
+        return out
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"stats": self.stats(), "videos": self.records}, f, ensure_ascii=False, indent=2)
+
+
+def from_env(prefix="FRAME_DEDUP", **kwargs):
+    """
+    按环境变量构造去重器，{prefix}=1 时启用，否则返回 None：
+    {prefix}_THRESHOLD（默认 6）、{prefix}_CANDIDATES（默认 2）；其余参数（flops_per_frame 等）由调用方给出
+    """
+    if os.environ.get(prefix, "0") != "1":
+        return None
+    kwargs.setdefault("threshold", int(os.environ.get(f"{prefix}_THRESHOLD", "6")))
+    kwargs.setdefault("candidates", int(os.environ.get(f"{prefix}_CANDIDATES", "2")))
+    return FrameDeduplicator(**kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+    from collections import defaultdict
+
+    from decord import VideoReader, cpu
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--frames", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--threshold", type=int, default=6)
+    parser.add_argument("--candidates", type=int, default=2)
+    args = parser.parse_args()
+
+    for num_frames in args.frames:
+        by_category = defaultdict(lambda: FrameDeduplicator(args.threshold, args.candidates))
+        for path in args.videos:
+            vr = VideoReader(path, ctx=cpu(0))
+            frame_idx = np.linspace(0, len(vr) - 1, num_frames, dtype=int).tolist()
+            category = os.path.basename(os.path.dirname(path))
+            by_category[category].select(lambda idx: vr.get_batch(idx).asnumpy(), frame_idx, 0, len(vr) - 1,
+                                         key=path)
+        for category, dedup in by_category.items():
+            st = dedup.stats()
+            saved = ", ".join(f"{name} {(st['frames'] - st['kept']) * flops / 1e12:.1f}"
+                              for name, flops in VISION_FLOPS_PER_FRAME.items())
+            print(f"{num_frames} 帧 [{category}] {st['videos']} 个视频: 保留 {st['kept']}/{st['frames']} 帧"
+                  f"（去掉 {st['dropped_ratio']:.1%}，替换 {st['replaced']}），节省视觉 TFLOPs: {saved}")
@@ -0,0 +1,368 @@
+"""
+OpenAI Batch API 作业模式：把大量互不依赖、不要求时延的请求写成 batch 格式 jsonl，
+提交、轮询，再把结果取回，由调用方写回原来的逐样本输出格式。
+
+作业目录结构（可断点续跑，重复运行只会提交还没有结果的请求）：
+    <job_dir>/state.json           各分片的 file_id / batch_id / 状态
+    <job_dir>/input_00000.jsonl    提交的请求分片
+    <job_dir>/output_00000.jsonl   取回的结果
+
+后端：
+- OpenAIBatchBackend: 真实 Batch API
+- LocalBatchBackend:  本地文件模拟，用 mock server 相同的规则生成回复，无需联网即可跑通整个流程
+"""
+import os
+import json
+import time
+import shutil
+import uuid
+
+from src.utils.llm_cache import make_key
+
+TERMINAL_STATUS = {"completed", "failed", "expired", "cancelled"}
+
+
+class OpenAIBatchBackend:
+    def __init__(self):
+        from openai import OpenAI
+        self.client = OpenAI()
+
+    def upload(self, path):
+        with open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, file_id, endpoint):
+        return self.client.batches.create(
+            input_file_id=file_id, endpoint=endpoint, completion_window="24h"
+        ).id
+
+    def retrieve(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+        }
+
+    def download(self, file_id, path):
+        content = self.client.files.content(file_id)
+        with open(path, "wb") as f:
+            f.write(content.read())
+
+
+class LocalBatchBackend:
+    """
+    本地替身：upload 把文件拷进 root/files，create 记录一个 batch，
+    第一次 retrieve 时按 mock server 的规则（canned responses / 按 schema 生成）逐行生成输出。
+    """
+
+    def __init__(self, root, responses=None):
+        from src.utils.mock_llm_server import MockState
+        self.root = root
+        self.state = MockState(responses)
+        os.makedirs(os.path.join(root, "files"), exist_ok=True)
+        os.makedirs(os.path.join(root, "batches"), exist_ok=True)
+
+    def _file(self, file_id):
+        return os.path.join(self.root, "files", file_id)
+
+    def _batch(self, batch_id):
+        return os.path.join(self.root, "batches", f"{batch_id}.json")
+
+    def upload(self, path):
+        file_id = f"file-local-{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(path, self._file(file_id))
+        return file_id
+
+    def create(self, file_id, endpoint):
+        batch_id = f"batch-local-{uuid.uuid4().hex[:12]}"
+        with open(self._batch(batch_id), "w", encoding="utf-8") as f:
+            json.dump({"input_file_id": file_id, "endpoint": endpoint, "status": "validating",
+                       "output_file_id": None, "error_file_id": None}, f)
+        return batch_id
+
+    def _process(self, batch):
+        from src.utils.mock_llm_server import _openai_schema
+        output_file_id = f"file-local-{uuid.uuid4().hex[:12]}"
+        with open(self._file(batch["input_file_id"]), "r", encoding="utf-8") as fin, \
+                open(self._file(output_file_id), "w", encoding="utf-8") as fout:
+            for line in fin:
+                if not line.strip():
+                    continue
+                req = json.loads(line)
+                body = req["body"]
+                text = self.state.reply_text(body, _openai_schema(body))
+                fout.write(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": req["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "request_id": uuid.uuid4().hex,
+                        "body": {
+                            "object": "chat.completion",
+                            "model": body.get("model"),
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": text}}],
+                            "usage": {},
+                        },
+                    },
+                    "error": None,
+                }, ensure_ascii=False) + "\n")
+        batch["status"] = "completed"
+        batch["output_file_id"] = output_file_id
+
+    def retrieve(self, batch_id):
+        with open(self._batch(batch_id), "r", encoding="utf-8") as f:
+            batch = json.load(f)
+        if batch["status"] not in TERMINAL_STATUS:
+            self._process(batch)
+            with open(self._batch(batch_id), "w", encoding="utf-8") as f:
+                json.dump(batch, f)
+        return {k: batch[k] for k in ("status", "output_file_id", "error_file_id")}
+
+    def download(self, file_id, path):
+        shutil.copyfile(self._file(file_id), path)
+
+
+def make_backend(name, job_dir):
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend(os.path.join(job_dir, "local_backend"))
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+def _parse_output_line(item):
+    """batch 输出的一行 -> (custom_id, text 或 None, usage)"""
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        return item["custom_id"], None, {}
+    body = response.get("body") or {}
+    try:
+        text = body["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return item["custom_id"], None, {}
+    return item["custom_id"], text, body.get("usage") or {}
+
+
+class BatchJob:
+    """
+    用法:
+        job = BatchJob("./batch_jobs/score/3audio_visual_alignment", backend="openai")
+        results = job.run({custom_id: {"model": ..., "messages": [...], ...}, ...})
+        # results: {custom_id: text}，只包含已成功的请求；失败的会在下次 run 时重新提交
+        # 写回时解析失败的结果用 job.discard(ids, requests) 丢弃，下次 run 时重新提交
+    """
+
+    def __init__(self, job_dir, backend="openai", endpoint="/v1/chat/completions",
+                 max_requests_per_shard=50000, max_bytes_per_shard=190 * 1024 ** 2,
+                 poll_interval=60, cache=None):
+        self.job_dir = job_dir
+        self.endpoint = endpoint
+        # Batch API 单个输入文件最多 50000 个请求、200 MB，留一点余量
+        self.max_requests_per_shard = max_requests_per_shard
+        self.max_bytes_per_shard = max_bytes_per_shard
+        self.poll_interval = poll_interval
+        self.cache = cache
+        os.makedirs(job_dir, exist_ok=True)
+        self.backend = make_backend(backend, job_dir) if isinstance(backend, str) else backend
+        self.state_path = os.path.join(job_dir, "state.json")
+        self.state = self._load_state()
+
+    # ------------------------
+    # 状态文件
+    # ------------------------
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"shards": []}
+
+    def _save_state(self):
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    # ------------------------
+    # 结果
+    # ------------------------
+    def _shard_keys(self, shard):
+        """分片中提交的请求 {custom_id: 请求体的内容 key}"""
+        keys = {}
+        with open(shard["input_path"], "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    req = json.loads(line)
+                    keys[req["custom_id"]] = self._cache_key(req["body"])
+        return keys
+
+    def collected_results(self, requests=None, verbose=True):
+        """
+        已下载分片中成功的结果 {custom_id: (text, usage)}
+        传入 requests 时只保留提交时请求体与当前一致的结果；prompt 等改过的请求视为没有结果，会重新提交
+        """
+        results = {}
+        stale = set()
+        for shard in self.state["shards"]:
+            path = shard.get("output_path")
+            if not path or not os.path.exists(path):
+                continue
+            submitted = self._shard_keys(shard) if requests is not None else None
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        custom_id, text, usage = _parse_output_line(json.loads(line))
+                        if text is None:
+                            continue
+                        if submitted is not None:
+                            if custom_id not in requests:
+                                continue
+                            if submitted.get(custom_id) != self._cache_key(requests[custom_id]):
+                                stale.add(custom_id)
+                                continue
+                        results[custom_id] = (text, usage)
+        # 较新的分片里可能已有按新请求体得到的结果
+        stale -= results.keys()
+        if stale and verbose:
+            print(f"♻️ {len(stale)} 个已有结果对应的请求内容已改变，忽略并重新提交")
+        return results
+
+    def discard(self, custom_ids, requests=None):
+        """
+        丢弃已取回、但调用方无法使用的结果（如 json 被截断），下次 run 时会重新提交。
+        传入 requests（run 的参数）时同时删除这些请求的缓存。
+        """
+        custom_ids = set(custom_ids)
+        if not custom_ids:
+            return
+        for shard in self.state["shards"]:
+            path = shard.get("output_path")
+            if not path or not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                lines = [line for line in f if line.strip() and json.loads(line)["custom_id"] not in custom_ids]
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(tmp, path)
+        if self.cache is not None and requests is not None:
+            for custom_id in custom_ids:
+                if custom_id in requests:
+                    self.cache.delete(self._cache_key(requests[custom_id]))
+
+    def _cache_key(self, body):
+        return make_key(provider="openai", **body)
+
+    # ------------------------
+    # 提交 / 轮询
+    # ------------------------
+    def _write_shards(self, requests, ids):
+        shard_lines, shard_bytes = [], 0
+        for custom_id in ids:
+            line = (json.dumps({"custom_id": custom_id, "method": "POST",
+                                "url": self.endpoint, "body": requests[custom_id]},
+                               ensure_ascii=False) + "\n").encode("utf-8")
+            if shard_lines and (len(shard_lines) >= self.max_requests_per_shard
+                                or shard_bytes + len(line) > self.max_bytes_per_shard):
+                self._add_shard(shard_lines)
+                shard_lines, shard_bytes = [], 0
+            shard_lines.append(line)
+            shard_bytes += len(line)
+        if shard_lines:
+            self._add_shard(shard_lines)
+
+    def _add_shard(self, lines):
+        n = len(self.state["shards"])
+        input_path = os.path.join(self.job_dir, f"input_{n:05d}.jsonl")
+        with open(input_path, "wb") as f:
+            f.writelines(lines)
+        self.state["shards"].append({"input_path": input_path, "file_id": None, "batch_id": None,
+                                     "status": "pending", "output_path": None})
+        self._save_state()
+
+    def _submit(self):
+        for shard in self.state["shards"]:
+            if shard["batch_id"] is not None:
+                continue
+            # 先记录 file_id，崩溃后重跑不会重复上传
+            if shard["file_id"] is None:
+                shard["file_id"] = self.backend.upload(shard["input_path"])
+                self._save_state()
+            shard["batch_id"] = self.backend.create(shard["file_id"], self.endpoint)
+            shard["status"] = "submitted"
+            self._save_state()
+            print(f"📤 已提交 {shard['input_path']} -> {shard['batch_id']}")
+
+    def _poll(self):
+        while True:
+            waiting = 0
+            for i, shard in enumerate(self.state["shards"]):
+                if shard["status"] in TERMINAL_STATUS and shard.get("output_path") is not None:
+                    continue
+                info = self.backend.retrieve(shard["batch_id"])
+                shard["status"] = info["status"]
+                if info["status"] in TERMINAL_STATUS:
+                    # expired 的 batch 也可能有部分结果
+                    if info.get("output_file_id"):
+                        output_path = os.path.join(self.job_dir, f"output_{i:05d}.jsonl")
+                        self.backend.download(info["output_file_id"], output_path)
+                        shard["output_path"] = output_path
+                    else:
+                        shard["output_path"] = ""
+                    print(f"📥 {shard['batch_id']} 状态 {info['status']}")
+                else:
+                    waiting += 1
+                self._save_state()
+            if waiting == 0:
+                return
+            print(f"⏳ 还有 {waiting} 个 batch 未完成，{self.poll_interval}s 后再查询")
+            time.sleep(self.poll_interval)
+
+    def run(self, requests):
+        """
+        requests: {custom_id: chat.completions 请求体}
+        返回 {custom_id: text}，只包含成功的请求
+        """
+        results = {}
+        collected = self.collected_results(requests)
+
+        # 缓存里已有的请求不再提交
+        pending = {}
+        for custom_id, body in requests.items():
+            if custom_id in collected:
+                results[custom_id] = collected[custom_id][0]
+                continue
+            if self.cache is not None:
+                value = self.cache.get(self._cache_key(body))
+                if value is not None:
+                    results[custom_id] = value["text"]
+                    continue
+            pending[custom_id] = body
+
+        # 只给既没有结果、也不在未完成分片里（且请求体相同）的请求写新分片
+        in_flight = set()
+        for shard in self.state["shards"]:
+            if shard["status"] not in TERMINAL_STATUS:
+                in_flight.update(cid for cid, key in self._shard_keys(shard).items()
+                                 if cid in pending and key == self._cache_key(pending[cid]))
+        new_ids = [cid for cid in pending if cid not in in_flight]
+        if new_ids:
+            self._write_shards(pending, new_ids)
+        print(f"🧾 共 {len(requests)} 个请求：已有结果 {len(results)}，新提交 {len(new_ids)}，"
+              f"等待中 {len(pending) - len(new_ids)}")
+
+        self._submit()
+        self._poll()
+
+        collected = self.collected_results(requests, verbose=False)
+        for custom_id in pending:
+            if custom_id in collected:
+                text, usage = collected[custom_id]
+                results[custom_id] = text
+                if self.cache is not None:
+                    self.cache.put(self._cache_key(pending[custom_id]), {"text": text, "usage": usage})
+        failed = len(requests) - len(results)
+        if failed:
+            print(f"⚠️ {failed} 个请求没有成功结果，重新运行会再次提交")
+        return results
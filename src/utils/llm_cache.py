@@ -0,0 +1,136 @@
+"""
+LLM 响应的内容寻址磁盘缓存。
+
+key = sha256(provider, model, messages/contents, schema, temperature 及其它请求参数)，
+音视频 bytes 只以其 sha256 参与 key。缓存文件按 key 前缀分片存放：
+    <root>/<key[:2]>/<key[2:4]>/<key>.json
+总大小超过 max_bytes 时按最近访问时间淘汰到 90%。
+
+配置（环境变量）：
+    LLM_CACHE_DIR    缓存目录，默认 ./llm_cache；设为 off / none / 空字符串 关闭缓存
+    LLM_CACHE_MAX_GB 缓存上限，默认 5
+"""
+import os
+import json
+import hashlib
+import inspect
+
+
+def _canonical(obj):
+    """把请求参数转换成可稳定序列化的结构"""
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (bytes, bytearray)):
+        return {"__bytes_sha256__": hashlib.sha256(obj).hexdigest()}
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    # pydantic 类（如 Gemini 的 response_schema=Recipe）取其 json schema
+    if inspect.isclass(obj) and hasattr(obj, "model_json_schema"):
+        return {"__schema__": obj.model_json_schema()}
+    # pydantic 实例（如 google.genai.types.Part）
+    if hasattr(obj, "model_dump"):
+        return _canonical(obj.model_dump(exclude_none=True))
+    return repr(obj)
+
+
+def make_key(**parts):
+    payload = json.dumps(_canonical(parts), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, root, max_bytes=5 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        root = os.getenv("LLM_CACHE_DIR", "./llm_cache")
+        if not root or root.lower() in ("off", "none", "0"):
+            return None
+        max_gb = float(os.getenv("LLM_CACHE_MAX_GB", 5))
+        return cls(root, int(max_gb * 1024 ** 3))
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)  # 更新访问时间，供 LRU 淘汰使用
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        self.writes += 1
+
+        if self._total_bytes is None:
+            self._total_bytes = self._scan_size()
+        else:
+            self._total_bytes += size
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        else:
+            self._total_bytes = None  # 下次写入时重新统计
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".json"):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """按最近访问时间从旧到新删除，直到总大小降到上限的 90%"""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions}
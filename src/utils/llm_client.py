@@ -0,0 +1,321 @@
+"""
+OpenAI / Azure OpenAI / Gemini 的共享异步调用层：
+- 有界并发（asyncio.Semaphore）
+- 每分钟请求数 / token 数限速（令牌桶）
+- 带抖动的指数退避重试（429 / 5xx / 超时 / 连接错误）
+
+并发与限速可以通过环境变量统一配置：
+    LLM_MAX_CONCURRENCY (默认 32), LLM_RPM, LLM_TPM, LLM_MAX_RETRIES (默认 6)
+
+相同请求的响应会写入磁盘缓存（见 llm_cache.py，LLM_CACHE_DIR / LLM_CACHE_MAX_GB），重跑时直接命中。
+
+离线测试时先启动本地 mock server（见 mock_llm_server.py），再设置
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1
+    LLM_BASE_URL=http://127.0.0.1:8000
+"""
+import os
+import time
+import random
+import asyncio
+from dataclasses import dataclass, field, asdict
+
+from tqdm import tqdm
+
+from src.utils.llm_cache import ResponseCache, make_key
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    usage: dict = field(default_factory=dict)
+
+
+class RateLimiter:
+    """每分钟 per_minute 个单位的令牌桶，per_minute 为 None 时不限速"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute) if per_minute else None
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0 if self.capacity else None
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        if self.capacity is None:
+            return
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def estimate_tokens(payload):
+    """粗略估算请求的 token 数（约 4 字符 / token），只统计文本，忽略音视频 bytes"""
+    if isinstance(payload, str):
+        return len(payload) // 4 + 1
+    if isinstance(payload, (bytes, bytearray)):
+        return 0
+    if isinstance(payload, dict):
+        return sum(estimate_tokens(v) for k, v in payload.items() if k not in ("data", "inline_data"))
+    if isinstance(payload, (list, tuple)):
+        return sum(estimate_tokens(v) for v in payload)
+    text = getattr(payload, "text", None)
+    if isinstance(text, str):
+        return len(text) // 4 + 1
+    parts = getattr(payload, "parts", None)
+    if parts:
+        return estimate_tokens(parts)
+    return 0
+
+
+def _status_code(exc):
+    for attr in ("status_code", "code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _is_retryable(exc):
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError, TimeoutError)):
+        return True
+    name = type(exc).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_valid(resp, validate):
+    if validate is None:
+        return True
+    try:
+        validate(resp.text)
+    except Exception:
+        return False
+    return True
+
+
+class AsyncLLMClient:
+    """
+    用法:
+        llm = AsyncLLMClient("openai")
+        resp = await llm.chat_completion(model="gpt-4o", messages=[...], response_format={...})
+        resp.text
+
+        llm = AsyncLLMClient("gemini")
+        resp = await llm.generate_content(model="gemini-2.5-flash", contents=[...], config={...})
+
+        # Azure OpenAI：model 传部署名；base_url / api_key 默认读 AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_KEY
+        llm = AsyncLLMClient("azure", base_url=endpoint, api_key=key, api_version="2024-08-01-preview")
+    """
+
+    def __init__(self, provider="openai", max_concurrency=None, rpm=None, tpm=None,
+                 max_retries=None, base_delay=1.0, max_delay=60.0, timeout=600.0,
+                 base_url=None, api_key=None, api_version=None, cache=True):
+        if provider not in ("openai", "azure", "gemini"):
+            raise ValueError(f"Unknown provider: {provider}")
+        self.provider = provider
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", 6))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.request_limiter = RateLimiter(rpm or os.getenv("LLM_RPM"))
+        self.token_limiter = RateLimiter(tpm or os.getenv("LLM_TPM"))
+        self.base_url = base_url
+        self.api_key = api_key
+        self.api_version = api_version
+        # cache: True 按环境变量创建，False 关闭，也可以直接传入 ResponseCache
+        if cache is True:
+            cache = ResponseCache.from_env()
+        self.cache = cache or None
+        self._semaphore = None
+        self._client = None
+        self._loop = None
+        self._inflight = {}
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+
+    # ------------------------
+    # 底层 SDK 客户端（延迟创建，只导入用到的 provider）
+    # ------------------------
+    def _bind_loop(self):
+        # 脚本可能对每个任务分别 asyncio.run，SDK 的连接池、Semaphore、Lock 都绑定在事件循环上，换循环时重建
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._client = None
+            self._semaphore = None
+            self._inflight = {}
+            self.request_limiter._lock = asyncio.Lock()
+            self.token_limiter._lock = asyncio.Lock()
+
+    def _get_client(self):
+        self._bind_loop()
+        if self._client is not None:
+            return self._client
+        if self.provider == "openai":
+            from openai import AsyncOpenAI
+            # 重试由本层负责，关闭 SDK 自带重试避免叠加
+            self._client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+        elif self.provider == "azure":
+            from openai import AsyncAzureOpenAI
+            self._client = AsyncAzureOpenAI(
+                azure_endpoint=self.base_url or os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_key=self.api_key or os.getenv("AZURE_OPENAI_KEY"),
+                api_version=self.api_version or os.getenv("OPENAI_API_VERSION", "2024-08-01-preview"),
+                max_retries=0,
+            )
+        else:
+            from google import genai
+            from google.genai import types
+            self._client = genai.Client(
+                api_key=self.api_key or os.getenv('LLM_API_KEY'),
+                http_options=types.HttpOptions(base_url=self.base_url or os.getenv('LLM_BASE_URL'))
+            )
+        return self._client
+
+    def _get_semaphore(self):
+        # Semaphore 要在事件循环里创建
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _call_with_retry(self, make_call, est_tokens):
+        attempt = 0
+        while True:
+            await self.request_limiter.acquire(1)
+            await self.token_limiter.acquire(est_tokens)
+            try:
+                async with self._get_semaphore():
+                    self.stats["requests"] += 1
+                    return await asyncio.wait_for(make_call(), timeout=self.timeout)
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    self.stats["failures"] += 1
+                    raise
+                # full jitter: [0, min(max_delay, base * 2^attempt)]，服务端给了 Retry-After 时作为下限
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                delay = max(delay, _retry_after(e) or 0.0)
+                attempt += 1
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def _cached_call(self, key_parts, make_call, est_tokens, validate=None):
+        if self.cache is None:
+            return await self._call_with_retry(make_call, est_tokens)
+        key = make_key(provider=self.provider, **key_parts)
+        value = self.cache.get(key)
+        if value is not None:
+            resp = LLMResponse(**value)
+            if _is_valid(resp, validate):
+                return resp
+            # 之前缓存了调用方无法使用的回复（如 json 被截断），删掉重新请求
+            self.cache.delete(key)
+        # 并发中的相同请求只发一次，其余等待同一个结果
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            resp = await self._call_with_retry(make_call, est_tokens)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 标记已读取，避免没有等待者时的告警
+            raise
+        else:
+            future.set_result(resp)
+        finally:
+            self._inflight.pop(key, None)
+        # 只缓存通过 validate 的回复，否则重跑时会一直拿到同一个坏结果
+        if resp.text is not None and _is_valid(resp, validate):
+            self.cache.put(key, asdict(resp))
+        return resp
+
+    # ------------------------
+    # 对外接口
+    # ------------------------
+    async def chat_completion(self, model, messages, validate=None, **kwargs):
+        """
+        OpenAI / Azure OpenAI chat.completions.create 的异步封装，返回 LLMResponse
+        validate(text): 可选，抛异常表示回复不可用（如 json 解析失败），这样的回复不写入缓存
+        """
+        client = self._get_client()
+
+        async def make_call():
+            resp = await client.chat.completions.create(model=model, messages=messages, **kwargs)
+            usage = resp.usage.model_dump() if getattr(resp, "usage", None) is not None else {}
+            return LLMResponse(resp.choices[0].message.content, usage)
+
+        key_parts = {"model": model, "messages": messages, **kwargs}
+        return await self._cached_call(key_parts, make_call, estimate_tokens(messages), validate)
+
+    async def generate_content(self, model, contents, config=None, validate=None):
+        """Gemini models.generate_content 的异步封装，返回 LLMResponse；validate 同 chat_completion"""
+        client = self._get_client()
+
+        async def make_call():
+            resp = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+            meta = getattr(resp, "usage_metadata", None)
+            usage = {}
+            if meta is not None:
+                usage = {
+                    "prompt_tokens": meta.prompt_token_count,
+                    "completion_tokens": meta.candidates_token_count,
+                    "total_tokens": meta.total_token_count,
+                }
+            return LLMResponse(resp.text, usage)
+
+        key_parts = {"model": model, "contents": contents, "config": config}
+        return await self._cached_call(key_parts, make_call, estimate_tokens(contents), validate)
+
+    async def run_all(self, worker, items, desc=None):
+        """
+        对 items 中每一项执行 async worker(item)，最多 max_concurrency 个同时进行。
+        单项失败只打印错误并跳过（下次运行会被断点续跑重新处理），返回失败项列表。
+        """
+        gate = asyncio.Semaphore(self.max_concurrency)
+        failed = []
+        bar = tqdm(total=len(items), desc=desc)
+
+        async def guarded(item):
+            async with gate:
+                try:
+                    await worker(item)
+                except Exception as e:
+                    print(f"⚠️ 处理失败，跳过: {e!r}")
+                    failed.append(item)
+                finally:
+                    bar.update(1)
+
+        await asyncio.gather(*(guarded(item) for item in items))
+        bar.close()
+        return failed
+
+    def report(self):
+        report = dict(self.stats)
+        if self.cache is not None:
+            report["cache"] = self.cache.stats()
+        return report
+
@@ -0,0 +1,226 @@
+"""
+本地 mock LLM server，用于离线跑通各阶段脚本和并发/重试逻辑。
+
+支持:
+- OpenAI:  POST /v1/chat/completions
+- Gemini:  POST /<version>/models/<model>:generateContent
+
+回复内容:
+- --responses 指定的 jsonl，每行 {"match": "<子串>", "response": <str 或 json>}，
+  按顺序匹配请求中的文本，命中则回放该条
+- 否则若请求带 json schema（OpenAI response_format / Gemini responseSchema），按 schema 生成一个最小合法 json
+- 否则返回 --default-text
+
+用法:
+    python -m src.utils.mock_llm_server --port 8000 --latency 0.2 --error-rate 0.05
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8000/v1 \
+    LLM_API_KEY=mock LLM_BASE_URL=http://127.0.0.1:8000 python -m src.qa_check_and_filter.score
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def synth_from_schema(schema):
+    """按 json schema 生成最小合法实例（OpenAI 小写类型 / Gemini 大写类型都支持）"""
+    if not isinstance(schema, dict):
+        return "mock"
+    if schema.get("enum"):
+        return schema["enum"][0]
+    kind = str(schema.get("type", "object")).lower()
+    if kind == "object":
+        props = schema.get("properties", {})
+        return {k: synth_from_schema(v) for k, v in props.items()}
+    if kind == "array":
+        return [synth_from_schema(schema.get("items", {"type": "string"}))]
+    if kind == "number":
+        return schema.get("maximum", 1.0)
+    if kind == "integer":
+        return int(schema.get("maximum", 1))
+    if kind == "boolean":
+        return True
+    # 选项类字段（model_answer 等）给 "A" 便于下游解析
+    return "A"
+
+
+def _request_text(body):
+    """把请求里所有文本拼起来，用于匹配 canned responses"""
+    texts = []
+
+    def walk(node):
+        if isinstance(node, str):
+            texts.append(node)
+        elif isinstance(node, dict):
+            for k, v in node.items():
+                if k not in ("data", "inlineData", "inline_data", "image_url"):
+                    walk(v)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v)
+
+    walk(body.get("messages", body.get("contents", [])))
+    return "\n".join(texts)
+
+
+class MockState:
+    def __init__(self, responses=None, default_text="mock response", latency=0.0, error_rate=0.0):
+        self.responses = responses or []
+        self.default_text = default_text
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0}
+
+    def reply_text(self, body, schema):
+        text = _request_text(body)
+        for item in self.responses:
+            if item.get("match", "") in text:
+                resp = item["response"]
+                return resp if isinstance(resp, str) else json.dumps(resp, ensure_ascii=False)
+        if schema is not None:
+            return json.dumps(synth_from_schema(schema), ensure_ascii=False)
+        return self.default_text
+
+
+def _openai_schema(body):
+    fmt = body.get("response_format") or {}
+    if fmt.get("type") == "json_schema":
+        return fmt.get("json_schema", {}).get("schema", {})
+    if fmt.get("type") == "json_object":
+        return {}
+    return None
+
+
+def _gemini_schema(body):
+    cfg = body.get("generationConfig") or {}
+    schema = cfg.get("responseSchema") or cfg.get("responseJsonSchema")
+    if schema is None and cfg.get("responseMimeType") == "application/json":
+        return {}
+    return schema
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if code == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b"{}"
+        return json.loads(raw or b"{}")
+
+    def do_POST(self):
+        state = self.state
+        body = self._read_body()
+        with state.lock:
+            state.counts["requests"] += 1
+        if state.latency:
+            time.sleep(state.latency)
+        if state.error_rate and random.random() < state.error_rate:
+            with state.lock:
+                state.counts["errors"] += 1
+            return self._send(429, {"error": {"message": "mock rate limit", "code": 429, "status": "RESOURCE_EXHAUSTED"}})
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            text = state.reply_text(body, _openai_schema(body))
+            prompt_tokens = len(_request_text(body)) // 4 + 1
+            completion_tokens = len(text) // 4 + 1
+            return self._send(200, {
+                "id": f"chatcmpl-mock-{state.counts['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+
+        if re.search(r"/models/[^/]+:generateContent$", self.path.split("?")[0]):
+            text = state.reply_text(body, _gemini_schema(body))
+            prompt_tokens = len(_request_text(body)) // 4 + 1
+            completion_tokens = len(text) // 4 + 1
+            return self._send(200, {
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "STOP",
+                    "index": 0,
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": completion_tokens,
+                    "totalTokenCount": prompt_tokens + completion_tokens,
+                },
+            })
+
+        return self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    # 默认 backlog 只有 5，32-64 并发时会出现连接被拒
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def load_responses(path):
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_server(host="127.0.0.1", port=8000, state=None):
+    """返回 (server, state)；port=0 时随机分配端口，测试时用 server.server_address[1] 取实际端口"""
+    state = state or MockState()
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    return MockHTTPServer((host, port), handler), state
+
+
+def serve_in_background(**kwargs):
+    """在后台线程启动 mock server，返回 (server, base_url)"""
+    server, _ = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--responses", default=None, help="canned responses jsonl")
+    parser.add_argument("--default-text", default="mock response")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 429 的概率，用于测试重试")
+    args = parser.parse_args()
+
+    state = MockState(load_responses(args.responses), args.default_text, args.latency, args.error_rate)
+    server, _ = make_server(args.host, args.port, state)
+    print(f"🧪 mock LLM server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"requests={state.counts['requests']}, injected errors={state.counts['errors']}")
@@ -0,0 +1,100 @@
+"""
+多模态前缀 KV cache：同一视频的多个问题共用 "系统提示 + 音视频 token" 这段前缀。
+
+把 user 消息里的视频放到问题文本之前后，最后一个媒体 token 之前的部分只依赖视频本身。
+每个视频对这段前缀 prefill 一次并保存 KV cache，之后每个问题 deepcopy 一份 cache，
+只需对问题文本及 assistant 起始 token 做 prefill 再解码，
+~128 帧 + 音频的 prefill 从每题一次变成每个视频一次。
+
+用法（配合 src/utils/video_scheduler.py 按视频分组）:
+    prefix_cache = PrefixKVCache(model.thinker, media_token_ids, forward_kwargs={"use_audio_in_video": True})
+    output_ids = prefix_cache.generate(inputs, max_new_tokens=2048)
+"""
+import copy
+
+import torch
+from transformers import GenerationMixin
+
+
+def media_prefix_length(input_ids, media_token_ids):
+    """最后一个媒体 token 之后的位置，即可共享前缀的长度（input_ids: [1, L]）"""
+    ids = input_ids[0]
+    is_media = torch.zeros_like(ids, dtype=torch.bool)
+    for token_id in media_token_ids:
+        is_media |= ids == token_id
+    positions = is_media.nonzero()
+    if len(positions) == 0:
+        raise ValueError("input_ids 中没有媒体 token，无法确定共享前缀")
+    return int(positions[-1]) + 1
+
+
+class PrefixKVCache:
+    """
+    model:           直接做前向/生成的语言模型（Qwen2.5-Omni 为 model.thinker）
+    media_token_ids: 视频/音频占位 token 以及它们的起止 token
+    forward_kwargs:  prefill 与 generate 都要传的额外参数（如 use_audio_in_video）
+    embed_inputs:    模型自定义的 generate 会重新编码媒体时（VideoLLaMA3），
+                     改为把 input_ids 的词向量作为 inputs_embeds 交给 GenerationMixin.generate，
+                     前缀部分由 KV cache 提供，不再经过视觉编码器
+    """
+
+    def __init__(self, model, media_token_ids, forward_kwargs=None, embed_inputs=False):
+        self.model = model
+        self.media_token_ids = list(media_token_ids)
+        self.forward_kwargs = forward_kwargs or {}
+        self.embed_inputs = embed_inputs
+        self.prefix_ids = None
+        self.past_key_values = None
+        self.rope_deltas = None
+        self.prefills = 0
+        self.reuses = 0
+
+    def matches(self, input_ids):
+        if self.prefix_ids is None:
+            return False
+        n = self.prefix_ids.shape[1]
+        return input_ids.shape[1] > n and torch.equal(input_ids[:, :n], self.prefix_ids)
+
+    @torch.inference_mode()
+    def prefill(self, inputs):
+        """inputs: 完整的 processor 输出（含媒体张量），只对前缀部分做前向"""
+        n = media_prefix_length(inputs["input_ids"], self.media_token_ids)
+        prefix = dict(inputs)
+        prefix["input_ids"] = inputs["input_ids"][:, :n]
+        prefix["attention_mask"] = inputs["attention_mask"][:, :n]
+        # 释放上一个视频的 cache 再 prefill，避免两份同时占显存
+        self.past_key_values = None
+        out = self.model(**prefix, **self.forward_kwargs, use_cache=True)
+        self.prefix_ids = prefix["input_ids"].clone()
+        self.past_key_values = out.past_key_values
+        # Qwen 系列的 M-RoPE 在 prefill 时计算 rope_deltas，之后的文本位置依赖它
+        self.rope_deltas = getattr(self.model, "rope_deltas", None)
+        self.prefills += 1
+
+    def fork(self):
+        return copy.deepcopy(self.past_key_values)
+
+    @torch.inference_mode()
+    def generate(self, inputs, **gen_kwargs):
+        """前缀与缓存一致时复用 KV cache，否则先为新视频 prefill"""
+        if self.matches(inputs["input_ids"]):
+            self.reuses += 1
+        else:
+            self.prefill(inputs)
+        past_key_values = self.fork()
+        if self.rope_deltas is not None:
+            self.model.rope_deltas = self.rope_deltas
+
+        if self.embed_inputs:
+            inputs_embeds = self.model.get_input_embeddings()(inputs["input_ids"])
+            return GenerationMixin.generate(
+                self.model,
+                inputs_embeds=inputs_embeds,
+                attention_mask=inputs["attention_mask"],
+                past_key_values=past_key_values,
+                **gen_kwargs,
+            )
+        return self.model.generate(**inputs, **self.forward_kwargs, past_key_values=past_key_values, **gen_kwargs)
+
+    def stats(self):
+        return {"prefills": self.prefills, "reuses": self.reuses}
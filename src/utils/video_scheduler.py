@@ -0,0 +1,147 @@
+"""
+按视频分组调度 src/test 下各模型的评测。
+
+六个任务文件里有大量问题共用同一个 related_videoID，逐题推理会把同一个视频反复解码、
+重采样、预处理。这里一次读入全部任务文件，把还没有答案的问题按视频分组：
+每个视频只调用一次 prepare(video_path) 得到抽帧/音频等预处理结果，
+再对它的所有问题调用 answer(media, qa)，然后才处理下一个视频。
+结果仍按任务分别写回原来的 {question_id: {...}} 输出文件，断点续跑方式不变。
+
+用法:
+    scheduler = VideoGroupScheduler(TASKS, "./final_qa_subset/{task}.json",
+                                    "./experiment/xxx/{task}.json", VIDEO_ROOT)
+    scheduler.run(prepare=load_media, answer=lambda media, qa: infer(media, qa))
+"""
+import os
+import json
+import time
+from collections import OrderedDict
+
+from tqdm import tqdm
+
+
+def video_path_of(video_root, video_id):
+    """'<category>_<idx>' -> <video_root>/<category>/sample_<idx>.mp4"""
+    category, idx = video_id.rsplit("_", 1)
+    return os.path.join(video_root, category, f"sample_{idx}.mp4")
+
+
+class VideoGroupScheduler:
+    def __init__(self, tasks, input_pattern, output_pattern, video_root):
+        self._setup(
+            {task: input_pattern.format(task=task) for task in tasks},
+            {task: output_pattern.format(task=task) for task in tasks},
+            video_root,
+        )
+
+    @classmethod
+    def from_files(cls, files, video_root):
+        """files: {name: (input_file, output_file)}，输入/输出路径不按统一模板命名时使用"""
+        self = cls.__new__(cls)
+        self._setup({k: v[0] for k, v in files.items()}, {k: v[1] for k, v in files.items()}, video_root)
+        return self
+
+    def _setup(self, input_files, output_files, video_root):
+        self.tasks = list(input_files)
+        self.video_root = video_root
+        self.input_files = input_files
+        self.output_files = output_files
+        self.results = {}
+        for task, path in self.output_files.items():
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self.results[task] = json.load(f)
+            else:
+                self.results[task] = {}
+
+    def pending_groups(self):
+        """
+        返回 OrderedDict: video_id -> [(task, qa), ...]，只包含还没有结果的问题。
+        视频按其在任务列表中第一次出现的顺序排列。
+        """
+        groups = OrderedDict()
+        for task in self.tasks:
+            with open(self.input_files[task], "r", encoding="utf-8") as f:
+                qa_data = json.load(f)
+            for qa in qa_data:
+                if qa["question_id"] in self.results[task]:
+                    continue
+                groups.setdefault(qa["related_videoID"], []).append((task, qa))
+        return groups
+
+    def save(self, task, qa, answer):
+        qid = qa["question_id"]
+        record = {
+            "question_id": qid,
+            "question": qa["question"],
+            "options": qa.get("options", ""),
+            "video_id": qa["related_videoID"],
+        }
+        # answer 可以是 str，也可以是含 model_answer 及其它附加字段（如选项分数）的 dict
+        if isinstance(answer, dict):
+            record.update(answer)
+        else:
+            record["model_answer"] = answer
+        self.results[task][qid] = record
+        with open(self.output_files[task], "w", encoding="utf-8") as f:
+            json.dump(self.results[task], f, ensure_ascii=False, indent=2)
+
+    def run(self, prepare, answer, desc="Videos"):
+        """
+        prepare(video_path) -> media：每个视频调用一次
+        answer(media, qa) -> str 或 dict：该视频的每个问题调用一次
+        返回本次运行的计时统计
+        """
+        groups = self.pending_groups()
+        n_questions = sum(len(v) for v in groups.values())
+        print(f"📋 {len(self.tasks)} 个任务共 {n_questions} 个待回答问题，涉及 {len(groups)} 个视频")
+
+        stats = new_stats()
+        for video_id, items in tqdm(groups.items(), desc=desc):
+            self.run_group(video_id, items, prepare, answer, stats)
+        self.summary(stats)
+        return stats
+
+    def run_group(self, video_id, items, prepare, answer, stats):
+        """处理 pending_groups() 中的一个视频：prepare 一次，回答它的全部问题，计时累加到 stats"""
+        try:
+            video_path = video_path_of(self.video_root, video_id)
+        except Exception as e:
+            print(f"⚠️ 无法解析 videoID: {video_id}, 跳过。异常: {e}")
+            return
+
+        if not os.path.exists(video_path):
+            print(f"⚠️ 视频不存在: {video_path}")
+            return
+
+        start = time.perf_counter()
+        try:
+            media = prepare(video_path)
+        except Exception as e:
+            print(f"⚠️ 视频预处理失败: {video_id}, 异常: {e}")
+            return
+        stats["prepare_time"] += time.perf_counter() - start
+        stats["videos"] += 1
+
+        for task, qa in items:
+            start = time.perf_counter()
+            try:
+                output = answer(media, qa)
+            except Exception as e:
+                print(f"⚠️ 推理失败: {task}/{qa['question_id']}, 异常: {e}")
+                continue
+            stats["answer_time"] += time.perf_counter() - start
+            stats["questions"] += 1
+            self.save(task, qa, output)
+        del media
+
+    def summary(self, stats):
+        print(f"⏱️ 视频预处理 {stats['prepare_time']:.1f}s（{stats['videos']} 个视频），"
+              f"问答 {stats['answer_time']:.1f}s（{stats['questions']} 个问题）")
+        for task in self.tasks:
+            print(f"✅ {task}: {len(self.results[task])} 条结果，已保存到 {self.output_files[task]}")
+
+
+def new_stats():
+    return {"videos": 0, "questions": 0, "prepare_time": 0.0, "answer_time": 0.0}